@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Startup and per-request cost of the dashboard aggregates, before and after
+taking pandas off the request path.
+
+    python benchmarks/bench_pandas_removal.py --rows 100000 --iterations 200
+
+The "pandas" numbers replay the original read_sql_query implementation of
+calculate_nutritional_stats / get_meal_distribution / get_mineral_intake /
+get_macronutrient_distribution; they are skipped if pandas is not installed.
+
+One run (Python 3.11, pandas 3.0.6, numpy 2.4.6; medians):
+
+    rows      pandas+numpy import   app import   legacy refresh   snapshot
+    20,000    471 ms                317 ms       158 ms           0.025 ms
+    100,000   469 ms                329 ms       807 ms           0.042 ms
+
+"app import" no longer loads pandas or numpy at all.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def time_import(statement, db_path, repeat=5):
+    """
+    Median wall time of `statement` in a fresh interpreter, in milliseconds.
+    """
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"{statement}; "
+        "print((time.perf_counter() - t) * 1000)"
+    )
+    # Keep any inherited PYTHONPATH: pandas may be installed outside site-packages
+    path = os.pathsep.join(p for p in (SRC, os.environ.get('PYTHONPATH')) if p)
+    env = dict(os.environ, NUTRILENS_DB=db_path, PYTHONPATH=path)
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', code], cwd=SRC, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def populate(db_path, rows):
+    import db
+    import migrations
+
+    db.configure(db_path)
+    migrations.migrate()
+    rng = random.Random(42)
+    meal_types = ['Breakfast', 'Lunch', 'Dinner', 'Snacks']
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO food_items (name, calories, protein, carbs, fat, fiber, iron, calcium, "
+            "magnesium, zinc, potassium, benefits, drawbacks, alternatives, timestamp) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((f"food {i}", rng.randint(10, 900), rng.uniform(0, 50), rng.uniform(0, 120),
+              rng.uniform(0, 60), rng.uniform(0, 15), rng.uniform(0, 10), rng.uniform(0, 400),
+              rng.uniform(0, 150), rng.uniform(0, 8), rng.uniform(0, 900),
+              "benefits", "drawbacks", "alternatives",
+              f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00")
+             for i in range(rows)))
+        conn.executemany(
+            "INSERT INTO meal_logs (food_id, meal_type, timestamp) VALUES (?, ?, ?)",
+            ((rng.randint(1, rows), rng.choice(meal_types), "2025-01-01 12:00:00")
+             for _ in range(rows)))
+
+
+def legacy_pandas_refresh(conn, pd):
+    # The pre-rewrite aggregate path: four read_sql_query calls per refresh
+    df = pd.read_sql_query("SELECT * FROM food_items", conn)
+    stats = {k: df[k].sum() for k in ('calories', 'protein', 'carbs', 'fat', 'fiber')}
+    meals = pd.read_sql_query("""
+        SELECT meal_type, SUM(f.calories) as total_calories
+        FROM meal_logs m JOIN food_items f ON m.food_id = f.id
+        GROUP BY meal_type""", conn)
+    calories = [0] * 4
+    for i, meal_type in enumerate(['Breakfast', 'Lunch', 'Dinner', 'Snacks']):
+        if meal_type in meals['meal_type'].values:
+            calories[i] = meals[meals['meal_type'] == meal_type]['total_calories'].iloc[0]
+    minerals = pd.read_sql_query("""
+        SELECT AVG(iron) as iron, AVG(calcium) as calcium, AVG(magnesium) as magnesium,
+               AVG(zinc) as zinc, AVG(potassium) as potassium FROM food_items""", conn)
+    macros = pd.read_sql_query("""
+        SELECT SUM(protein) as total_protein, SUM(carbs) as total_carbs,
+               SUM(fat) as total_fat FROM food_items""", conn)
+    return stats, calories, minerals['iron'].iloc[0], macros['total_fat'].iloc[0]
+
+
+def per_request(iterations, fn):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'mean_ms': sum(samples) / len(samples),
+        'p50_ms': samples[len(samples) // 2],
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, SRC)
+    results = {'rows': args.rows, 'startup_ms': {}, 'refresh': {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        populate(db_path, args.rows)
+
+        results['startup_ms'] = {
+            'pandas_numpy_import': time_import("import pandas, numpy", db_path),
+            'dashboard_modules': time_import(
+                "import db, snapshot, foods, deltas, migrations", db_path),
+            'app': time_import("import app", db_path),
+        }
+
+        import db
+        from snapshot import compute_snapshot
+
+        results['refresh']['snapshot'] = per_request(args.iterations, compute_snapshot)
+        try:
+            import pandas as pd
+        except ImportError:
+            results['refresh']['legacy_pandas'] = None
+        else:
+            with db.connection() as conn:
+                results['refresh']['legacy_pandas'] = per_request(
+                    args.iterations, lambda: legacy_pandas_refresh(conn, pd))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
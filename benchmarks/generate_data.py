@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Fill a NutriLens database with realistic synthetic foods and meal logs.
+
+    python benchmarks/generate_data.py --foods 1000000 --db /tmp/bench.db
+
+Foods are drawn from a catalogue of common dishes with portion-size and
+nutrient noise, timestamped around breakfast, lunch, dinner and snack
+times over --days days (weekends slightly busier). About --meal-ratio meal
+logs are written per food, mostly for the meal the food was eaten at.
+
+By default the write triggers are dropped during the load and the rollups
+rebuilt once at the end, which is what makes 10M rows practical; pass
+--with-triggers to measure the incremental path instead.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# name, calories, protein, carbs, fat, fiber, iron, calcium, magnesium, zinc, potassium
+CATALOGUE = [
+    ("Peanut Butter Sandwich", 350, 15, 42, 16, 4, 2.1, 60, 70, 1.5, 180),
+    ("Chicken and Rice Bowl", 520, 35, 65, 12, 3, 1.8, 40, 60, 2.4, 320),
+    ("Greek Yogurt with Berries", 180, 15, 22, 4, 3, 0.3, 200, 25, 0.8, 280),
+    ("Oatmeal with Banana", 300, 9, 54, 5, 7, 2.5, 45, 90, 2.0, 520),
+    ("Scrambled Eggs on Toast", 380, 20, 30, 19, 2, 2.6, 110, 30, 1.9, 220),
+    ("Caesar Salad", 330, 10, 14, 27, 3, 1.4, 150, 35, 1.0, 350),
+    ("Salmon with Quinoa", 560, 40, 45, 22, 5, 2.8, 60, 120, 2.9, 900),
+    ("Beef Burrito", 650, 30, 72, 26, 8, 4.5, 180, 80, 4.8, 700),
+    ("Margherita Pizza Slice", 285, 12, 36, 10, 2, 2.5, 190, 25, 1.4, 170),
+    ("Lentil Soup", 230, 14, 36, 3, 12, 4.0, 50, 60, 1.9, 640),
+    ("Apple", 95, 0.5, 25, 0.3, 4, 0.2, 11, 9, 0.1, 195),
+    ("Banana", 105, 1.3, 27, 0.4, 3, 0.3, 6, 32, 0.2, 420),
+    ("Almonds", 165, 6, 6, 14, 3.5, 1.1, 75, 77, 0.9, 200),
+    ("Protein Bar", 210, 20, 23, 7, 3, 2.0, 150, 40, 2.5, 160),
+    ("Vegetable Stir Fry", 310, 9, 40, 13, 6, 2.2, 90, 55, 1.2, 610),
+    ("Turkey Sandwich", 420, 28, 44, 14, 5, 3.0, 120, 50, 2.6, 400),
+    ("Spaghetti Bolognese", 610, 29, 74, 21, 6, 4.2, 90, 85, 4.5, 780),
+    ("Tofu Curry with Rice", 540, 22, 70, 18, 6, 5.5, 350, 110, 2.8, 560),
+    ("Avocado Toast", 290, 7, 30, 17, 9, 1.9, 40, 45, 1.0, 600),
+    ("Smoothie Bowl", 340, 8, 62, 8, 9, 1.6, 180, 70, 1.1, 750),
+    ("Cheeseburger", 540, 30, 40, 29, 2, 4.8, 200, 45, 5.1, 450),
+    ("Sushi Roll", 300, 12, 50, 6, 2, 1.0, 30, 35, 1.3, 260),
+    ("Dark Chocolate", 170, 2, 13, 12, 3, 3.4, 20, 65, 0.9, 200),
+    ("Hummus with Carrots", 200, 6, 22, 10, 7, 1.8, 60, 50, 1.2, 480),
+    ("Grilled Chicken Salad", 360, 38, 12, 18, 4, 2.0, 90, 70, 2.2, 700),
+]
+
+PORTIONS = (("small", 0.7), (None, 1.0), ("large", 1.4))
+
+# meal, weight, hour window
+MEAL_SLOTS = (
+    ('Breakfast', 0.28, (6, 10)),
+    ('Lunch', 0.30, (11, 14)),
+    ('Dinner', 0.30, (17, 21)),
+    ('Snacks', 0.12, (9, 23)),
+)
+
+BENEFITS = "Good source of protein; Provides sustained energy"
+DRAWBACKS = "Can be high in sodium depending on preparation"
+ALTERNATIVES = "Whole-grain version; Smaller portion"
+
+
+def noisy(rng, value, spread=0.15):
+    return max(0.0, value * rng.uniform(1 - spread, 1 + spread))
+
+
+def food_rows(rng, count, start_id, start_day, days):
+    """
+    Yield (food row, meal_type, datetime) with explicit ids, so meal logs
+    can reference them without a lookup.
+    """
+    meals = [m for m, _, _ in MEAL_SLOTS]
+    weights = [w for _, w, _ in MEAL_SLOTS]
+    windows = {m: hours for m, _, hours in MEAL_SLOTS}
+    for i in range(count):
+        base = rng.choice(CATALOGUE)
+        label, scale = rng.choice(PORTIONS)
+        # Log-normal-ish portion spread around the named size
+        scale *= math.exp(rng.gauss(0, 0.12))
+        meal = rng.choices(meals, weights)[0]
+        day = start_day + timedelta(days=rng.randrange(days))
+        if day.weekday() >= 5 and rng.random() < 0.2:
+            # Weekends log an extra snack now and then
+            meal = 'Snacks'
+        low, high = windows[meal]
+        moment = day + timedelta(hours=rng.randint(low, high - 1), minutes=rng.randrange(60),
+                                 seconds=rng.randrange(60))
+        name = f"{base[0]} ({label})" if label else base[0]
+        row = (
+            start_id + i, name, round(base[1] * scale),
+            *(round(noisy(rng, v * scale), 2) for v in base[2:6]),
+            *(round(noisy(rng, v * scale, 0.25), 2) for v in base[6:]),
+            BENEFITS, DRAWBACKS, ALTERNATIVES,
+            moment.strftime('%Y-%m-%d %H:%M:%S'),
+        )
+        yield row, meal, moment
+
+
+FOOD_INSERT = """
+    INSERT INTO food_items (id, name, calories, protein, carbs, fat, fiber,
+                            iron, calcium, magnesium, zinc, potassium,
+                            benefits, drawbacks, alternatives, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+MEAL_INSERT = "INSERT INTO meal_logs (food_id, meal_type, timestamp) VALUES (?, ?, ?)"
+
+WRITE_TRIGGERS_QUERY = """
+    SELECT name FROM sqlite_master
+    WHERE type = 'trigger' AND tbl_name IN ('food_items', 'meal_logs')
+"""
+
+
+def drop_write_triggers(conn):
+    names = [row[0] for row in conn.execute(WRITE_TRIGGERS_QUERY)]
+    for name in names:
+        conn.execute(f'DROP TRIGGER "{name}"')
+    return names
+
+
+def restore_write_triggers(conn):
+    """
+    Recreate every trigger on food_items/meal_logs and rebuild what they
+    maintain. The change log is not backfilled: connected clients see a
+    cursor gap and reload.
+    """
+    from deltas import create_change_log
+    from generation import create_generation_counter
+    from rollups import create_bucket_rollups, create_rollups, rebuild_rollups
+    from search import create_search_index, rebuild_search_index
+
+    create_rollups(conn)
+    rebuild_rollups(conn)
+    create_bucket_rollups(conn)
+    create_change_log(conn)
+    create_generation_counter(conn)
+    create_search_index(conn)
+    rebuild_search_index(conn)
+    conn.execute("UPDATE data_generation SET value = value + 1 WHERE id = 1")
+
+
+def generate(db_path, foods, meal_ratio=1.5, days=365, seed=42, batch_size=50000,
+             with_triggers=False, end=None, progress=None):
+    """
+    Append `foods` synthetic foods and about foods * meal_ratio meal logs.
+    Returns counts and timings.
+    """
+    if SRC not in sys.path:
+        sys.path.insert(0, SRC)
+    import db
+    import migrations
+
+    db.configure(db_path)
+    migrations.migrate()
+    rng = random.Random(seed)
+    end = end or datetime(2025, 4, 6)
+    start_day = (end - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    with db.connection() as conn:
+        start_id = (conn.execute("SELECT MAX(id) FROM food_items").fetchone()[0] or 0) + 1
+
+    started = time.perf_counter()
+    dropped = []
+    if not with_triggers:
+        with db.transaction() as conn:
+            dropped = drop_write_triggers(conn)
+
+    meals_written = 0
+    try:
+        rows = food_rows(rng, foods, start_id, start_day, days)
+        written = 0
+        while written < foods:
+            chunk = [next(rows) for _ in range(min(batch_size, foods - written))]
+            logs = []
+            for row, meal, moment in chunk:
+                # Poisson-ish: whole part always, fraction by chance
+                for _ in range(int(meal_ratio) + (rng.random() < meal_ratio % 1)):
+                    logged = moment + timedelta(minutes=rng.randrange(30))
+                    logs.append((row[0], meal if rng.random() < 0.9 else rng.choice(MEAL_SLOTS)[0],
+                                 logged.strftime('%Y-%m-%d %H:%M:%S')))
+            with db.transaction() as conn:
+                conn.executemany(FOOD_INSERT, (row for row, _, _ in chunk))
+                conn.executemany(MEAL_INSERT, logs)
+            written += len(chunk)
+            meals_written += len(logs)
+            if progress:
+                progress(written, foods)
+    finally:
+        if dropped:
+            rebuild_started = time.perf_counter()
+            with db.transaction() as conn:
+                restore_write_triggers(conn)
+            rebuild_seconds = time.perf_counter() - rebuild_started
+        else:
+            rebuild_seconds = 0.0
+
+    with db.connection() as conn:
+        # Fresh statistics for the planner after a large load
+        conn.execute("ANALYZE")
+    elapsed = time.perf_counter() - started
+    return {
+        'foods': foods,
+        'meal_logs': meals_written,
+        'seconds': round(elapsed, 3),
+        'rebuild_seconds': round(rebuild_seconds, 3),
+        'rows_per_second': round((foods + meals_written) / elapsed) if elapsed > 0 else 0,
+        'with_triggers': with_triggers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', default=os.environ.get('NUTRILENS_DB', 'food_analysis.db'))
+    parser.add_argument('--foods', type=int, default=10000)
+    parser.add_argument('--meal-ratio', type=float, default=1.5, help="meal logs per food")
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=50000)
+    parser.add_argument('--with-triggers', action='store_true',
+                        help="keep the write triggers on (slower, exercises incremental rollups)")
+    args = parser.parse_args()
+
+    def progress(done, total):
+        print(f"\r{done}/{total} foods", end='', file=sys.stderr, flush=True)
+
+    result = generate(args.db, args.foods, args.meal_ratio, args.days, args.seed,
+                      args.batch_size, args.with_triggers, progress=progress)
+    print(file=sys.stderr)
+    print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Find how many idle dashboard sockets one server process can hold.
+
+    NUTRILENS_ASYNC_MODE=eventlet python src/app.py &
+    python benchmarks/load_sockets.py --url http://localhost:8080 --max-clients 10000 \\
+        --server-pid $!
+
+Connections are opened in steps of --step. After each step a sample of the
+open sockets sends refresh_data and the round trip to update_data is timed.
+The ceiling is the last step where every connection succeeded (within
+--max-failure-rate) and the refresh p99 stayed under --max-latency-ms.
+
+Needs python-socketio's asyncio client (pip install "python-socketio[asyncio_client]").
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def percentiles(samples):
+    if not samples:
+        return {'p50_ms': None, 'p99_ms': None}
+    samples = sorted(samples)
+    return {
+        'p50_ms': samples[len(samples) // 2],
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
+
+
+def server_usage(pid):
+    """
+    Resident memory and open descriptors of the server, from /proc.
+    """
+    if pid is None:
+        return None
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    usage['rss_kb'] = int(line.split()[1])
+        usage['open_fds'] = len(os.listdir(f'/proc/{pid}/fd'))
+    except OSError:
+        return None
+    return usage
+
+
+class DashboardClient:
+    def __init__(self, socketio, url, user):
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.url = url
+        self.user = user
+        self._waiter = None
+        self.sio.on('update_data', self._on_update)
+
+    async def _on_update(self, data):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(data)
+
+    async def connect(self, timeout):
+        await self.sio.connect(self.url, transports=['websocket'],
+                               auth={'user': self.user}, wait_timeout=timeout)
+
+    async def refresh(self, timeout):
+        self._waiter = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        await self.sio.emit('refresh_data', {})
+        await asyncio.wait_for(self._waiter, timeout)
+        return (time.perf_counter() - start) * 1000
+
+    async def close(self):
+        try:
+            await self.sio.disconnect()
+        except Exception:
+            pass
+
+
+async def open_clients(socketio, args, count, users):
+    slots = asyncio.Semaphore(args.concurrency)
+    clients, failures, latencies = [], 0, []
+
+    async def one():
+        nonlocal failures
+        client = DashboardClient(socketio, args.url, random.choice(users))
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await client.connect(args.timeout)
+            except Exception:
+                failures += 1
+                return
+            latencies.append((time.perf_counter() - start) * 1000)
+        clients.append(client)
+
+    await asyncio.gather(*(one() for _ in range(count)))
+    return clients, failures, latencies
+
+
+async def sample_refresh(clients, args):
+    sample = random.sample(clients, min(args.sample, len(clients)))
+    results = await asyncio.gather(*(c.refresh(args.timeout) for c in sample),
+                                   return_exceptions=True)
+    latencies = [r for r in results if isinstance(r, float)]
+    return latencies, len(results) - len(latencies)
+
+
+async def run(args):
+    import socketio
+
+    users = [None] if args.users == 0 else [f"load{i}" for i in range(args.users)]
+    clients, steps, ceiling = [], [], 0
+    try:
+        while len(clients) < args.max_clients:
+            count = min(args.step, args.max_clients - len(clients))
+            opened, failures, connect_ms = await open_clients(socketio, args, count, users)
+            clients.extend(opened)
+            await asyncio.sleep(args.settle)
+            refresh_ms, refresh_failures = await sample_refresh(clients, args)
+
+            step = {
+                'attempted': count,
+                'connected': len(clients),
+                'connect_failures': failures,
+                'connect': percentiles(connect_ms),
+                'refresh': percentiles(refresh_ms),
+                'refresh_failures': refresh_failures,
+                'server': server_usage(args.server_pid),
+            }
+            steps.append(step)
+            print(json.dumps(step), file=sys.stderr)
+
+            p99 = step['refresh']['p99_ms']
+            healthy = (failures <= count * args.max_failure_rate and not refresh_failures
+                       and p99 is not None and p99 <= args.max_latency_ms)
+            if not healthy:
+                break
+            ceiling = len(clients)
+    finally:
+        await asyncio.gather(*(c.close() for c in clients))
+    return {'url': args.url, 'ceiling': ceiling, 'steps': steps}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--max-clients', type=int, default=5000)
+    parser.add_argument('--step', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=100, help="connects in flight at once")
+    parser.add_argument('--users', type=int, default=0,
+                        help="spread sockets over this many users (0: shared database)")
+    parser.add_argument('--sample', type=int, default=50, help="sockets refreshed per step")
+    parser.add_argument('--settle', type=float, default=1.0, help="seconds idle after each step")
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--max-latency-ms', type=float, default=500.0)
+    parser.add_argument('--max-failure-rate', type=float, default=0.0)
+    parser.add_argument('--server-pid', type=int)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, SRC)
+    from workers import raise_fd_limit
+
+    # The load generator needs one descriptor per socket too
+    raise_fd_limit()
+    results = asyncio.run(run(args))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Benchmark the dashboard backend at several database sizes.
+
+    python benchmarks/run_benchmarks.py --rows 10000 1000000 --output results.json
+    python benchmarks/run_benchmarks.py --rows 10000 --compare results.json
+
+For each size a synthetic database is generated (see generate_data.py), then:
+
+  aggregates   per-call latency of every aggregate / query function
+  endpoints    /api/* latency and throughput over real HTTP at each
+               --concurrency level, both cache-warm and cache-busting
+  fanout       refresh_data cost with --clients simulated sockets: the
+               initial per-client replies, one broadcast after a write, and
+               the per-client replies it replaces
+  payloads     update_data size and encode / decode time per wire encoding,
+               for a reset and a worst-case delta (needs msgpack)
+
+Results are JSON (one object per size, plus environment metadata);
+--compare prints the change against an earlier results file and exits
+non-zero if any p50 regressed by more than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, '..', 'src')
+
+ENDPOINTS = (
+    '/api/dashboard',
+    '/api/stats',
+    '/api/charts',
+    '/api/foods?limit=50',
+    '/api/foods?limit=50&sort=calories&order=asc&min_protein=20&meal_type=Lunch',
+    '/api/charts?bucket=week',
+    '/api/foods?stream=1&limit=5000',
+)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    return {
+        'n': n,
+        'mean_ms': round(sum(samples) / n, 4),
+        'p50_ms': round(samples[n // 2], 4),
+        'p95_ms': round(samples[min(n - 1, int(n * 0.95))], 4),
+        'p99_ms': round(samples[min(n - 1, int(n * 0.99))], 4),
+        'max_ms': round(samples[-1], 4),
+    }
+
+
+def time_calls(fn, iterations, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def bench_aggregates(iterations):
+    import deltas
+    import foods
+    import generation
+    import snapshot
+
+    date_range = snapshot.DateRange('day', snapshot.RANGE_MIN, snapshot.RANGE_MAX)
+    week_range = snapshot.DateRange('week', snapshot.RANGE_MIN, snapshot.RANGE_MAX)
+    _, first_cursor = foods.fetch_foods_page(50, None, foods.FOOD_COLUMNS)
+    filtered_view = foods.parse_view({'sort': 'calories', 'min_protein': 20, 'meal_type': 'Lunch'})
+
+    cases = {
+        'compute_snapshot': snapshot.compute_snapshot,
+        'compute_range_snapshot_day': lambda: snapshot.compute_range_snapshot(date_range),
+        'bucket_series_week': lambda: snapshot.bucket_series(week_range),
+        'foods_first_page': lambda: foods.fetch_foods_page(50, None, foods.FOOD_COLUMNS),
+        'foods_next_page': lambda: foods.fetch_foods_page(50, first_cursor, foods.FOOD_COLUMNS),
+        'foods_filtered_page': lambda: foods.fetch_foods_page(50, None, foods.FOOD_COLUMNS, filtered_view),
+        'read_delta_initial': lambda: deltas.read_delta(None),
+        'last_modified': generation.generation_changed_at,
+    }
+    return {name: time_calls(fn, iterations) for name, fn in cases.items()}
+
+
+def bench_rebuild():
+    from db import transaction
+    from rollups import rebuild_bucket_rollups, rebuild_rollups
+
+    results = {}
+    for name, fn in (('rebuild_rollups', rebuild_rollups),
+                     ('rebuild_bucket_rollups', rebuild_bucket_rollups)):
+        start = time.perf_counter()
+        with transaction() as conn:
+            fn(conn)
+        results[name] = round((time.perf_counter() - start) * 1000, 3)
+    return results
+
+
+def start_server(db_path, port):
+    """
+    Run the real app in a child process (threading mode) and wait until it
+    answers.
+    """
+    code = (
+        "import app; from werkzeug.serving import make_server; "
+        f"make_server('127.0.0.1', {port}, app.app, threaded=True).serve_forever()"
+    )
+    env = dict(os.environ, NUTRILENS_DB=db_path, PYTHONPATH=SRC)
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=SRC, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited: {proc.stderr.read().decode()[-2000:]}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/stats", timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def bench_endpoints(port, concurrency_levels, requests_per_level):
+    base = f"http://127.0.0.1:{port}"
+    results = {}
+    counter = iter(range(10 ** 12))
+    counter_lock = threading.Lock()
+
+    def fetch(path, bust):
+        if bust:
+            # A unique query string misses the response cache every time
+            with counter_lock:
+                n = next(counter)
+            path += ('&' if '?' in path else '?') + f"_bench={n}"
+        start = time.perf_counter()
+        with urllib.request.urlopen(base + path, timeout=30) as response:
+            response.read()
+        return (time.perf_counter() - start) * 1000
+
+    for path in ENDPOINTS:
+        for bust in (False, True):
+            key = f"{path} {'uncached' if bust else 'cached'}"
+            results[key] = {}
+            for concurrency in concurrency_levels:
+                fetch(path, bust)
+                started = time.perf_counter()
+                with ThreadPoolExecutor(concurrency) as pool:
+                    samples = list(pool.map(lambda _: fetch(path, bust), range(requests_per_level)))
+                elapsed = time.perf_counter() - started
+                result = summarize(samples)
+                result['requests_per_second'] = round(requests_per_level / elapsed, 1)
+                results[key][str(concurrency)] = result
+    return results
+
+
+def bench_fanout(clients, writes=10):
+    import ingest
+    from broadcast import observe_payload
+    from deltas import read_delta
+    from tenants import Tenant
+
+    tenant = Tenant(None)
+    sids = [f"bench-{i}" for i in range(clients)]
+
+    start = time.perf_counter()
+    for sid in sids:
+        tenant.cursors.build_update(sid, tenant.snapshots.get())
+    initial = (time.perf_counter() - start) * 1000
+
+    # One write burst, then what a single broadcast costs versus answering
+    # every client's refresh_data individually
+    cursor = read_delta(None)[0]
+    ingest.ingest('foods', enumerate({'name': f"fanout {i}", 'calories': 100} for i in range(writes)))
+
+    start = time.perf_counter()
+    snapshot = tenant.snapshots.refresh()
+    _, payload = tenant.cursors.build_broadcast(cursor, snapshot)
+    broadcast = (time.perf_counter() - start) * 1000
+    payload_bytes = len(json.dumps(payload, separators=(',', ':')))
+    observe_payload('broadcast', payload)
+
+    ingest.ingest('foods', enumerate({'name': f"fanout b{i}", 'calories': 100} for i in range(writes)))
+    start = time.perf_counter()
+    for sid in sids:
+        tenant.cursors.build_update(sid, tenant.snapshots.get())
+    per_client = (time.perf_counter() - start) * 1000
+
+    return {
+        'clients': clients,
+        'initial_replies_ms': round(initial, 3),
+        'broadcast_ms': round(broadcast, 3),
+        'broadcast_payload_bytes': payload_bytes,
+        'per_client_replies_ms': round(per_client, 3),
+        'per_client_reply_ms': round(per_client / clients, 4),
+    }
+
+
+def bench_payloads(iterations):
+    import deltas
+    import payloads
+    import snapshot
+    from foods import fetch_foods_page
+
+    if 'msgpack' not in payloads.available_encodings():
+        return {'skipped': "msgpack is not installed"}
+
+    head = deltas.read_delta(None)[0]
+    upserted, _ = fetch_foods_page(deltas.MAX_DELTA_ROWS)
+    cases = {
+        'reset': deltas.reset_payload(head, snapshot.compute_snapshot()),
+        'delta_max': deltas.delta_payload(head, (head, upserted, [])),
+    }
+
+    # name -> (encode, decode); json is what Socket.IO does with a dict
+    encoders = {
+        'json': (lambda p: json.dumps(p, separators=(',', ':')), json.loads),
+        'json_columnar': (lambda p: json.dumps(payloads.columnar(p), separators=(',', ':')),
+                          json.loads),
+        'msgpack': (lambda p: payloads.encode_payload(p, 'msgpack'), payloads.decode_payload),
+        'msgpack_uncompressed': (lambda p: payloads.encode_payload(p, 'msgpack', float('inf')),
+                                 payloads.decode_payload),
+    }
+    results = {}
+    for case, payload in cases.items():
+        baseline = None
+        for name, (encode, decode) in encoders.items():
+            message = encode(payload)
+            size = len(message.encode() if isinstance(message, str) else message)
+            baseline = baseline or size
+            results[f"{case} {name}"] = {
+                'bytes': size,
+                'ratio': round(size / baseline, 3),
+                'encode': time_calls(lambda: encode(payload), iterations),
+                'decode': time_calls(lambda: decode(message), iterations),
+            }
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(current, baseline, threshold):
+    """
+    Print p50 changes for every case present in both runs; return the
+    regressions beyond threshold.
+    """
+    regressions = []
+
+    def walk(path, new, old):
+        if isinstance(new, dict) and isinstance(old, dict):
+            if 'p50_ms' in new and 'p50_ms' in old and old['p50_ms']:
+                change = new['p50_ms'] / old['p50_ms'] - 1
+                flag = ' REGRESSION' if change > threshold else ''
+                print(f"{path}: {old['p50_ms']:.3f} -> {new['p50_ms']:.3f} ms ({change:+.1%}){flag}")
+                if flag:
+                    regressions.append(path)
+                return
+            for key in new:
+                if key in old:
+                    walk(f"{path}/{key}" if path else key, new[key], old[key])
+
+    walk('', current['sizes'], baseline.get('sizes', {}))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                        help="food_items rows per run (meal logs are 1.5x)")
+    parser.add_argument('--db', help="benchmark this existing database instead of generating")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=500, help="HTTP requests per level")
+    parser.add_argument('--clients', type=int, default=1000, help="simulated sockets for fan-out")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--skip', nargs='*', default=[],
+                        choices=['aggregates', 'rebuild', 'endpoints', 'fanout', 'payloads'])
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="p50 slowdown counted as a regression (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, SRC)
+    sys.path.insert(0, HERE)
+    import db
+    from generate_data import generate
+
+    results = {'environment': environment(), 'args': vars(args), 'sizes': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [(None, args.db)] if args.db else [
+            (rows, os.path.join(tmp, f"bench_{rows}.db")) for rows in args.rows]
+        for rows, db_path in runs:
+            label = str(rows) if rows is not None else os.path.basename(db_path)
+            print(f"== {label}", file=sys.stderr)
+            size = {}
+            if rows is not None:
+                size['generate'] = generate(db_path, rows)
+            db.configure(db_path)
+            if 'aggregates' not in args.skip:
+                size['aggregates'] = bench_aggregates(args.iterations)
+            if 'rebuild' not in args.skip:
+                size['rebuild_ms'] = bench_rebuild()
+            if 'endpoints' not in args.skip:
+                server = start_server(db_path, args.port)
+                try:
+                    size['endpoints'] = bench_endpoints(args.port, args.concurrency, args.requests)
+                finally:
+                    server.terminate()
+                    server.wait()
+            if 'fanout' not in args.skip:
+                size['fanout'] = bench_fanout(args.clients)
+            if 'payloads' not in args.skip:
+                size['payloads'] = bench_payloads(args.iterations)
+            results['sizes'][label] = size
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
+import os
 import re
+import sys
 import time
 from datetime import datetime
 import json
 import websocket
 import threading
 import queue
-from flask import Flask, render_template_string
+from flask import Flask, Response, render_template_string
+
+# Shared metrics helpers live with the dashboard server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from metrics import CONTENT_TYPE, REGISTRY
 
 # Flask app configuration
 app = Flask(__name__)
@@ -15,6 +21,28 @@ app = Flask(__name__)
 SERVER_RESPONSES = []
 log_queue = queue.Queue()
 
+# Ingest-rate metrics, scraped from /metrics
+WS_MESSAGES = REGISTRY.counter(
+    'nutrilens_ws_messages', "Socket.IO frames received from the analysis server", ['event'])
+WS_MESSAGE_BYTES = REGISTRY.counter(
+    'nutrilens_ws_message_bytes', "Bytes received from the analysis server")
+WS_FOOD_ITEMS = REGISTRY.counter(
+    'nutrilens_ws_food_items', "Messages a food item was extracted from", ['with_calories'])
+WS_ERRORS = REGISTRY.counter(
+    'nutrilens_ws_errors', "Message processing and connection errors", ['stage'])
+WS_CONNECTS = REGISTRY.counter(
+    'nutrilens_ws_connects', "WebSocket connection attempts")
+WS_CONNECTED = REGISTRY.gauge(
+    'nutrilens_ws_connected', "1 while the WebSocket connection is open")
+WS_CONNECTED.set(0)
+WS_PROCESS_DURATION = REGISTRY.histogram(
+    'nutrilens_ws_message_processing_seconds', "Time to parse and extract one message",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+
+# Events this extractor handles; any other name the remote server sends is
+# counted as "other", so it can't grow the event label set
+KNOWN_EVENTS = ('message',)
+
 # WebSocket configuration
 WEBSOCKET_ROOT_URL = "wss://krishna-websocket-123-cbb50832eaae.herokuapp.com"
 WEBSOCKET_URL = f"{WEBSOCKET_ROOT_URL}/socket.io/?EIO=4&transport=websocket"
@@ -1690,6 +1718,8 @@ def on_message(ws, message):
     """
     Handle incoming WebSocket messages.
     """
+    started = time.perf_counter()
+    WS_MESSAGE_BYTES.inc(len(message))
     try:
         # Parse the message
         if message.startswith('42'):
@@ -1697,6 +1727,7 @@ def on_message(ws, message):
             data = json.loads(message[2:])
             event_name = data[0]
             event_data = data[1]
+            WS_MESSAGES.inc(event=event_name if event_name in KNOWN_EVENTS else 'other')
             
             # Process the message
             if event_name == 'message':
@@ -1721,6 +1752,7 @@ def on_message(ws, message):
                     calorie_match = re.search(calorie_pattern, event_data.lower())
                     if calorie_match:
                         response['calories'] = calorie_match.group(1)
+                    WS_FOOD_ITEMS.inc(with_calories=str(bool(calorie_match)).lower())
                 
                 # Add to responses
                 SERVER_RESPONSES.append(response)
@@ -1728,25 +1760,33 @@ def on_message(ws, message):
                 
                 # Put in queue for real-time updates
                 log_queue.put(json.dumps(response))
+        else:
+            WS_MESSAGES.inc(event='engine.io')
     except Exception as e:
+        WS_ERRORS.inc(stage='message')
         print(f"Error processing message: {str(e)}")
+    finally:
+        WS_PROCESS_DURATION.observe(time.perf_counter() - started)
 
 def on_error(ws, error):
     """
     Handle WebSocket errors.
     """
+    WS_ERRORS.inc(stage='connection')
     print(f"WebSocket error: {str(error)}")
 
 def on_close(ws, close_status_code, close_msg):
     """
     Handle WebSocket connection close.
     """
+    WS_CONNECTED.set(0)
     print("WebSocket connection closed")
 
 def on_open(ws):
     """
     Handle WebSocket connection open.
     """
+    WS_CONNECTED.set(1)
     print("WebSocket connection established")
     # Send a ping to keep the connection alive
     ws.send("2probe")
@@ -1755,6 +1795,7 @@ def connect_websocket():
     """
     Connect to the WebSocket server.
     """
+    WS_CONNECTS.inc()
     websocket.enableTrace(True)
     ws = websocket.WebSocketApp(
         WEBSOCKET_URL,
@@ -1808,6 +1849,13 @@ def index():
         total_carbs=total_carbs
     )
 
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus scrape endpoint: WebSocket ingest counters and latencies.
+    """
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 def main():
     """
     Main function to start the Flask application.
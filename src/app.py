@@ -1,137 +1,110 @@
-from flask import Flask, render_template_string, jsonify
+# Must run before flask/socketio are imported so sockets go green in async mode
+from workers import (ASYNC_MODE, get_executor, iter_blocking, patch_for_async_mode, raise_fd_limit,
+                     run_blocking)
+patch_for_async_mode()
+
+from flask import Flask, Response, abort, render_template_string, jsonify, request, url_for, g
 import json
-import sqlite3
 from datetime import datetime
-import pandas as pd
-import numpy as np
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit, join_room
 import os
-
-app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")
+import time
+
+from assets import IMMUTABLE_CACHE_CONTROL, AssetManifest, etag, make_asset, negotiate
+from broadcast import Broadcaster, observe_payload
+from cache import (
+    LastModifiedTracker, cached_response, conditional_get, create_cache, request_generation, varies_on,
+)
+from db import current_user, name_queries, reading_replica
+from export import EXPORT_FORMATS, ExportFailed, ExportUnavailable, iter_export, parse_export
+from foods import (
+    AFTER_VALUE, DEFAULT_VIEW, WITHIN_NULLS, FoodView, InvalidQuery,
+    fetch_foods_page, iter_foods, page_query, parse_fields, parse_limit, parse_view,
+)
+from generation import current_generation
+from ingest import ingest, iter_ndjson
+from materializer import Materializer
+from messaging import MESSAGE_QUEUE_URL, create_bus, socketio_options
+from metrics import CONTENT_TYPE, REGISTRY, timed
+from migrations import check_query_plans, migrate
+from payloads import encode_payload, encoding_room, negotiate_encoding
+from replica import reads_replica
+from search import search_foods
+from snapshot import (BUCKET_SERIES_QUERY, MEAL_TYPES, RANGE_MAX, RANGE_MIN, RANGE_SNAPSHOT_QUERY,
+                      SNAPSHOT_QUERY, DateRange, bucket_series,
+                      compute_range_snapshot, compute_snapshot, parse_range)
+from tenants import Tenants, UnknownUser, activate, deactivate, parse_user_id, prepare_user, user_scope
+
+# static/ is served by get_asset() under fingerprinted names instead
+app = Flask(__name__, static_folder=None)
+# Wrapped before SocketIO installs its middleware: HTTP views run on the
+# blocking executor, socket traffic stays on the event loop
+app.wsgi_app = get_executor().wrap_wsgi(app.wsgi_app)
+# With NUTRILENS_MESSAGE_QUEUE set, emits and change events reach every worker
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, **socketio_options())
+bus = create_bus()
 
 # Database setup
 def init_db():
-    conn = sqlite3.connect('food_analysis.db')
-    c = conn.cursor()
-    
-    # Create food items table
-    c.execute('''CREATE TABLE IF NOT EXISTS food_items
-                 (id INTEGER PRIMARY KEY, name TEXT, calories INTEGER, 
-                  protein REAL, carbs REAL, fat REAL, fiber REAL,
-                  iron REAL, calcium REAL, magnesium REAL, zinc REAL, potassium REAL,
-                  benefits TEXT, drawbacks TEXT, alternatives TEXT,
-                  timestamp DATETIME)''')
-    
-    # Create meal_logs table
-    c.execute('''CREATE TABLE IF NOT EXISTS meal_logs
-                 (id INTEGER PRIMARY KEY, food_id INTEGER, meal_type TEXT,
-                  timestamp DATETIME, FOREIGN KEY (food_id) REFERENCES food_items(id))''')
-    
-    conn.commit()
-    conn.close()
+    migrate()
 
 # Initialize database
 init_db()
 
+def foods_query(view, keyset=None, keyset_params=()):
+    sql, params = page_query(view, keyset=keyset)
+    return sql, params + keyset_params + (1,)
+
+# A Filter + Sort combination as the dashboard sends it
+FILTERED_VIEW = FoodView('calories', 'asc', (('calories', 200.0, 800.0),), 'Lunch', None, None)
+
+# Every query the dashboard runs per request; their plans are checked at startup
+DASHBOARD_QUERIES = {
+    'snapshot': (SNAPSHOT_QUERY, MEAL_TYPES),
+    'foods_first_page': foods_query(DEFAULT_VIEW),
+    'foods_next_page': foods_query(DEFAULT_VIEW, AFTER_VALUE, ('', 0)),
+    'foods_null_tail': foods_query(DEFAULT_VIEW, WITHIN_NULLS, (0,)),
+    'foods_filtered_page': foods_query(FILTERED_VIEW),
+    'foods_filtered_next_page': foods_query(FILTERED_VIEW, AFTER_VALUE, (0, 0)),
+    'range_snapshot': (RANGE_SNAPSHOT_QUERY, DateRange('day', RANGE_MIN, RANGE_MAX).params()),
+    'bucket_series': (BUCKET_SERIES_QUERY, DateRange('day', RANGE_MIN, RANGE_MAX).params()),
+}
+
+check_query_plans(DASHBOARD_QUERIES)
+name_queries(DASHBOARD_QUERIES)
+
+# Per-user snapshots, socket cursors and rooms; requests arriving together
+# for the same user share one snapshot computation
+tenants = Tenants()
+
+def user_snapshots():
+    return tenants.get(current_user()).snapshots
+
+# The helpers below are views over a single snapshot of the current user's
+# data; callers that need more than one of them should call
+# user_snapshots().get() once and reuse it
 def calculate_nutritional_stats():
-    conn = sqlite3.connect('food_analysis.db')
-    df = pd.read_sql_query("SELECT * FROM food_items", conn)
-    
-    if df.empty:
-        return {
-            'total_calories': 0,
-            'total_protein': 0,
-            'total_carbs': 0,
-            'total_fat': 0,
-            'total_fiber': 0
-        }
-    
-    stats = {
-        'total_calories': df['calories'].sum(),
-        'total_protein': df['protein'].sum(),
-        'total_carbs': df['carbs'].sum(),
-        'total_fat': df['fat'].sum(),
-        'total_fiber': df['fiber'].sum()
-    }
-    
-    conn.close()
-    return stats
+    return user_snapshots().get().stats()
 
 def get_meal_distribution():
-    conn = sqlite3.connect('food_analysis.db')
-    df = pd.read_sql_query("""
-        SELECT meal_type, SUM(f.calories) as total_calories
-        FROM meal_logs m
-        JOIN food_items f ON m.food_id = f.id
-        GROUP BY meal_type
-    """, conn)
-    
-    meal_types = ['Breakfast', 'Lunch', 'Dinner', 'Snacks']
-    calories = [0] * 4
-    
-    for i, meal_type in enumerate(meal_types):
-        if meal_type in df['meal_type'].values:
-            calories[i] = df[df['meal_type'] == meal_type]['total_calories'].iloc[0]
-    
-    conn.close()
-    return calories
+    return list(user_snapshots().get().meal_calories)
 
 def get_mineral_intake():
-    conn = sqlite3.connect('food_analysis.db')
-    df = pd.read_sql_query("""
-        SELECT 
-            AVG(iron) as iron,
-            AVG(calcium) as calcium,
-            AVG(magnesium) as magnesium,
-            AVG(zinc) as zinc,
-            AVG(potassium) as potassium
-        FROM food_items
-    """, conn)
-    
-    # Convert to percentages (assuming daily recommended values)
-    daily_values = {
-        'iron': 18,  # mg
-        'calcium': 1000,  # mg
-        'magnesium': 400,  # mg
-        'zinc': 11,  # mg
-        'potassium': 3500  # mg
-    }
-    
-    minerals = {
-        'iron': (df['iron'].iloc[0] / daily_values['iron']) * 100,
-        'calcium': (df['calcium'].iloc[0] / daily_values['calcium']) * 100,
-        'magnesium': (df['magnesium'].iloc[0] / daily_values['magnesium']) * 100,
-        'zinc': (df['zinc'].iloc[0] / daily_values['zinc']) * 100,
-        'potassium': (df['potassium'].iloc[0] / daily_values['potassium']) * 100
-    }
-    
-    conn.close()
-    return list(minerals.values())
+    return list(user_snapshots().get().minerals)
 
 def get_macronutrient_distribution():
-    conn = sqlite3.connect('food_analysis.db')
-    df = pd.read_sql_query("""
-        SELECT SUM(protein) as total_protein,
-               SUM(carbs) as total_carbs,
-               SUM(fat) as total_fat
-        FROM food_items
-    """, conn)
-    
-    total = df['total_protein'].iloc[0] + df['total_carbs'].iloc[0] + df['total_fat'].iloc[0]
-    if total == 0:
-        return [0, 0, 0]
-    
-    distribution = [
-        (df['total_protein'].iloc[0] / total) * 100,
-        (df['total_carbs'].iloc[0] / total) * 100,
-        (df['total_fat'].iloc[0] / total) * 100
-    ]
-    
-    conn.close()
-    return distribution
-
-# HTML Template (same as before, but with dynamic data)
+    return list(user_snapshots().get().macronutrients)
+
+def current_snapshot():
+    # Replica reads are point-in-time and the snapshot query is a single
+    # row; the coalesced snapshot stays on the database for the socket path.
+    # Never older than the generation the response is cached under
+    if reading_replica():
+        return compute_snapshot()
+    return user_snapshots().get(request_generation())
+
+# Dashboard shell; styles and script live in static/ and everything dynamic
+# arrives over the socket
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
@@ -143,235 +116,7 @@ HTML_TEMPLATE = """
     <link href="https://fonts.googleapis.com/css2?family=SF+Pro+Display:wght@300;400;500;600;700&display=swap" rel="stylesheet">
     <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
     <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js"></script>
-    <style>
-        /* Same CSS as before */
-        :root {
-            --primary-color: #007AFF;
-            --text-color: #000000;
-            --background-color: #F2F2F7;
-            --card-background: #FFFFFF;
-            --border-radius: 12px;
-            --shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
-            --spacing-unit: 8px;
-            --font-size-base: 16px;
-            --font-size-small: 14px;
-            --font-size-large: 20px;
-        }
-
-        body {
-            font-family: 'SF Pro Display', -apple-system, BlinkMacSystemFont, sans-serif;
-            margin: 0;
-            padding: 0;
-            background: linear-gradient(135deg, 
-                rgba(0, 122, 255, 0.3) 0%,
-                rgba(88, 86, 214, 0.2) 50%,
-                rgba(255, 255, 255, 0.9) 100%);
-            min-height: 100vh;
-            color: var(--text-color);
-        }
-
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: calc(var(--spacing-unit) * 3);
-        }
-
-        .header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: calc(var(--spacing-unit) * 4);
-            padding: calc(var(--spacing-unit) * 2);
-            background: var(--card-background);
-            border-radius: var(--border-radius);
-            box-shadow: var(--shadow);
-        }
-
-        .logo {
-            font-size: var(--font-size-large);
-            font-weight: 600;
-            color: var(--primary-color);
-        }
-
-        .stats-container {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: calc(var(--spacing-unit) * 2);
-            margin-bottom: calc(var(--spacing-unit) * 4);
-        }
-
-        .stat-card {
-            background: var(--card-background);
-            padding: calc(var(--spacing-unit) * 2);
-            border-radius: var(--border-radius);
-            text-align: center;
-            box-shadow: var(--shadow);
-            transition: all 0.3s ease;
-            cursor: pointer;
-        }
-
-        .stat-card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.2);
-            background: linear-gradient(135deg, var(--primary-color), #5856D6);
-        }
-
-        .stat-card:hover .stat-value,
-        .stat-card:hover .stat-label {
-            color: white;
-        }
-
-        .stat-value {
-            font-size: var(--font-size-large);
-            font-weight: 600;
-            color: var(--primary-color);
-            margin-bottom: var(--spacing-unit);
-            transition: color 0.3s ease;
-        }
-
-        .stat-label {
-            font-size: var(--font-size-small);
-            color: var(--text-color);
-            transition: color 0.3s ease;
-        }
-
-        .controls {
-            display: flex;
-            gap: calc(var(--spacing-unit) * 2);
-            margin-bottom: calc(var(--spacing-unit) * 4);
-        }
-
-        .button {
-            padding: calc(var(--spacing-unit) * 1.5) calc(var(--spacing-unit) * 3);
-            border: none;
-            border-radius: var(--border-radius);
-            background: var(--primary-color);
-            color: white;
-            font-size: var(--font-size-base);
-            font-weight: 500;
-            cursor: pointer;
-            transition: all 0.3s ease;
-        }
-
-        .button:hover {
-            background: #0056b3;
-            transform: translateY(-2px);
-        }
-
-        .food-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-            gap: calc(var(--spacing-unit) * 3);
-            margin-bottom: calc(var(--spacing-unit) * 4);
-        }
-
-        .food-card {
-            background: var(--card-background);
-            border-radius: var(--border-radius);
-            padding: calc(var(--spacing-unit) * 2);
-            box-shadow: var(--shadow);
-            transition: all 0.3s ease;
-        }
-
-        .food-card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.2);
-        }
-
-        .food-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: calc(var(--spacing-unit) * 2);
-        }
-
-        .food-name {
-            font-size: var(--font-size-large);
-            font-weight: 600;
-            color: var(--text-color);
-        }
-
-        .food-calories {
-            font-size: var(--font-size-base);
-            color: var(--primary-color);
-            font-weight: 500;
-        }
-
-        .nutrition-info {
-            display: grid;
-            grid-template-columns: repeat(2, 1fr);
-            gap: calc(var(--spacing-unit) * 2);
-            margin-bottom: calc(var(--spacing-unit) * 2);
-        }
-
-        .nutrition-item {
-            display: flex;
-            flex-direction: column;
-        }
-
-        .nutrition-label {
-            font-size: var(--font-size-small);
-            color: #666;
-        }
-
-        .nutrition-value {
-            font-size: var(--font-size-base);
-            font-weight: 500;
-        }
-
-        .food-details {
-            margin-top: calc(var(--spacing-unit) * 2);
-            padding-top: calc(var(--spacing-unit) * 2);
-            border-top: 1px solid #eee;
-        }
-
-        .detail-section {
-            margin-bottom: calc(var(--spacing-unit) * 2);
-        }
-
-        .detail-title {
-            font-size: var(--font-size-base);
-            font-weight: 600;
-            margin-bottom: var(--spacing-unit);
-            color: var(--text-color);
-        }
-
-        .detail-content {
-            font-size: var(--font-size-small);
-            color: #666;
-            line-height: 1.5;
-        }
-
-        .graphs-section {
-            margin-top: calc(var(--spacing-unit) * 4);
-            padding: calc(var(--spacing-unit) * 3);
-            background: var(--card-background);
-            border-radius: var(--border-radius);
-            box-shadow: var(--shadow);
-        }
-
-        .graphs-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-            gap: calc(var(--spacing-unit) * 3);
-            margin-top: calc(var(--spacing-unit) * 2);
-        }
-
-        .graph-container {
-            background: var(--background-color);
-            padding: calc(var(--spacing-unit) * 2);
-            border-radius: var(--border-radius);
-            height: 300px;
-        }
-
-        .graph-title {
-            font-size: var(--font-size-base);
-            font-weight: 600;
-            margin-bottom: calc(var(--spacing-unit) * 2);
-            color: var(--text-color);
-            text-align: center;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('dashboard.css') }}">
 </head>
 <body>
     <div class="container">
@@ -423,225 +168,328 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
-    <script>
-        const socket = io();
-        let macronutrientsChart, caloriesChart, mineralsChart;
-
-        function updateStats(stats) {
-            document.getElementById('total-items').textContent = stats.total_items;
-            document.getElementById('total-calories').textContent = stats.total_calories;
-            document.getElementById('total-protein').textContent = stats.total_protein + 'g';
-            document.getElementById('total-fiber').textContent = stats.total_fiber + 'g';
-        }
-
-        function updateFoodGrid(foods) {
-            const grid = document.getElementById('food-grid');
-            grid.innerHTML = '';
-            
-            foods.forEach(food => {
-                const card = document.createElement('div');
-                card.className = 'food-card';
-                card.innerHTML = `
-                    <div class="food-header">
-                        <div class="food-name">${food.name}</div>
-                        <div class="food-calories">${food.calories} kcal</div>
-                    </div>
-                    <div class="nutrition-info">
-                        <div class="nutrition-item">
-                            <div class="nutrition-label">Protein</div>
-                            <div class="nutrition-value">${food.protein}g</div>
-                        </div>
-                        <div class="nutrition-item">
-                            <div class="nutrition-label">Carbs</div>
-                            <div class="nutrition-value">${food.carbs}g</div>
-                        </div>
-                        <div class="nutrition-item">
-                            <div class="nutrition-label">Fat</div>
-                            <div class="nutrition-value">${food.fat}g</div>
-                        </div>
-                        <div class="nutrition-item">
-                            <div class="nutrition-label">Fiber</div>
-                            <div class="nutrition-value">${food.fiber}g</div>
-                        </div>
-                    </div>
-                    <div class="food-details">
-                        <div class="detail-section">
-                            <div class="detail-title">Benefits</div>
-                            <div class="detail-content">${food.benefits}</div>
-                        </div>
-                        <div class="detail-section">
-                            <div class="detail-title">Drawbacks</div>
-                            <div class="detail-content">${food.drawbacks}</div>
-                        </div>
-                        <div class="detail-section">
-                            <div class="detail-title">Alternatives</div>
-                            <div class="detail-content">${food.alternatives}</div>
-                        </div>
-                    </div>
-                `;
-                grid.appendChild(card);
-            });
-        }
-
-        function updateCharts(data) {
-            // Update Macronutrients Chart
-            if (macronutrientsChart) {
-                macronutrientsChart.destroy();
-            }
-            const macronutrientsCtx = document.getElementById('macronutrientsChart').getContext('2d');
-            macronutrientsChart = new Chart(macronutrientsCtx, {
-                type: 'doughnut',
-                data: {
-                    labels: ['Protein', 'Carbs', 'Fat'],
-                    datasets: [{
-                        data: data.macronutrients,
-                        backgroundColor: [
-                            'rgba(52, 199, 89, 0.8)',
-                            'rgba(0, 122, 255, 0.8)',
-                            'rgba(255, 149, 0, 0.8)'
-                        ]
-                    }]
-                },
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    plugins: {
-                        title: {
-                            display: true,
-                            text: 'Macronutrient Distribution'
-                        }
-                    }
-                }
-            });
-
-            // Update Calories Chart
-            if (caloriesChart) {
-                caloriesChart.destroy();
-            }
-            const caloriesCtx = document.getElementById('caloriesChart').getContext('2d');
-            caloriesChart = new Chart(caloriesCtx, {
-                type: 'bar',
-                data: {
-                    labels: ['Breakfast', 'Lunch', 'Dinner', 'Snacks'],
-                    datasets: [{
-                        label: 'Calories',
-                        data: data.meal_calories,
-                        backgroundColor: 'rgba(88, 86, 214, 0.8)'
-                    }]
-                },
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    plugins: {
-                        title: {
-                            display: true,
-                            text: 'Calories by Meal'
-                        }
-                    }
-                }
-            });
-
-            // Update Minerals Chart
-            if (mineralsChart) {
-                mineralsChart.destroy();
-            }
-            const mineralsCtx = document.getElementById('mineralsChart').getContext('2d');
-            mineralsChart = new Chart(mineralsCtx, {
-                type: 'radar',
-                data: {
-                    labels: ['Iron', 'Calcium', 'Magnesium', 'Zinc', 'Potassium'],
-                    datasets: [{
-                        label: 'Daily Intake %',
-                        data: data.minerals,
-                        backgroundColor: 'rgba(0, 122, 255, 0.2)',
-                        borderColor: 'rgba(0, 122, 255, 0.8)',
-                        pointBackgroundColor: 'rgba(0, 122, 255, 0.8)'
-                    }]
-                },
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    plugins: {
-                        title: {
-                            display: true,
-                            text: 'Mineral Intake'
-                        }
-                    },
-                    scales: {
-                        r: {
-                            beginAtZero: true,
-                            max: 100
-                        }
-                    }
-                }
-            });
-        }
-
-        function refreshData() {
-            socket.emit('refresh_data');
-        }
-
-        function filterData() {
-            // Implement filtering logic
-        }
-
-        function sortData() {
-            // Implement sorting logic
-        }
-
-        socket.on('update_data', function(data) {
-            updateStats(data.stats);
-            updateFoodGrid(data.foods);
-            updateCharts(data.charts);
-        });
-
-        // Initial data load
-        socket.emit('refresh_data');
-    </script>
+    <script src="{{ asset_url('msgpack.js') }}"></script>
+    <script src="{{ asset_url('dashboard.js') }}"></script>
 </body>
 </html>
 """
 
+# Static files of this deploy, read and compressed once
+assets = AssetManifest()
+
+# The shell has no per-request content: render it once and serve it like a
+# precompressed asset
+with app.app_context():
+    DASHBOARD_PAGE = make_asset('index.html', render_template_string(
+        HTML_TEMPLATE, asset_url=assets.url).encode(), 'text/html; charset=utf-8')
+
+# Revalidated on every load, since a deploy changes the asset URLs inside
+# it; an unchanged page costs a 304
+PAGE_CACHE_CONTROL = 'no-cache'
+
+# Rendered API responses, invalidated whenever the data generation moves
+response_cache = create_cache()
+
+# Newest food timestamp per generation, for Last-Modified
+last_modified = LastModifiedTracker()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'nutrilens_http_requests', "HTTP requests by route, method and status", ['route', 'method', 'status'])
+HTTP_DURATION = REGISTRY.histogram(
+    'nutrilens_http_request_duration_seconds', "HTTP request latency by route", ['route', 'method'])
+SOCKET_EVENT_DURATION = REGISTRY.histogram(
+    'nutrilens_socketio_event_duration_seconds', "Socket.IO handler latency by event", ['event'])
+SOCKET_CLIENTS = REGISTRY.gauge(
+    'nutrilens_socketio_connected_clients', "Dashboard sockets connected to this worker")
+CACHE_STATS = REGISTRY.gauge(
+    'nutrilens_response_cache', "Response cache counters and sizes", ['stat'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The rule, not the path, so cursors and ids don't explode the label set
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_DURATION.observe(time.perf_counter() - started, route=route, method=request.method)
+        HTTP_REQUESTS.inc(route=route, method=request.method, status=str(response.status_code))
+    return response
+
+# Requests name their user with this header or ?user=; neither means the
+# shared database. Only a write creates a new user's database
+USER_HEADER = 'X-NutriLens-User'
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+@app.before_request
+def enter_user_scope():
+    user_id = parse_user_id(request.headers.get(USER_HEADER) or request.args.get('user'))
+    g.user_token = activate(user_id, create=request.method not in READ_METHODS)
+
+@app.teardown_request
+def leave_user_scope(error=None):
+    token = g.pop('user_token', None)
+    if token is not None:
+        deactivate(token)
+
+def send_asset(asset, cache_control):
+    encoding = negotiate(asset, request.accept_encodings.quality)
+    tag = etag(asset, encoding)
+    if request.if_none_match.contains(tag):
+        response = Response(status=304)
+    else:
+        response = Response(asset.bodies[encoding], content_type=asset.content_type)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    return send_asset(DASHBOARD_PAGE, PAGE_CACHE_CONTROL)
+
+@app.route('/assets/<path:name>')
+def get_asset(name):
+    asset = assets.get(name)
+    if asset is None:
+        abort(404)
+    return send_asset(asset, IMMUTABLE_CACHE_CONTROL)
+
+# Prebuilt stats, charts and first page of foods per user, rebuilt in the
+# background whenever their data changes. Started here, on the event loop:
+# views run on executor threads
+materializer = Materializer(socketio)
+materializer.start()
+
+@app.route('/api/dashboard')
+def get_dashboard():
+    # The default view as one reset payload; reads no database once the
+    # user is warm. Revalidated like the page, by content hash
+    return send_asset(materializer.get(current_user()).asset, PAGE_CACHE_CONTROL)
 
 @app.route('/api/stats')
+@reads_replica
+@conditional_get(last_modified)
+@cached_response(response_cache)
 def get_stats():
-    return jsonify(calculate_nutritional_stats())
+    # ?from=&to=&bucket=hour|day|week reads the time-bucket rollups instead
+    date_range = parse_range(request.args)
+    if date_range is not None:
+        return jsonify(compute_range_snapshot(date_range).stats())
+    return jsonify(current_snapshot().stats())
+
+@app.errorhandler(InvalidQuery)
+def handle_invalid_query(error):
+    return jsonify({'error': str(error)}), 400
+
+@app.errorhandler(UnknownUser)
+def handle_unknown_user(error):
+    return jsonify({'error': str(error)}), 404
+
+# Streamed bodies are read line by line, never buffered whole
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+
+def wants_stream():
+    # ?stream=1, or an Accept header that prefers NDJSON over JSON
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    best = request.accept_mimetypes.best_match(('application/json',) + NDJSON_MIMETYPES[:2])
+    return best in NDJSON_MIMETYPES
+
+@varies_on('Accept')
+def foods_representation():
+    return 'ndjson' if wants_stream() else 'json'
+
+def ndjson_lines(batches):
+    for batch in batches:
+        yield ''.join(json.dumps(food, separators=(',', ':')) + '\n' for food in batch)
 
 @app.route('/api/foods')
+@reads_replica
+@conditional_get(last_modified, vary=foods_representation)
+@cached_response(response_cache, vary=foods_representation)
 def get_foods():
-    conn = sqlite3.connect('food_analysis.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM food_items ORDER BY timestamp DESC")
-    foods = [dict(zip([col[0] for col in c.description], row)) for row in c.fetchall()]
-    conn.close()
-    return jsonify(foods)
+    # Keyset-paginated: ?limit=N (capped), ?cursor=<next_cursor>, ?fields=a,b,c
+    # Filtered and sorted in SQL: ?min_<nutrient>=&max_<nutrient>=,
+    # ?meal_type=, ?from=&to=, ?sort=<column>&order=asc|desc
+    # Streamed as NDJSON with ?stream=1 or Accept: application/x-ndjson:
+    # every matching row after ?cursor=, or the first ?limit= (uncapped)
+    columns = parse_fields(request.args.get('fields'))
+    view = parse_view(request.args)
+    if wants_stream():
+        limit = parse_limit(request.args.get('limit'), default=None, maximum=None)
+        batches = iter_foods(request.args.get('cursor'), columns, view, limit)
+        return Response(iter_blocking(ndjson_lines(batches)), mimetype='application/x-ndjson')
+    limit = parse_limit(request.args.get('limit'))
+    foods, next_cursor = fetch_foods_page(limit, request.args.get('cursor'), columns, view)
+
+    response = jsonify(foods)
+    if next_cursor is not None:
+        args = dict(request.args, cursor=next_cursor)
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for("get_foods", **args)}>; rel="next"'
+    return response
+
+@app.route('/api/search')
+@reads_replica
+@conditional_get(last_modified)
+@cached_response(response_cache)
+def get_search_results():
+    # ?q=<words> (each a prefix, all required), ?limit=N; best match first
+    return jsonify(search_foods(request.args.get('q', ''), request.args.get('limit')))
+
+@app.route('/api/export/<table>')
+def export_table(table):
+    # ?format=parquet|arrow, ?columns=a,b,c, ?from=&to=; streamed batch by
+    # batch, never built in memory
+    export = parse_export(table, request.args)
+    chunks = iter_export(export)
+    fmt = EXPORT_FORMATS[export.format]
+    return Response(iter_blocking(chunks), mimetype=fmt.mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{table}.{fmt.extension}"'})
+
+@app.errorhandler(ExportUnavailable)
+def handle_export_unavailable(error):
+    return jsonify({'error': str(error)}), 501
+
+@app.errorhandler(ExportFailed)
+def handle_export_failed(error):
+    return jsonify({'error': str(error)}), 500
+
+def request_records():
+    if request.mimetype in NDJSON_MIMETYPES:
+        return iter_ndjson(request.stream)
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, list):
+        raise InvalidQuery("Expected a JSON array or an application/x-ndjson body")
+    return enumerate(payload, start=1)
+
+def announce_change(report):
+    # Lets every worker drop its cached responses and push the new data now
+    if report['inserted']:
+        bus.publish({'type': 'changed', 'user': current_user(), 'generation': current_generation()})
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/foods/bulk', methods=['POST'])
+def bulk_insert_foods():
+    # An Idempotency-Key header makes the whole request safe to retry
+    report = ingest('foods', request_records(), request.headers.get('Idempotency-Key'))
+    announce_change(report)
+    return jsonify(report)
+
+@app.route('/api/meals/bulk', methods=['POST'])
+def bulk_insert_meals():
+    report = ingest('meals', request_records(), request.headers.get('Idempotency-Key'))
+    announce_change(report)
+    return jsonify(report)
 
 @app.route('/api/charts')
+@reads_replica
+@conditional_get(last_modified)
+@cached_response(response_cache)
 def get_charts_data():
-    return jsonify({
-        'macronutrients': get_macronutrient_distribution(),
-        'meal_calories': get_meal_distribution(),
-        'minerals': get_mineral_intake()
-    })
+    date_range = parse_range(request.args)
+    if date_range is not None:
+        charts = compute_range_snapshot(date_range).charts()
+        charts['series'] = bucket_series(date_range)
+        return jsonify(charts)
+    return jsonify(current_snapshot().charts())
+
+# Ceiling on simultaneous sockets in eventlet mode; each idle dashboard is a
+# parked green thread and a file descriptor
+MAX_CONNECTIONS = int(os.environ.get('NUTRILENS_MAX_CONNECTIONS', '20000'))
+
+# Behind a shared queue, writers announce changes, so polling is only a
+# safety net for writes made outside the app
+SAFETY_POLL_INTERVAL = 5.0
+
+# Pushes changes to each user's dashboards once per write burst
+broadcaster = Broadcaster(socketio, tenants, bus,
+                          poll_interval=SAFETY_POLL_INTERVAL if MESSAGE_QUEUE_URL else None,
+                          local=bool(MESSAGE_QUEUE_URL))
+
+def handle_bus_message(message):
+    if message.get('type') == 'changed':
+        response_cache.invalidate(message.get('user'), message.get('generation'))
+        broadcaster.notify(message.get('user'))
+
+bus.subscribe(handle_bus_message)
+bus.start(socketio.start_background_task, socketio.sleep)
+
+SOCKET_CLIENTS.set_function(tenants.client_count)
+CACHE_STATS.set_function(response_cache.stats)
+
+@socketio.on('connect')
+@timed(SOCKET_EVENT_DURATION, event='connect')
+def handle_connect(auth=None):
+    auth = auth if isinstance(auth, dict) else {}
+    user_id = auth.get('user', request.args.get('user'))
+    try:
+        user_id = parse_user_id(user_id)
+        if user_id is not None:
+            run_blocking(prepare_user, user_id)
+    except (InvalidQuery, UnknownUser):
+        return False
+    # auth={'encodings': [...]}: the update_data encodings the client reads
+    encoding = negotiate_encoding(auth.get('encodings'))
+    tenant = tenants.connect(request.sid, user_id, encoding)
+    join_room(encoding_room(tenant.room, encoding))
+    run_blocking(broadcaster.watch, tenant)
+    broadcaster.start()
+
+def build_client_update(tenant, sid, client_cursor, view, encoding):
+    with user_scope(tenant.user_id):
+        payload = tenant.cursors.build_update(sid, tenant.snapshots.get(), client_cursor, view)
+    return encode_payload(payload, encoding)
 
 @socketio.on('refresh_data')
-def handle_refresh():
-    stats = calculate_nutritional_stats()
-    foods = get_foods().json
-    charts = {
-        'macronutrients': get_macronutrient_distribution(),
-        'meal_calories': get_meal_distribution(),
-        'minerals': get_mineral_intake()
-    }
-    
-    socketio.emit('update_data', {
-        'stats': stats,
-        'foods': foods,
-        'charts': charts
-    })
+@timed(SOCKET_EVENT_DURATION, event='refresh_data')
+def handle_refresh(data=None):
+    tenant = tenants.for_socket(request.sid)
+    if tenant is None:
+        return
+    # Reply to the requesting socket only: the delta is relative to its cursor
+    data = data if isinstance(data, dict) else {}
+    view = data.get('view')
+    try:
+        # Same filter and sort arguments as /api/foods
+        view = parse_view(view) if isinstance(view, dict) else DEFAULT_VIEW
+    except InvalidQuery as error:
+        emit('invalid_query', {'error': str(error)})
+        return
+    encoding = tenants.encoding(request.sid)
+    message = run_blocking(build_client_update, tenant, request.sid, data.get('cursor'), view, encoding)
+    observe_payload('reply', message, encoding)
+    emit('update_data', message)
+
+@socketio.on('disconnect')
+@timed(SOCKET_EVENT_DURATION, event='disconnect')
+def handle_disconnect():
+    tenants.disconnect(request.sid)
+
+def stop_background_tasks():
+    # In threading mode the loops are ordinary threads and would keep the
+    # process alive after the server returns
+    broadcaster.stop()
+    materializer.stop()
+    bus.close()
 
 if __name__ == '__main__':
-    socketio.run(app, host='0.0.0.0', port=8080, debug=True) 
\ No newline at end of file
+    try:
+        if ASYNC_MODE == 'threading':
+            socketio.run(app, host='0.0.0.0', port=8080, debug=True)
+        else:
+            raise_fd_limit()
+            # eventlet.wsgi caps concurrent connections at 1024 by default
+            options = {'max_size': MAX_CONNECTIONS} if ASYNC_MODE == 'eventlet' else {}
+            socketio.run(app, host='0.0.0.0', port=8080, **options)
+    finally:
+        stop_background_tasks() 
\ No newline at end of file
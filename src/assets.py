@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Fingerprinted, precompressed static assets for the dashboard.
+
+Every file under static/ is read once at startup and served from memory as
+/assets/<stem>.<hash><ext>. The hash changes with the content, so responses
+can be cached for a year and marked immutable; a deploy that changes a file
+changes its URL. gzip bodies are always prepared, br bodies when the brotli
+package is installed.
+
+    python src/assets.py build /srv/nutrilens/assets
+
+writes the same fingerprinted files with .gz/.br siblings, for a front proxy
+that serves precompressed files itself (nginx gzip_static / brotli_static).
+"""
+import argparse
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+URL_PREFIX = '/assets/'
+
+# Fingerprinted URLs never change content
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Preferred first; identity is always available
+ENCODINGS = ('br', 'gzip')
+
+FILE_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Below this a compressed body saves less than its headers cost
+MIN_COMPRESS_SIZE = 512
+
+Asset = namedtuple('Asset', ['name', 'content_type', 'digest', 'bodies'])
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def compress(data):
+    """
+    {encoding: body} for identity plus every encoding that actually shrinks
+    data.
+    """
+    bodies = {'identity': data}
+    if len(data) < MIN_COMPRESS_SIZE:
+        return bodies
+    # mtime=0 keeps the gzip bytes reproducible across builds
+    candidates = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    brotli = _brotli()
+    if brotli is not None:
+        candidates['br'] = brotli.compress(data, quality=11)
+    for encoding, body in candidates.items():
+        if len(body) < len(data):
+            bodies[encoding] = body
+    return bodies
+
+
+def make_asset(name, data, content_type=None):
+    if content_type is None:
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    return Asset(name, content_type, digest, compress(data))
+
+
+def fingerprint(name, digest):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+
+def negotiate(asset, quality):
+    """
+    Pick the body to send. quality(encoding) returns the client's q-value
+    for an encoding (werkzeug's request.accept_encodings.quality).
+    """
+    for encoding in ENCODINGS:
+        if encoding in asset.bodies and quality(encoding) > 0:
+            return encoding
+    return 'identity'
+
+
+def etag(asset, encoding):
+    # Each encoding is its own representation, so its own strong validator
+    return asset.digest if encoding == 'identity' else f"{asset.digest}-{encoding}"
+
+
+class AssetManifest:
+    """
+    The static files of one deploy, keyed by their fingerprinted names.
+    """
+
+    def __init__(self, directory=STATIC_DIR):
+        self.directory = directory
+        self._by_name = {}
+        self._by_fingerprint = {}
+        for root, _, files in os.walk(directory):
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, directory).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    asset = make_asset(name, f.read())
+                self._by_name[name] = asset
+                self._by_fingerprint[fingerprint(name, asset.digest)] = asset
+        if _brotli() is None:
+            logger.info("brotli is not installed; serving gzip assets only")
+
+    def url(self, name):
+        asset = self._by_name.get(name)
+        if asset is None:
+            raise KeyError(f"No static asset {name!r} in {self.directory}")
+        return URL_PREFIX + fingerprint(name, asset.digest)
+
+    def get(self, fingerprinted):
+        return self._by_fingerprint.get(fingerprinted)
+
+    def names(self):
+        return sorted(self._by_name)
+
+    def asset(self, name):
+        return self._by_name[name]
+
+    def write(self, target):
+        """
+        Write every asset under its fingerprinted name, plus one file per
+        compressed variant.
+        """
+        written = []
+        for fingerprinted, asset in self._by_fingerprint.items():
+            path = os.path.join(target, fingerprinted)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            for encoding, body in asset.bodies.items():
+                out = path + FILE_SUFFIXES.get(encoding, '')
+                with open(out, 'wb') as f:
+                    f.write(body)
+                written.append(out)
+        return written
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Build the dashboard's fingerprinted static assets")
+    parser.add_argument('command', choices=['list', 'build'])
+    parser.add_argument('target', nargs='?', help="output directory for build")
+    args = parser.parse_args()
+
+    manifest = AssetManifest()
+    if args.command == 'list':
+        for name in manifest.names():
+            asset = manifest.asset(name)
+            sizes = ', '.join(f"{e} {len(b)}" for e, b in asset.bodies.items())
+            print(f"{manifest.url(name)}  ({sizes})")
+    elif args.command == 'build':
+        if not args.target:
+            parser.error("build needs a target directory")
+        written = manifest.write(args.target)
+        print(f"Wrote {len(written)} file(s) to {args.target}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+
+from deltas import read_delta
+from generation import current_generation
+from metrics import REGISTRY, SIZE_BUCKETS
+from payloads import DEFAULT_ENCODING, encode_payload, encoding_room, message_size
+from tenants import user_scope
+from workers import run_blocking
+
+logger = logging.getLogger(__name__)
+
+UPDATE_DATA_BYTES = REGISTRY.histogram(
+    'nutrilens_update_data_bytes', "Serialized size of update_data payloads",
+    ['kind', 'encoding'], SIZE_BUCKETS)
+
+
+def observe_payload(kind, message, encoding=DEFAULT_ENCODING):
+    UPDATE_DATA_BYTES.observe(message_size(message), kind=kind, encoding=encoding)
+
+
+class Broadcaster:
+    """
+    Push update_data to each user's room when their data generation changes.
+
+    A single background task polls the generation counter of every user
+    with a connected dashboard. When one moves, the broadcaster waits
+    `debounce` seconds for the write burst to settle, builds one payload
+    from that user's database, and emits it to their room only, so fan-out
+    costs one snapshot per changed user instead of one per client (and one
+    encoding per wire encoding their sockets use).
+
+    With several workers, a bus carries "changed" events: writers announce
+    their commits, so each worker only re-reads the users it was told
+    about and polls everyone every `poll_interval` as a safety net. Each
+    worker emits to its own sockets (`local`), whose delta cursors it holds.
+    """
+
+    def __init__(self, socketio, tenants, bus=None, interval=0.5, debounce=0.2,
+                 poll_interval=None, local=False):
+        self.socketio = socketio
+        self.tenants = tenants
+        self.bus = bus
+        self.interval = interval
+        self.debounce = debounce
+        self.poll_interval = interval if poll_interval is None else poll_interval
+        self.emit_options = {'ignore_queue': True} if local else {}
+        self._lock = threading.Lock()
+        self._task = None
+        self._stopped = None
+        self._notified = set()
+
+    def notify(self, user_id):
+        """
+        Check user_id on the next tick instead of waiting for the poll.
+        """
+        with self._lock:
+            self._notified.add(user_id)
+
+    def start(self):
+        with self._lock:
+            if self._task is not None:
+                return
+            # Each run gets its own flag, so a stopped loop still finishing
+            # its tick never sees a later start()
+            self._stopped = threading.Event()
+            # start_background_task picks a thread, greenlet or eventlet
+            # green thread to match the server's async mode
+            self._task = self.socketio.start_background_task(self._run, self._stopped)
+
+    def stop(self, timeout=None):
+        """
+        Stop the background task; it exits at its next tick, or before
+        returning when a timeout to wait for it is given. start() runs it
+        again.
+        """
+        with self._lock:
+            task, stopped = self._task, self._stopped
+            self._task = self._stopped = None
+        if task is None:
+            return
+        stopped.set()
+        if timeout is not None:
+            task.join(timeout)
+
+    def watch(self, tenant):
+        """
+        Start tracking a user's changes from their current position.
+        """
+        if tenant.generation is not None:
+            return
+        with user_scope(tenant.user_id):
+            tenant.broadcast_cursor = read_delta(None)[0]
+            tenant.generation = current_generation()
+
+    def _changed_tenants(self, poll, notified):
+        changed = []
+        for tenant in self.tenants.active():
+            if not poll and tenant.user_id not in notified:
+                continue
+            try:
+                with user_scope(tenant.user_id):
+                    generation = current_generation()
+            except Exception:
+                logger.exception("Reading the data generation for %s failed", tenant.room)
+                continue
+            if generation == tenant.generation:
+                continue
+            changed.append(tenant)
+            if self.bus is not None and tenant.user_id not in notified:
+                # Nobody announced this write (e.g. a script); tell the others
+                self.bus.publish({'type': 'changed', 'user': tenant.user_id,
+                                  'generation': generation})
+        return changed
+
+    def _run(self, stopped):
+        last_poll = 0.0
+        while not stopped.is_set():
+            self.socketio.sleep(self.interval)
+            if stopped.is_set():
+                break
+            now = time.monotonic()
+            poll = now - last_poll >= self.poll_interval
+            if poll:
+                last_poll = now
+            with self._lock:
+                notified, self._notified = self._notified, set()
+            if not poll and not notified:
+                continue
+            # Database reads happen off the event loop; only emits stay on it
+            changed = run_blocking(self._changed_tenants, poll, notified)
+            if not changed:
+                continue
+            # Let the rest of the burst land before publishing
+            self.socketio.sleep(self.debounce)
+            for tenant in changed:
+                try:
+                    self.publish(tenant)
+                except Exception:
+                    logger.exception("Dashboard broadcast to %s failed", tenant.room)
+
+    def build_payload(self, tenant):
+        with user_scope(tenant.user_id):
+            tenant.generation = current_generation()
+            snapshot = tenant.snapshots.refresh()
+            tenant.broadcast_cursor, payload = tenant.cursors.build_broadcast(
+                tenant.broadcast_cursor, snapshot)
+        return payload
+
+    def encode(self, tenant, encodings):
+        payload = self.build_payload(tenant)
+        return {encoding: encode_payload(payload, encoding) for encoding in encodings}
+
+    def publish(self, tenant):
+        # One message per encoding in use, each sent to that encoding's room
+        messages = run_blocking(self.encode, tenant, self.tenants.encodings(tenant))
+        for encoding, message in messages.items():
+            observe_payload('broadcast', message, encoding)
+            self.socketio.emit('update_data', message, to=encoding_room(tenant.room, encoding),
+                               **self.emit_options)
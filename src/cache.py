@@ -0,0 +1,361 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import Response, g, request
+
+from db import MAX_OPEN_SHARDS, current_user
+from generation import current_generation, generation_changed_at
+
+# In-process limits; either one triggers LRU eviction
+CACHE_MAX_ENTRIES = int(os.environ.get('NUTRILENS_CACHE_MAX_ENTRIES', '1024'))
+CACHE_MAX_BYTES = int(os.environ.get('NUTRILENS_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+# Optional cache shared by every worker, e.g. redis://localhost:6379/0
+CACHE_URL = os.environ.get('NUTRILENS_CACHE_URL')
+
+# Shared entries outlive their generation only briefly
+SHARED_TTL = 300
+
+# Response headers worth replaying from the cache
+CACHED_HEADERS = ('X-Next-Cursor', 'Link', 'Vary')
+
+# Bump when a response format changes so clients don't revalidate old bodies
+ETAG_VERSION = '1'
+
+
+
+class CachedResponse:
+    __slots__ = ('body', 'status', 'mimetype', 'headers')
+
+    def __init__(self, body, status, mimetype, headers):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.headers = headers
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.headers)
+
+    def to_response(self):
+        return Response(self.body, status=self.status, mimetype=self.mimetype,
+                        headers=list(self.headers))
+
+
+class RedisBackend:
+    """
+    Shared second-level cache. Keys embed the generation, so bumping it
+    invalidates every worker at once; old keys expire on their own.
+    """
+
+    def __init__(self, url, prefix='nutrilens:cache:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("NUTRILENS_CACHE_URL is set but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, generation, key):
+        raw = self.client.get(f"{self.prefix}{generation}:{key}")
+        if raw is None:
+            return None
+        # One JSON line of metadata, then the body bytes
+        meta, body = raw.split(b'\n', 1)
+        status, mimetype, headers = json.loads(meta)
+        return CachedResponse(body, status, mimetype, [tuple(h) for h in headers])
+
+    def set(self, generation, key, entry):
+        meta = json.dumps([entry.status, entry.mimetype, entry.headers]).encode()
+        self.client.set(f"{self.prefix}{generation}:{key}", meta + b'\n' + entry.body, ex=SHARED_TTL)
+
+
+class ResponseCache:
+    """
+    LRU cache of rendered responses, valid for one data generation.
+
+    Entries are grouped by scope (the user whose database rendered them),
+    and each scope has its own generation counter (a single-row primary-key
+    read per lookup); when it moves, that scope's entries are dropped. Only
+    scopes with entries are tracked.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, backend=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self._lock = threading.Lock()
+        # (scope, key) -> CachedResponse, least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # scope -> [generation, entry count]
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+
+    def _sync_generation(self, scope, generation):
+        # Caller holds the lock
+        tracked = self._generations.get(scope)
+        if tracked is not None and tracked[0] != generation:
+            self._drop_scope(scope)
+
+    def _drop_scope(self, scope):
+        # Caller holds the lock. Linear in the entry count, which
+        # max_entries keeps small
+        for stale in [k for k in self._entries if k[0] == scope]:
+            self._bytes -= self._entries.pop(stale).size
+        self._generations.pop(scope, None)
+
+    def _remove(self, key):
+        # Caller holds the lock
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        tracked = self._generations[key[0]]
+        tracked[1] -= 1
+        if not tracked[1]:
+            del self._generations[key[0]]
+        return entry
+
+    def get(self, generation, key, scope=None):
+        with self._lock:
+            self._sync_generation(scope, generation)
+            entry = self._entries.get((scope, key))
+            if entry is not None:
+                self._entries.move_to_end((scope, key))
+                self.hits += 1
+                return entry
+        if self.backend is not None:
+            entry = self.backend.get(generation, _shared_key(scope, key))
+            if entry is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                self._store(generation, key, scope, entry)
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, generation, key, entry, scope=None):
+        self._store(generation, key, scope, entry)
+        if self.backend is not None:
+            self.backend.set(generation, _shared_key(scope, key), entry)
+
+    def _store(self, generation, key, scope, entry):
+        size = entry.size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._sync_generation(scope, generation)
+            if (scope, key) in self._entries:
+                self._remove((scope, key))
+            self._generations.setdefault(scope, [generation, 0])[1] += 1
+            self._entries[(scope, key)] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, scope, generation=None):
+        """
+        Drop a scope's entries now, e.g. on a write announced by another
+        worker, instead of on its next lookup.
+        """
+        with self._lock:
+            tracked = self._generations.get(scope)
+            if tracked is not None and (generation is None or tracked[0] != generation):
+                self._drop_scope(scope)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'scopes': len(self._generations),
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+def _shared_key(scope, key):
+    # User ids never contain ':', and the shared database's scope is empty
+    return f"{scope or ''}:{key}"
+
+
+def create_cache():
+    backend = RedisBackend(CACHE_URL) if CACHE_URL else None
+    return ResponseCache(backend=backend)
+
+
+def request_generation():
+    # Read the counter once per request and share it between decorators
+    if 'data_generation' not in g:
+        g.data_generation = current_generation()
+    return g.data_generation
+
+
+def varies_on(*headers):
+    """
+    Mark a vary() callable with the request headers it reads; they go in the
+    Vary header of every response it applies to, cached and 304 included.
+    """
+    def decorator(vary):
+        vary.headers = headers
+        return vary
+    return decorator
+
+
+def add_vary(response, vary):
+    if vary is not None:
+        response.vary.update(getattr(vary, 'headers', ()))
+
+
+def representation_key(vary):
+    # Path and query string, plus whatever else picks the representation
+    # (e.g. the Accept header) when the view negotiates one
+    return request.full_path if vary is None else f"{request.full_path} {vary()}"
+
+
+def cached_response(cache, vary=None):
+    """
+    Cache a GET view's response per (user, generation, path + query string).
+    Only 200 responses are stored. vary() names the representation when the
+    view negotiates one.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            generation = request_generation()
+            key = representation_key(vary)
+            scope = current_user()
+            entry = cache.get(generation, key, scope)
+            if entry is not None:
+                response = entry.to_response()
+                add_vary(response, vary)
+                return response
+
+            response = view(*args, **kwargs)
+            add_vary(response, vary)
+            if response.status_code == 200 and not response.is_streamed:
+                headers = [(h, response.headers[h]) for h in CACHED_HEADERS if h in response.headers]
+                cache.put(generation, key, CachedResponse(
+                    response.get_data(), response.status_code, response.mimetype, headers), scope)
+            return response
+        return wrapper
+    return decorator
+
+
+class LastModifiedTracker:
+    """
+    When the current user's data generation last moved, looked up once per
+    generation, for the max_scopes most recently used users.
+
+    HTTP dates have one-second resolution, so a change made in the current
+    second gets no Last-Modified: another write in the same second would
+    carry the same date and a client holding it would get a wrong 304. Once
+    the second is over, any later write is dated after it.
+    """
+
+    def __init__(self, max_scopes=MAX_OPEN_SHARDS):
+        self.max_scopes = max_scopes
+        self._lock = threading.Lock()
+        # scope -> (generation, value), least recently used first
+        self._values = OrderedDict()
+
+    def get(self, generation):
+        scope = current_user()
+        with self._lock:
+            cached = self._values.get(scope)
+            if cached is not None and cached[0] == generation:
+                self._values.move_to_end(scope)
+                return settled(cached[1])
+        value = parse_timestamp(generation_changed_at())
+        with self._lock:
+            self._values[scope] = (generation, value)
+            self._values.move_to_end(scope)
+            while len(self._values) > self.max_scopes:
+                self._values.popitem(last=False)
+        return settled(value)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+def settled(changed_at):
+    # changed_at if its second is over, else None
+    if changed_at is None:
+        return None
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    return changed_at.replace(microsecond=0) if changed_at < now else None
+
+
+def parse_timestamp(raw):
+    if raw is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(raw))
+    except ValueError:
+        return None
+    # Stored timestamps are naive UTC
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def make_etag(generation, key, scope=None):
+    # Same user + generation + URL always renders the same bytes, so this is
+    # a strong validator without hashing the body
+    digest = hashlib.sha1(f"{ETAG_VERSION}:{scope or ''}:{generation}:{key}".encode()).hexdigest()
+    return digest[:32]
+
+
+def conditional_get(last_modified, vary=None):
+    """
+    Add ETag / Last-Modified validators to a GET view and answer matching
+    If-None-Match / If-Modified-Since requests with 304 before the view runs.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            generation = request_generation()
+            etag = make_etag(generation, representation_key(vary), current_user())
+            modified = last_modified.get(generation)
+
+            if request.if_none_match:
+                # If-None-Match takes precedence over If-Modified-Since
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = since is not None and modified is not None and modified <= since
+
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = view(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # A 304 carries the Vary of the representation it stands for
+            add_vary(response, vary)
+            if modified is not None:
+                response.last_modified = modified
+            # Let clients keep the body but revalidate on every use
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
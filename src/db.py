@@ -0,0 +1,401 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from metrics import QUERY_BUCKETS, REGISTRY
+
+# Database location (overridable so tests/benchmarks can point at a scratch file)
+DB_PATH = os.environ.get('NUTRILENS_DB', 'food_analysis.db')
+
+# Each user's data lives in its own database file under this directory, so a
+# heavy user's history never sits in another user's indexes or write lock.
+# Requests that name no user use DB_PATH.
+USER_DB_DIR = os.environ.get('NUTRILENS_USER_DB_DIR', 'users')
+
+# Pool sizing: enough for the threading server's concurrent handlers without
+# letting eventlet/gevent spawn one connection per greenlet
+POOL_SIZE = int(os.environ.get('NUTRILENS_DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.environ.get('NUTRILENS_DB_POOL_TIMEOUT', '10'))
+
+# Per-user pools are smaller, and only the most recently used ones stay open
+SHARD_POOL_SIZE = int(os.environ.get('NUTRILENS_SHARD_POOL_SIZE', '4'))
+MAX_OPEN_SHARDS = int(os.environ.get('NUTRILENS_MAX_OPEN_SHARDS', '64'))
+
+# Per-connection prepared statement cache (sqlite3 reuses compiled statements
+# for identical SQL strings, so keep the dashboard queries as constants)
+STATEMENT_CACHE_SIZE = 256
+
+# Per-statement timing for /metrics; costs a Python-level call per query
+QUERY_METRICS = os.environ.get('NUTRILENS_QUERY_METRICS', '1') == '1'
+
+# Statements whose labels are remembered; beyond this they are fingerprinted
+# on every call instead
+MAX_QUERY_LABELS = 200
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+QUERY_DURATION = REGISTRY.histogram(
+    'nutrilens_sqlite_query_duration_seconds',
+    "Time to execute a statement (up to its first row)", ['query'], QUERY_BUCKETS)
+QUERY_FETCH_SECONDS = REGISTRY.counter(
+    'nutrilens_sqlite_fetch_seconds',
+    "Time spent fetching result rows after execute", ['query'])
+
+_query_labels = {}
+
+
+def name_queries(queries):
+    """
+    Label statements in metrics by name ({name: (sql, params)}, as passed
+    to check_query_plans) instead of by their text.
+    """
+    for name, (sql, _) in queries.items():
+        _query_labels[sql] = name
+
+
+# Unnamed statements are labelled "<verb> <table>", so the label set stays
+# bounded by the schema and no statement text (literals, DDL) reaches /metrics
+_STATEMENT_TABLE = {
+    'select': re.compile(r'\bfrom\s+"?(\w+)', re.IGNORECASE),
+    'with': re.compile(r'\bfrom\s+"?(\w+)', re.IGNORECASE),
+    'insert': re.compile(r'\binto\s+"?(\w+)', re.IGNORECASE),
+    'replace': re.compile(r'\binto\s+"?(\w+)', re.IGNORECASE),
+    'update': re.compile(r'^\s*update\s+(?:or\s+\w+\s+)?"?(\w+)', re.IGNORECASE),
+    'delete': re.compile(r'\bfrom\s+"?(\w+)', re.IGNORECASE),
+}
+_STATEMENT_KINDS = {
+    'create': 'ddl', 'alter': 'ddl', 'drop': 'ddl', 'reindex': 'ddl',
+    'begin': 'transaction', 'commit': 'transaction', 'end': 'transaction',
+    'rollback': 'transaction', 'savepoint': 'transaction', 'release': 'transaction',
+    'pragma': 'pragma', 'analyze': 'maintenance', 'vacuum': 'maintenance',
+}
+
+
+def query_fingerprint(sql):
+    words = sql.split(None, 1)
+    verb = words[0].lower() if words else ''
+    pattern = _STATEMENT_TABLE.get(verb)
+    if pattern is None:
+        return _STATEMENT_KINDS.get(verb, 'other')
+    match = pattern.search(sql)
+    verb = 'select' if verb == 'with' else verb
+    return f"{verb} {match.group(1).lower()}" if match else verb
+
+
+def query_label(sql):
+    label = _query_labels.get(sql)
+    if label is None:
+        label = query_fingerprint(sql)
+        if len(_query_labels) < MAX_QUERY_LABELS:
+            _query_labels[sql] = label
+    return label
+
+
+class TimedCursor(sqlite3.Cursor):
+    label = None
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            QUERY_FETCH_SECONDS.inc(time.perf_counter() - start, query=self.label)
+
+    def fetchmany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            QUERY_FETCH_SECONDS.inc(time.perf_counter() - start, query=self.label)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            QUERY_FETCH_SECONDS.inc(time.perf_counter() - start, query=self.label)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Connection whose execute()/executemany() record per-statement latency.
+    """
+
+    def execute(self, sql, parameters=()):
+        cursor = self.cursor(TimedCursor)
+        cursor.label = query_label(sql)
+        start = time.perf_counter()
+        try:
+            return cursor.execute(sql, parameters)
+        finally:
+            QUERY_DURATION.observe(time.perf_counter() - start, query=cursor.label)
+
+    def executemany(self, sql, seq_of_parameters):
+        label = query_label(sql)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            QUERY_DURATION.observe(time.perf_counter() - start, query=label)
+
+
+def _connect(path, uri=False):
+    """
+    Open a connection with the dashboard's pragmas applied.
+    """
+    # isolation_level=None puts the driver in autocommit mode; writes are
+    # grouped explicitly with transaction() so reads never hold a lock
+    conn = sqlite3.connect(
+        path,
+        uri=uri,
+        timeout=5.0,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=TimedConnection if QUERY_METRICS else sqlite3.Connection,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of SQLite connections.
+
+    Built on queue.LifoQueue and real threading locks: in the eventlet and
+    gevent modes threading is left unpatched (monkey_patch(thread=False),
+    see workers.py) and every database call runs on a run_blocking() OS
+    thread, so waiting for a free connection blocks only that thread, never
+    the hub. Connections are opened lazily and re-created after a fork.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT, uri=False):
+        self.path = path
+        self.uri = uri
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.closed = False
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            # Never share SQLite handles across a fork
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError(f"Timed out waiting for a database connection ({self.size} in use)")
+
+    def _open(self):
+        return _connect(self.path, self.uri)
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            conn.close()
+            return
+        if self.closed:
+            self.discard(conn)
+            return
+        if conn.in_transaction:
+            # Handler bailed out mid-transaction; don't hand the lock to the next user
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                # The handle is unusable (closed file, corruption); drop it
+                self.discard(conn)
+                return
+        self._idle.put(conn)
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._created -= 1
+
+    def close(self):
+        # Connections still borrowed are closed as they come back
+        self.closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_shard_pools = OrderedDict()
+
+# The user whose database connection() and transaction() use; set per
+# request or socket event, None for the shared database
+_current_user = ContextVar('nutrilens_user', default=None)
+
+
+# Set for the duration of a request that reads a replica (see replica.py):
+# connection() borrows from it instead of the user's database
+_read_pool = ContextVar('nutrilens_read_pool', default=None)
+
+
+def current_user():
+    return _current_user.get()
+
+
+def set_current_user(user_id):
+    """
+    Route this context's connections to user_id's database. Returns a token
+    for reset_current_user().
+    """
+    return _current_user.set(user_id)
+
+
+def reset_current_user(token):
+    _current_user.reset(token)
+
+
+def user_db_path(user_id):
+    return os.path.join(USER_DB_DIR, f"{user_id}.db")
+
+
+def _shard_pool(user_id):
+    with _pool_lock:
+        pool = _shard_pools.get(user_id)
+        if pool is not None:
+            _shard_pools.move_to_end(user_id)
+            return pool
+        os.makedirs(USER_DB_DIR, exist_ok=True)
+        pool = _shard_pools[user_id] = ConnectionPool(user_db_path(user_id), SHARD_POOL_SIZE)
+        while len(_shard_pools) > MAX_OPEN_SHARDS:
+            _, evicted = _shard_pools.popitem(last=False)
+            evicted.close()
+        return pool
+
+
+def get_pool():
+    global _pool
+    user_id = _current_user.get()
+    if user_id is not None:
+        return _shard_pool(user_id)
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+
+def configure(path=None, size=None):
+    """
+    Point the module at a different database file (or resize the pool).
+    """
+    global _pool, DB_PATH
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        for pool in _shard_pools.values():
+            pool.close()
+        _shard_pools.clear()
+        if path is not None:
+            DB_PATH = path
+        _pool = ConnectionPool(DB_PATH, size or POOL_SIZE)
+    return _pool
+
+
+def set_read_pool(pool):
+    """
+    Route this context's reads to pool. Returns a token for
+    reset_read_pool().
+    """
+    return _read_pool.set(pool)
+
+
+def reset_read_pool(token):
+    _read_pool.reset(token)
+
+
+def reading_replica():
+    return _read_pool.get() is not None
+
+
+@contextmanager
+def connection():
+    """
+    Borrow a pooled connection; it is always returned, even on error.
+    """
+    with (_read_pool.get() or get_pool()).connection() as conn:
+        yield conn
+
+
+@contextmanager
+def transaction():
+    """
+    Borrow a connection and run the block inside BEGIN IMMEDIATE ... COMMIT.
+    Always on the user's database, never a replica.
+    """
+    with get_pool().connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def query_all(sql, params=()):
+    with connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def query_one(sql, params=()):
+    with connection() as conn:
+        return conn.execute(sql, params).fetchone()
@@ -0,0 +1,229 @@
+import threading
+
+from db import connection
+from foods import DEFAULT_PAGE_SIZE, DEFAULT_VIEW, FOOD_COLUMNS, fetch_foods_page, matching_ids, view_args
+
+# Past this many changed rows a full first page is cheaper than a diff
+MAX_DELTA_ROWS = 500
+
+# Upper bound on change-log entries scanned for one diff
+MAX_DELTA_CHANGES = 5000
+
+# Change-log rows kept before the pruning trigger drops them (clients whose
+# cursor falls behind the retained window get a full reset)
+CHANGE_LOG_RETENTION = 100000
+
+CHANGE_LOG_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS food_changes
+       (seq INTEGER PRIMARY KEY AUTOINCREMENT, food_id INTEGER NOT NULL)''',
+    '''CREATE TRIGGER IF NOT EXISTS food_items_changes_insert AFTER INSERT ON food_items
+       BEGIN
+           INSERT INTO food_changes (food_id) VALUES (NEW.id);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS food_items_changes_update AFTER UPDATE ON food_items
+       BEGIN
+           INSERT INTO food_changes (food_id) SELECT OLD.id WHERE OLD.id != NEW.id;
+           INSERT INTO food_changes (food_id) VALUES (NEW.id);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS food_items_changes_delete AFTER DELETE ON food_items
+       BEGIN
+           INSERT INTO food_changes (food_id) VALUES (OLD.id);
+       END''',
+    # Prune in batches rather than on every write
+    f'''CREATE TRIGGER IF NOT EXISTS food_changes_prune AFTER INSERT ON food_changes
+       WHEN NEW.seq % 1000 = 0
+       BEGIN
+           DELETE FROM food_changes WHERE seq <= NEW.seq - {CHANGE_LOG_RETENTION};
+       END''',
+]
+
+# Separate subqueries so each bound is a single rowid lookup
+CHANGE_LOG_BOUNDS_QUERY = "SELECT (SELECT MIN(seq) FROM food_changes), (SELECT MAX(seq) FROM food_changes)"
+
+# Latest change per food since the cursor; a missing food_items row means
+# the food was deleted
+CHANGED_FOODS_QUERY = """
+    SELECT c.food_id, {columns}
+    FROM (SELECT food_id, MAX(seq) AS seq FROM food_changes
+          WHERE seq > ? GROUP BY food_id) c
+    LEFT JOIN food_items f ON f.id = c.food_id
+    ORDER BY c.seq
+    LIMIT ?
+""".format(columns=', '.join(f"f.{c}" for c in FOOD_COLUMNS))
+
+
+def create_change_log(conn):
+    for statement in CHANGE_LOG_SCHEMA:
+        conn.execute(statement)
+
+
+def valid_cursor(cursor):
+    """
+    Whether cursor (as sent by a client) is a change-log position: a
+    non-negative int.
+    """
+    return isinstance(cursor, int) and not isinstance(cursor, bool) and cursor >= 0
+
+
+def changes_since(cursor, conn, view=DEFAULT_VIEW):
+    """
+    Return (head, upserted, deleted), or None when the cursor is unknown,
+    already pruned, or too far behind for a diff to be worthwhile. Changed
+    rows that no longer pass view's filters are reported as deleted.
+    """
+    oldest, head = conn.execute(CHANGE_LOG_BOUNDS_QUERY).fetchone()
+    head = head or 0
+    if not valid_cursor(cursor) or cursor > head:
+        return None
+    if oldest is not None and oldest > cursor + 1:
+        # Some of the changes after the cursor have been pruned
+        return None
+    if head - cursor > MAX_DELTA_CHANGES:
+        return None
+
+    rows = conn.execute(CHANGED_FOODS_QUERY, (cursor, MAX_DELTA_ROWS + 1)).fetchall()
+    if len(rows) > MAX_DELTA_ROWS:
+        return None
+
+    upserted, deleted = [], []
+    for row in rows:
+        if row[1] is None:
+            deleted.append(row[0])
+        else:
+            upserted.append(dict(zip(FOOD_COLUMNS, row[1:])))
+    if view != DEFAULT_VIEW and upserted:
+        matched = matching_ids(conn, view, [food['id'] for food in upserted])
+        deleted.extend(food['id'] for food in upserted if food['id'] not in matched)
+        upserted = [food for food in upserted if food['id'] in matched]
+    return head, upserted, deleted
+
+
+def change_head(conn):
+    # The cursor a client at the current data is at
+    return conn.execute(CHANGE_LOG_BOUNDS_QUERY).fetchone()[1] or 0
+
+
+def read_delta(cursor, view=DEFAULT_VIEW):
+    """
+    Run changes_since() in one read transaction. Returns (head, delta) where
+    delta is None if the caller needs a full reset.
+    """
+    with connection() as conn:
+        # One read transaction so the cursor and the rows agree
+        conn.execute("BEGIN")
+        try:
+            delta = changes_since(cursor, conn, view)
+            if delta is None:
+                head = change_head(conn)
+            else:
+                head = delta[0]
+        finally:
+            conn.execute("COMMIT")
+    return head, delta
+
+
+def view_key(view):
+    # Echoed in every update_data so a client can tell whether a payload was
+    # built for the view it is showing
+    return '&'.join(f"{k}={v}" for k, v in view_args(view).items())
+
+
+def reset_payload(head, snapshot, view=DEFAULT_VIEW, conn=None):
+    foods, next_cursor = fetch_foods_page(view=view, conn=conn)
+    return {
+        'reset': True,
+        'view': view_key(view),
+        'cursor': head,
+        'page_size': DEFAULT_PAGE_SIZE,
+        'foods': foods,
+        'foods_cursor': next_cursor,
+        'stats': snapshot.stats(),
+        'charts': snapshot.charts()
+    }
+
+
+def delta_payload(from_cursor, delta, view=DEFAULT_VIEW):
+    head, upserted, deleted = delta
+    # from_cursor lets the client detect a gap and ask for a resync
+    return {
+        'reset': False,
+        'view': view_key(view),
+        'from_cursor': from_cursor,
+        'cursor': head,
+        'upserted': upserted,
+        'deleted': deleted
+    }
+
+
+class ClientCursors:
+    """
+    Per-client delta state: the change-log position, the view (filters and
+    sort) the client's grid shows, and the aggregates it was last sent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def forget(self, client_id):
+        with self._lock:
+            self._clients.pop(client_id, None)
+
+    def build_update(self, client_id, snapshot, client_cursor=None, view=DEFAULT_VIEW):
+        """
+        Build the next update_data payload for one client and advance its
+        cursor. client_cursor is the position the client reports; when it
+        disagrees with ours the client missed something, so trust it and
+        resend the aggregates. A change of view or a client_cursor that is
+        not a valid cursor resets the grid.
+        """
+        with self._lock:
+            state = self._clients.get(client_id)
+        if client_cursor is not None and not valid_cursor(client_cursor):
+            state = client_cursor = None
+        if client_cursor is not None and (state is None or state['cursor'] != client_cursor):
+            state = {'cursor': client_cursor, 'view': view, 'stats': None, 'charts': None}
+        stats, charts = snapshot.stats(), snapshot.charts()
+
+        same_view = state is not None and state['view'] == view
+        head, delta = read_delta(state['cursor'] if same_view else None, view)
+        if delta is None:
+            # First contact, cursor lost or a new view: send a full first page
+            payload = reset_payload(head, snapshot, view)
+        else:
+            payload = delta_payload(state['cursor'], delta, view)
+            if stats != state['stats']:
+                payload['stats'] = stats
+            if charts != state['charts']:
+                payload['charts'] = charts
+
+        with self._lock:
+            self._clients[client_id] = {'cursor': head, 'view': view, 'stats': stats, 'charts': charts}
+        return payload
+
+    def build_broadcast(self, from_cursor, snapshot):
+        """
+        Build one payload for every subscribed client: a delta of the default
+        view from from_cursor (or a reset), with the aggregates always
+        included. Default-view clients that were at from_cursor are
+        advanced; the rest see the from_cursor or view mismatch and ask for
+        their own update.
+        """
+        stats, charts = snapshot.stats(), snapshot.charts()
+        head, delta = read_delta(from_cursor)
+        if delta is None:
+            payload = reset_payload(head, snapshot)
+        else:
+            payload = delta_payload(from_cursor, delta)
+            payload['stats'] = stats
+            payload['charts'] = charts
+        payload['broadcast'] = True
+
+        with self._lock:
+            for client_id, state in self._clients.items():
+                if state['view'] != DEFAULT_VIEW:
+                    continue
+                if delta is None or state['cursor'] == from_cursor:
+                    self._clients[client_id] = {'cursor': head, 'view': DEFAULT_VIEW,
+                                                'stats': stats, 'charts': charts}
+        return head, payload
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Columnar exports of food_items and meal_logs for offline analysis.
+
+Rows are read in keyset pages of EXPORT_BATCH_SIZE in (timestamp, id) order,
+and each page is written as a Parquet row group or an Arrow IPC record batch
+as soon as it is read, so memory holds one batch however large the table. A
+page is one short read: a slow download holds no pooled connection and no
+read transaction between pages. Rows written during an export are included
+if they sort after the page being read; nothing is repeated or skipped.
+
+    python src/export.py food_items foods.parquet --from 2025-01-01
+    python src/export.py meal_logs meals.arrows --format arrow --columns food_id,meal_type
+
+pyarrow is optional and only imported by an export.
+"""
+import argparse
+import sys
+from collections import namedtuple
+
+from db import connection
+from foods import FOOD_COLUMNS, InvalidQuery, NUTRIENT_COLUMNS, parse_moment
+from metrics import REGISTRY
+
+# Rows per Parquet row group / Arrow record batch
+EXPORT_BATCH_SIZE = 65536
+
+ExportFormat = namedtuple('ExportFormat', ['mimetype', 'extension'])
+
+EXPORT_FORMATS = {
+    'parquet': ExportFormat('application/vnd.apache.parquet', 'parquet'),
+    # The IPC stream format: no footer, so readers can start on the first batch
+    'arrow': ExportFormat('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+ExportTable = namedtuple('ExportTable', ['columns', 'order'])
+
+# Column -> Arrow type name. SQLite doesn't enforce column types, so every
+# nutrient (calories included) is exported as float64
+EXPORT_TABLES = {
+    'food_items': ExportTable(
+        {c: 'int64' if c == 'id' else 'float64' if c in NUTRIENT_COLUMNS
+         else 'timestamp' if c == 'timestamp' else 'string' for c in FOOD_COLUMNS},
+        # Walks idx_food_items_timestamp, which also serves the date range
+        'timestamp, id'),
+    'meal_logs': ExportTable(
+        {'id': 'int64', 'food_id': 'int64', 'meal_type': 'string', 'timestamp': 'timestamp'},
+        # Walks idx_meal_logs_timestamp (migration 11), as for food_items
+        'timestamp, id'),
+}
+
+# The (timestamp, id) key of each row comes first, for the next page
+EXPORT_QUERY = "SELECT timestamp, id, {columns} FROM {table}{where} ORDER BY {order} LIMIT ?"
+
+# A stored timestamp not in TIMESTAMP_FORMAT; checked before an export
+# starts rather than written out as null
+NONCANONICAL_TIMESTAMP_QUERY = """
+    SELECT id, timestamp FROM {table}
+    WHERE {conditions}
+    LIMIT 1
+"""
+NONCANONICAL_TIMESTAMP = "timestamp IS NOT NULL AND strftime('%Y-%m-%d %H:%M:%S', timestamp) IS NOT timestamp"
+
+# Rows after the last one read; NULL timestamps sort first
+AFTER_KEY = "(timestamp, id) > (?, ?)"
+AFTER_NULL_KEY = "(timestamp IS NULL AND id > ?) OR timestamp IS NOT NULL"
+
+# How ingest stores timestamps (naive UTC)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Parquet and Arrow IPC both support it and it beats the defaults on
+# repetitive text like meal types and notes
+COMPRESSION = 'zstd'
+
+EXPORT_ROWS = REGISTRY.counter(
+    'nutrilens_export_rows', "Rows written by columnar exports", ['table', 'format'])
+
+ExportRequest = namedtuple('ExportRequest', ['table', 'format', 'columns', 'start', 'end'])
+
+
+class ExportUnavailable(RuntimeError):
+    """
+    Raised when pyarrow is not installed; the API maps it to a 501.
+    """
+
+
+class ExportFailed(RuntimeError):
+    """
+    Raised when a stored value cannot be written with its column's type;
+    the API maps it to a 500.
+    """
+
+
+def load_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportUnavailable("Exports need the pyarrow package (pip install pyarrow)")
+    return pyarrow
+
+
+def parse_export(table, args):
+    """
+    Validate an export of table from format=, columns=a,b,c and from=/to=
+    (to exclusive) arguments.
+    """
+    spec = EXPORT_TABLES.get(table)
+    if spec is None:
+        raise InvalidQuery(f"table must be one of {', '.join(EXPORT_TABLES)}")
+    fmt = args.get('format') or 'parquet'
+    if fmt not in EXPORT_FORMATS:
+        raise InvalidQuery(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    columns = tuple(spec.columns)
+    if args.get('columns'):
+        requested = [c.strip() for c in args['columns'].split(',') if c.strip()]
+        unknown = [c for c in requested if c not in spec.columns]
+        if unknown:
+            raise InvalidQuery(f"Unknown column(s) for {table}: {', '.join(unknown)}")
+        # Table order, like /api/foods?fields=
+        columns = tuple(c for c in spec.columns if c in requested)
+    start = end = None
+    if args.get('from'):
+        start = parse_moment(args['from'], 'from').strftime(TIMESTAMP_FORMAT)
+    if args.get('to'):
+        end = parse_moment(args['to'], 'to').strftime(TIMESTAMP_FORMAT)
+    if start is not None and end is not None and start >= end:
+        raise InvalidQuery("from must be earlier than to")
+    return ExportRequest(table, fmt, columns, start, end)
+
+
+def _range_conditions(request):
+    conditions, params = [], []
+    if request.start is not None:
+        conditions.append("timestamp >= ?")
+        params.append(request.start)
+    if request.end is not None:
+        conditions.append("timestamp < ?")
+        params.append(request.end)
+    return conditions, params
+
+
+def check_timestamps(request):
+    """
+    Raise ExportFailed if a row in request's range has a timestamp that
+    would not parse, so the export fails before anything is streamed.
+    """
+    conditions, params = _range_conditions(request)
+    sql = NONCANONICAL_TIMESTAMP_QUERY.format(
+        table=request.table, conditions=' AND '.join(conditions + [NONCANONICAL_TIMESTAMP]))
+    with connection() as conn:
+        row = conn.execute(sql, params).fetchone()
+    if row is not None:
+        raise ExportFailed(f"{request.table} row {row[0]} has timestamp {row[1]!r}, "
+                           f"which is not in the {TIMESTAMP_FORMAT} format exports read")
+
+
+def export_query(request, after=None, limit=EXPORT_BATCH_SIZE):
+    """
+    The statement for one page of request: the first `limit` rows after the
+    (timestamp, id) key `after`, or from the start.
+    """
+    conditions, params = _range_conditions(request)
+    if after is not None:
+        timestamp, row_id = after
+        if timestamp is None:
+            conditions.append(f"({AFTER_NULL_KEY})")
+            params.append(row_id)
+        else:
+            conditions.append(AFTER_KEY)
+            params += [timestamp, row_id]
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    sql = EXPORT_QUERY.format(columns=', '.join(request.columns), table=request.table,
+                              where=where, order=EXPORT_TABLES[request.table].order)
+    return sql, tuple(params) + (limit,)
+
+
+def _arrow_type(pa, name):
+    if name == 'timestamp':
+        return pa.timestamp('s', tz='UTC')
+    return getattr(pa, name)()
+
+
+def _record_batch(pa, schema, rows):
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if pa.types.is_timestamp(field.type):
+            # Parsed in one vectorised pass rather than per row in Python
+            text = pa.array(values, pa.string())
+            parsed = pa.compute.strptime(text, format=TIMESTAMP_FORMAT, unit='s', error_is_null=True)
+            if parsed.null_count != text.null_count:
+                # Written after check_timestamps() ran
+                raise ExportFailed(f"A {field.name} is not in the {TIMESTAMP_FORMAT} format")
+            arrays.append(parsed.cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _Spool:
+    """
+    Write-only file object for pyarrow's writers; the exporter takes what
+    has been written after every batch.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _open_writer(pa, fmt, sink, schema):
+    if fmt == 'parquet':
+        return pa.parquet.ParquetWriter(sink, schema, compression=COMPRESSION)
+    options = pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+    return pa.ipc.new_stream(sink, schema, options=options)
+
+
+def iter_export(request, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Return an iterator of encoded chunks for request. pyarrow is loaded and
+    the timestamps checked here, before anything is streamed, so either
+    problem is an error response rather than a truncated file.
+    """
+    pa = load_pyarrow()
+    if 'timestamp' in request.columns:
+        check_timestamps(request)
+    spec = EXPORT_TABLES[request.table]
+    schema = pa.schema([(c, _arrow_type(pa, spec.columns[c])) for c in request.columns])
+    return _stream(pa, request, schema, batch_size)
+
+
+def _stream(pa, request, schema, batch_size):
+    spool = _Spool()
+    writer = _open_writer(pa, request.format, pa.PythonFile(spool, mode='w'), schema)
+    rows_written = 0
+    after = None
+    try:
+        while True:
+            sql, params = export_query(request, after, batch_size)
+            # Released before the batch is sent, however slowly the client
+            # reads: a held connection would starve the pool and an open
+            # read transaction would stop WAL checkpoints
+            with connection() as conn:
+                rows = conn.execute(sql, params).fetchall()
+            if not rows:
+                break
+            after = rows[-1][:2]
+            writer.write_batch(_record_batch(pa, schema, [row[2:] for row in rows]))
+            rows_written += len(rows)
+            chunk = spool.drain()
+            if chunk:
+                yield chunk
+            if len(rows) < batch_size:
+                break
+    finally:
+        EXPORT_ROWS.inc(rows_written, table=request.table, format=request.format)
+    writer.close()
+    yield spool.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export food_items or meal_logs as Parquet or Arrow")
+    parser.add_argument('table', choices=list(EXPORT_TABLES))
+    parser.add_argument('output', help="file to write, or - for stdout")
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='parquet')
+    parser.add_argument('--columns', help="comma-separated projection")
+    parser.add_argument('--from', dest='start', help="ISO 8601 start (inclusive)")
+    parser.add_argument('--to', dest='end', help="ISO 8601 end (exclusive)")
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    request = parse_export(args.table, {'format': args.format, 'columns': args.columns,
+                                        'from': args.start, 'to': args.end})
+    out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        for chunk in iter_export(request, args.batch_size):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+import base64
+import json
+import math
+from collections import namedtuple
+from datetime import datetime
+
+from db import connection
+
+FOOD_COLUMNS = (
+    'id', 'name', 'calories', 'protein', 'carbs', 'fat', 'fiber',
+    'iron', 'calcium', 'magnesium', 'zinc', 'potassium',
+    'benefits', 'drawbacks', 'alternatives', 'timestamp',
+)
+
+# The cursor is built from these, so they are always selected
+KEY_COLUMNS = ('id', 'timestamp')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Rows per keyset page (one short read each) when a listing is streamed
+STREAM_BATCH_SIZE = 500
+
+# Columns that take min_<column>=/max_<column>= range filters
+NUTRIENT_COLUMNS = (
+    'calories', 'protein', 'carbs', 'fat', 'fiber',
+    'iron', 'calcium', 'magnesium', 'zinc', 'potassium',
+)
+
+# Every sort key has an index ending in the rowid (idx_food_items_timestamp
+# and the per-nutrient indexes of migrations 8 and 12), so ORDER BY <key>, id
+# walks the index and a page costs the same at any depth
+SORT_COLUMNS = ('timestamp',) + NUTRIENT_COLUMNS
+
+# Free text, kept out of the listing indexes
+TEXT_COLUMNS = ('benefits', 'drawbacks', 'alternatives')
+
+# What the per-nutrient indexes hold (migration 12): a listing sorted or
+# filtered by a nutrient and projected to these (fields=) never reads the
+# table
+INDEXED_COLUMNS = tuple(c for c in FOOD_COLUMNS if c not in TEXT_COLUMNS)
+
+SORT_ORDERS = ('asc', 'desc')
+
+FoodView = namedtuple('FoodView', ['sort', 'order', 'ranges', 'meal_type', 'start', 'end'])
+
+# Newest first, unfiltered: what the dashboard shows by default
+DEFAULT_VIEW = FoodView('timestamp', 'desc', (), None, None, None)
+
+PAGE_QUERY = "SELECT {columns} FROM food_items{where} ORDER BY {sort} {order}, id {order} LIMIT ?"
+
+# Probes idx_meal_logs_meal_type (meal_type, food_id) per candidate row, so
+# the sort index still drives the scan
+MEAL_TYPE_CONDITION = "EXISTS (SELECT 1 FROM meal_logs WHERE meal_type = ? AND food_id = food_items.id)"
+
+# Keyset conditions continuing a listing after a cursor. NULL sort values
+# can't be reached by the row-value comparison; SQLite sorts them first, so
+# they are the tail of a descending listing and the head of an ascending one,
+# and are paged by id alone.
+AFTER_VALUE = "({sort}, id) {op} (?, ?)"
+WITHIN_NULLS = "{sort} IS NULL AND id {op} ?"
+NOT_NULL = "{sort} IS NOT NULL"
+
+# Larger than any rowid, so a descending listing enters its NULL tail at the
+# first row
+MAX_ROWID = 2 ** 63 - 1
+
+MATCHING_IDS_QUERY = """
+    SELECT id FROM food_items
+    WHERE id IN (SELECT value FROM json_each(?)) AND {conditions}
+"""
+
+
+class InvalidQuery(ValueError):
+    """
+    Raised for malformed listing parameters; the API maps it to a 400.
+    """
+
+
+def encode_cursor(value, food_id, view=DEFAULT_VIEW):
+    key = [value, food_id]
+    if (view.sort, view.order) != (DEFAULT_VIEW.sort, DEFAULT_VIEW.order):
+        # Ties the cursor to its sort, so it can't be replayed against another
+        key.append(f"{view.sort}:{view.order}")
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, view=DEFAULT_VIEW):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(key, list) or len(key) not in (2, 3):
+            raise ValueError
+        value, food_id = key[:2]
+        sort = key[2] if len(key) == 3 else f"{DEFAULT_VIEW.sort}:{DEFAULT_VIEW.order}"
+        if not isinstance(food_id, int) or isinstance(food_id, bool) or not -MAX_ROWID - 1 <= food_id <= MAX_ROWID:
+            raise ValueError
+    except (ValueError, TypeError):
+        raise InvalidQuery(f"Invalid cursor: {cursor!r}")
+    if sort != f"{view.sort}:{view.order}":
+        raise InvalidQuery("cursor belongs to a different sort; start again without it")
+    if not _valid_sort_value(value, view.sort):
+        raise InvalidQuery(f"Invalid cursor: {cursor!r}")
+    return value, food_id
+
+
+def _valid_sort_value(value, sort):
+    # What encode_cursor can have put there: NULL, or the column's type
+    if value is None:
+        return True
+    if sort == 'timestamp':
+        return isinstance(value, str)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    if isinstance(value, int):
+        return -MAX_ROWID - 1 <= value <= MAX_ROWID
+    return math.isfinite(value)
+
+
+def parse_moment(value, name):
+    if not isinstance(value, str):
+        raise InvalidQuery(f"{name} must be an ISO 8601 date or datetime")
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        raise InvalidQuery(f"{name} must be an ISO 8601 date or datetime")
+
+
+def _parse_number(value, name):
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise InvalidQuery(f"{name} must be a number")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise InvalidQuery(f"{name} must be a number")
+    if not math.isfinite(number):
+        raise InvalidQuery(f"{name} must be a finite number")
+    return number
+
+
+def parse_view(args):
+    """
+    Build a FoodView from listing arguments (query string or refresh_data
+    payload): min_<nutrient>=/max_<nutrient>= (inclusive), meal_type=,
+    from=/to= on the timestamp (to exclusive), sort=<column> and
+    order=asc|desc.
+    """
+    sort = args.get('sort') or DEFAULT_VIEW.sort
+    if sort not in SORT_COLUMNS:
+        raise InvalidQuery(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    order = args.get('order') or DEFAULT_VIEW.order
+    if order not in SORT_ORDERS:
+        raise InvalidQuery("order must be asc or desc")
+
+    unknown = [k for k in args if k.startswith(('min_', 'max_')) and k[4:] not in NUTRIENT_COLUMNS]
+    if unknown:
+        raise InvalidQuery(f"Unknown filter(s): {', '.join(unknown)}")
+    ranges = []
+    for column in NUTRIENT_COLUMNS:
+        low = _parse_number(args.get(f'min_{column}'), f'min_{column}')
+        high = _parse_number(args.get(f'max_{column}'), f'max_{column}')
+        if low is not None and high is not None and low > high:
+            raise InvalidQuery(f"min_{column} must not exceed max_{column}")
+        if low is not None or high is not None:
+            ranges.append((column, low, high))
+
+    meal_type = args.get('meal_type') or None
+    if meal_type is not None and (not isinstance(meal_type, str) or len(meal_type) > 64):
+        raise InvalidQuery("meal_type must be a string of at most 64 characters")
+
+    start = end = None
+    if args.get('from'):
+        start = parse_moment(args['from'], 'from').strftime('%Y-%m-%d %H:%M:%S')
+    if args.get('to'):
+        end = parse_moment(args['to'], 'to').strftime('%Y-%m-%d %H:%M:%S')
+    if start is not None and end is not None and start >= end:
+        raise InvalidQuery("from must be earlier than to")
+    return FoodView(sort, order, tuple(ranges), meal_type, start, end)
+
+
+def view_args(view):
+    """
+    The arguments parse_view() turns back into view, in a fixed order.
+    """
+    args = {}
+    if view.sort != DEFAULT_VIEW.sort:
+        args['sort'] = view.sort
+    if view.order != DEFAULT_VIEW.order:
+        args['order'] = view.order
+    for column, low, high in view.ranges:
+        if low is not None:
+            args[f'min_{column}'] = low
+        if high is not None:
+            args[f'max_{column}'] = high
+    for name, value in (('meal_type', view.meal_type), ('from', view.start), ('to', view.end)):
+        if value is not None:
+            args[name] = value
+    return args
+
+
+def view_conditions(view):
+    """
+    WHERE conditions and parameters for view's filters. Column names only
+    ever come from NUTRIENT_COLUMNS / SORT_COLUMNS.
+    """
+    conditions, params = [], []
+    for column, low, high in view.ranges:
+        if low is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append(f"{column} <= ?")
+            params.append(high)
+    if view.start is not None:
+        conditions.append("timestamp >= ?")
+        params.append(view.start)
+    if view.end is not None:
+        conditions.append("timestamp < ?")
+        params.append(view.end)
+    if view.meal_type is not None:
+        conditions.append(MEAL_TYPE_CONDITION)
+        params.append(view.meal_type)
+    return conditions, params
+
+
+def page_query(view, columns=FOOD_COLUMNS, keyset=None):
+    """
+    Return (sql, params) for one page of view. keyset is None for the first
+    page or one of AFTER_VALUE / WITHIN_NULLS / NOT_NULL; its own parameters
+    and the LIMIT follow params.
+    """
+    conditions, params = view_conditions(view)
+    if keyset is not None:
+        conditions.append(keyset.format(sort=view.sort, op='<' if view.order == 'desc' else '>'))
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    sql = PAGE_QUERY.format(columns=', '.join(columns), where=where,
+                            sort=view.sort, order=view.order.upper())
+    return sql, tuple(params)
+
+
+def parse_fields(fields):
+    """
+    Validate a comma-separated fields= projection against FOOD_COLUMNS.
+    """
+    if not fields:
+        return FOOD_COLUMNS
+    requested = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in FOOD_COLUMNS]
+    if unknown:
+        raise InvalidQuery(f"Unknown field(s): {', '.join(unknown)}")
+    # Preserve table order and always carry the cursor key
+    return tuple(c for c in FOOD_COLUMNS if c in requested or c in KEY_COLUMNS)
+
+
+def parse_limit(limit, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    if limit in (None, ''):
+        return default
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise InvalidQuery(f"Invalid limit: {limit!r}")
+    if limit < 1:
+        raise InvalidQuery("limit must be positive")
+    if limit > MAX_ROWID:
+        # More than SQLite's LIMIT can hold
+        raise InvalidQuery("limit is too large")
+    return limit if maximum is None else min(limit, maximum)
+
+
+def _listing_columns(columns, view):
+    if view.sort not in columns:
+        # The cursor is built from the sort key, so it is always selected
+        columns = tuple(c for c in FOOD_COLUMNS if c in columns or c == view.sort)
+    return columns
+
+
+def _keyset_steps(cursor, view):
+    """
+    The (keyset, params) queries that continue view after cursor, in order.
+    """
+    if cursor is None:
+        return [(None, ())]
+    descending = view.order == 'desc'
+    value, food_id = decode_cursor(cursor, view)
+    if value is None:
+        steps = [(WITHIN_NULLS, (food_id,))]
+        if not descending:
+            steps.append((NOT_NULL, ()))
+    else:
+        steps = [(AFTER_VALUE, (value, food_id))]
+        if descending:
+            steps.append((WITHIN_NULLS, (MAX_ROWID,)))
+    return steps
+
+
+def fetch_foods_page(limit=DEFAULT_PAGE_SIZE, cursor=None, columns=FOOD_COLUMNS, view=DEFAULT_VIEW,
+                     conn=None):
+    """
+    Return (foods, next_cursor) for one page of food_items in view's order
+    (newest first by default). next_cursor is None on the last page.
+    """
+    if conn is None:
+        with connection() as conn:
+            return fetch_foods_page(limit, cursor, columns, view, conn)
+    columns = _listing_columns(columns, view)
+    steps = _keyset_steps(cursor, view)
+
+    # Each step runs only while the page is short; fetch one extra row to
+    # learn whether another page exists
+    rows = []
+    for keyset, keyset_params in steps:
+        if len(rows) > limit:
+            break
+        sql, params = page_query(view, columns, keyset)
+        rows += conn.execute(sql, params + keyset_params + (limit + 1 - len(rows),)).fetchall()
+
+    foods = [dict(zip(columns, row)) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = foods[-1]
+        next_cursor = encode_cursor(last[view.sort], last['id'], view)
+    return foods, next_cursor
+
+
+def iter_foods(cursor=None, columns=FOOD_COLUMNS, view=DEFAULT_VIEW, limit=None,
+               batch_size=STREAM_BATCH_SIZE):
+    """
+    Return an iterator over lists of food dicts: every row of view after
+    cursor (or the first `limit`), batch_size at a time. Each batch is a
+    keyset page of its own, so a connection is held only while a batch is
+    read, never while the client drains it. The cursor is checked here,
+    before anything is streamed.
+    """
+    if cursor is not None:
+        decode_cursor(cursor, view)
+    return _stream_foods(cursor, columns, view, limit, batch_size)
+
+
+def _stream_foods(cursor, columns, view, limit, batch_size):
+    # Rows written mid-stream show up if they sort after the batch being
+    # read; nothing is repeated or skipped
+    remaining = limit
+    while remaining != 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        foods, cursor = fetch_foods_page(size, cursor, columns, view)
+        if foods:
+            yield foods
+        if cursor is None:
+            return
+        if remaining is not None:
+            remaining -= len(foods)
+
+
+def matching_ids(conn, view, ids):
+    """
+    The subset of ids whose rows currently pass view's filters, checked in
+    SQL so meal_type and the ranges mean exactly what they do in a listing.
+    """
+    conditions, params = view_conditions(view)
+    if not conditions or not ids:
+        return set(ids)
+    # One statement text for any number of ids
+    sql = MATCHING_IDS_QUERY.format(conditions=' AND '.join(conditions))
+    rows = conn.execute(sql, (json.dumps(list(ids)),) + tuple(params))
+    return {row[0] for row in rows}
@@ -0,0 +1,70 @@
+from db import connection
+
+# A single counter bumped by triggers on every write to food_items or
+# meal_logs; readers compare it to decide whether anything changed
+GENERATION_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS data_generation
+       (id INTEGER PRIMARY KEY CHECK (id = 1), value INTEGER NOT NULL)''',
+    "INSERT OR IGNORE INTO data_generation (id, value) VALUES (1, 0)",
+] + [
+    f'''CREATE TRIGGER IF NOT EXISTS {table}_generation_{op.lower()} AFTER {op} ON {table}
+       BEGIN
+           UPDATE data_generation SET value = value + 1 WHERE id = 1;
+       END'''
+    for table in ('food_items', 'meal_logs')
+    for op in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+# Migration 10 adds data_generation.changed_at, set by the same triggers:
+# when the counter last moved, i.e. when the data last changed in any way
+# (deletes, updates and back-dated rows included)
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+GENERATION_TIMESTAMP_SCHEMA = [
+    f"UPDATE data_generation SET changed_at = {NOW} WHERE id = 1 AND changed_at IS NULL",
+] + [
+    statement
+    for table in ('food_items', 'meal_logs')
+    for op in ('INSERT', 'UPDATE', 'DELETE')
+    for statement in (
+        f"DROP TRIGGER IF EXISTS {table}_generation_{op.lower()}",
+        f'''CREATE TRIGGER {table}_generation_{op.lower()} AFTER {op} ON {table}
+           BEGIN
+               UPDATE data_generation SET value = value + 1, changed_at = {NOW} WHERE id = 1;
+           END''',
+    )
+]
+
+GENERATION_QUERY = "SELECT value FROM data_generation WHERE id = 1"
+
+CHANGED_AT_QUERY = "SELECT changed_at FROM data_generation WHERE id = 1"
+
+
+def create_generation_counter(conn):
+    for statement in GENERATION_SCHEMA:
+        conn.execute(statement)
+
+
+def add_generation_timestamp(conn):
+    for statement in GENERATION_TIMESTAMP_SCHEMA:
+        conn.execute(statement)
+
+
+def current_generation(conn=None):
+    if conn is None:
+        with connection() as conn:
+            return current_generation(conn)
+    row = conn.execute(GENERATION_QUERY).fetchone()
+    return row[0] if row else 0
+
+
+def generation_changed_at(conn=None):
+    """
+    When the data generation last moved, as stored (naive UTC text), or
+    None before the first write.
+    """
+    if conn is None:
+        with connection() as conn:
+            return generation_changed_at(conn)
+    row = conn.execute(CHANGED_AT_QUERY).fetchone()
+    return row[0] if row else None
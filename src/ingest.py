@@ -0,0 +1,255 @@
+import json
+import math
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+from db import transaction
+from metrics import REGISTRY
+from snapshot import MEAL_TYPES
+
+# Rows per write transaction: large enough to amortise the commit and the
+# WAL fsync, small enough that readers never wait long on the write lock
+BATCH_SIZE = 5000
+
+# Rejected rows reported back in full; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+FOOD_NUMERIC_FIELDS = (
+    'calories', 'protein', 'carbs', 'fat', 'fiber',
+    'iron', 'calcium', 'magnesium', 'zinc', 'potassium',
+)
+
+FOOD_TEXT_FIELDS = ('benefits', 'drawbacks', 'alternatives')
+
+FOOD_INSERT = """
+    INSERT INTO food_items (name, {numeric}, {text}, timestamp, ingest_key)
+    VALUES (?, {numeric_params}, {text_params}, ?, ?)
+    ON CONFLICT DO NOTHING
+""".format(
+    numeric=', '.join(FOOD_NUMERIC_FIELDS),
+    text=', '.join(FOOD_TEXT_FIELDS),
+    numeric_params=', '.join('?' * len(FOOD_NUMERIC_FIELDS)),
+    text_params=', '.join('?' * len(FOOD_TEXT_FIELDS)),
+)
+
+MEAL_INSERT = """
+    INSERT INTO meal_logs (food_id, meal_type, timestamp, ingest_key)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT DO NOTHING
+"""
+
+# food_key lets a meal reference a food ingested in an earlier backfill
+# request by its idempotency key instead of a database id
+FOOD_BY_KEY_QUERY = "SELECT id FROM food_items WHERE ingest_key = ?"
+
+
+INGEST_ROWS = REGISTRY.counter(
+    'nutrilens_ingest_rows', "Rows received by bulk ingest, by outcome", ['kind', 'result'])
+INGEST_DURATION = REGISTRY.histogram(
+    'nutrilens_ingest_duration_seconds', "Wall time of one bulk ingest request", ['kind'])
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def _number(record, field):
+    value = record.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise InvalidRow(f"{field} must be a number")
+    if not math.isfinite(value) or value < 0:
+        raise InvalidRow(f"{field} must be a non-negative finite number")
+    return value
+
+
+def _text(record, field):
+    value = record.get(field)
+    if value is None:
+        return None
+    if isinstance(value, list):
+        # extract_food_responses.py produces these as lists of sentences
+        value = '; '.join(str(v) for v in value)
+    if not isinstance(value, str):
+        raise InvalidRow(f"{field} must be a string")
+    return value
+
+
+def _timestamp(record):
+    value = record.get('timestamp')
+    if value is None:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise InvalidRow("timestamp must be ISO 8601")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    # Stored as naive UTC text so it sorts correctly in idx_food_items_timestamp
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _key(record, default_key):
+    key = record.get('idempotency_key', default_key)
+    if key is not None and not isinstance(key, str):
+        raise InvalidRow("idempotency_key must be a string")
+    return key
+
+
+def food_params(record, default_key=None):
+    if not isinstance(record, dict):
+        raise InvalidRow("row must be a JSON object")
+    name = record.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise InvalidRow("name is required")
+    return (
+        (name.strip(),)
+        + tuple(_number(record, f) for f in FOOD_NUMERIC_FIELDS)
+        + tuple(_text(record, f) for f in FOOD_TEXT_FIELDS)
+        + (_timestamp(record), _key(record, default_key))
+    )
+
+
+def meal_params(record, default_key=None):
+    if not isinstance(record, dict):
+        raise InvalidRow("row must be a JSON object")
+    food_id, food_key = record.get('food_id'), record.get('food_key')
+    if food_id is None and food_key is None:
+        raise InvalidRow("food_id or food_key is required")
+    if food_id is not None and (isinstance(food_id, bool) or not isinstance(food_id, int)):
+        raise InvalidRow("food_id must be an integer")
+    if food_id is None and not isinstance(food_key, str):
+        raise InvalidRow("food_key must be a string")
+    if record.get('meal_type') not in MEAL_TYPES:
+        raise InvalidRow(f"meal_type must be one of {', '.join(MEAL_TYPES)}")
+    return (food_id if food_id is not None else food_key, record['meal_type'],
+            _timestamp(record), _key(record, default_key))
+
+
+def resolve_food_key(conn, params):
+    """
+    Swap a meal's food_key for the id of the food ingested under it; the
+    meal is rejected when there is none.
+    """
+    food = params[0]
+    if not isinstance(food, str):
+        return params
+    row = conn.execute(FOOD_BY_KEY_QUERY, (food,)).fetchone()
+    if row is None:
+        raise InvalidRow("food not found")
+    return (row[0],) + params[1:]
+
+
+INGESTERS = {
+    'foods': (FOOD_INSERT, food_params, None),
+    'meals': (MEAL_INSERT, meal_params, resolve_food_key),
+}
+
+
+def iter_ndjson(lines):
+    """
+    Yield (line_number, record) from an iterable of NDJSON lines; lines that
+    are not valid JSON yield an InvalidRow in place of the record.
+    """
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, InvalidRow("invalid JSON")
+
+
+def ingest(kind, records, request_key=None, batch_size=BATCH_SIZE):
+    """
+    Validate and insert (position, record) pairs in batched transactions.
+
+    Rows carry their own idempotency_key; when a request-level key is
+    given, rows without one get "<request_key>:<position>", so replaying
+    the same request (or the tail of a failed one) inserts nothing twice.
+    """
+    sql, to_params, resolve = INGESTERS[kind]
+    report = {'received': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0, 'errors': []}
+    start = time.perf_counter()
+    batch = []
+    positions = []
+
+    def reject(position, error):
+        report['rejected'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': position, 'error': error})
+
+    def insert_rows(conn):
+        # Slow path for a batch holding a row that violates a constraint
+        # (e.g. a meal whose food does not exist): reject just that row
+        inserted = 0
+        for position, params in zip(positions, batch):
+            try:
+                inserted += conn.execute(sql, params).rowcount
+            except sqlite3.IntegrityError as e:
+                reject(position, "food not found" if 'FOREIGN KEY' in str(e) else str(e))
+        return inserted
+
+    def resolve_rows(conn):
+        resolved, kept = [], []
+        for position, params in zip(positions, batch):
+            try:
+                resolved.append(resolve(conn, params))
+            except InvalidRow as e:
+                reject(position, str(e))
+                continue
+            kept.append(position)
+        batch[:] = resolved
+        positions[:] = kept
+
+    def flush():
+        inserted = failed = 0
+        with transaction() as conn:
+            if resolve is not None:
+                resolve_rows(conn)
+            if batch:
+                conn.execute("SAVEPOINT ingest_batch")
+                try:
+                    # rowcount sums sqlite3_changes() per row: rows skipped by
+                    # ON CONFLICT DO NOTHING count 0 and trigger writes are excluded
+                    inserted = conn.executemany(sql, batch).rowcount
+                except sqlite3.IntegrityError:
+                    conn.execute("ROLLBACK TO ingest_batch")
+                    before = report['rejected']
+                    inserted = insert_rows(conn)
+                    failed = report['rejected'] - before
+                conn.execute("RELEASE ingest_batch")
+        report['inserted'] += inserted
+        report['duplicates'] += len(batch) - inserted - failed
+        batch.clear()
+        positions.clear()
+
+    for position, record in records:
+        report['received'] += 1
+        try:
+            if isinstance(record, InvalidRow):
+                raise record
+            default_key = f"{request_key}:{position}" if request_key else None
+            batch.append(to_params(record, default_key))
+        except InvalidRow as e:
+            reject(position, str(e))
+            continue
+        positions.append(position)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    elapsed = time.perf_counter() - start
+    INGEST_DURATION.observe(elapsed, kind=kind)
+    INGEST_ROWS.inc(report['inserted'], kind=kind, result='inserted')
+    INGEST_ROWS.inc(report['duplicates'], kind=kind, result='duplicate')
+    INGEST_ROWS.inc(report['rejected'], kind=kind, result='rejected')
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['inserted'] / elapsed) if elapsed > 0 else 0
+    return report
@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from assets import FILE_SUFFIXES, make_asset
+from db import connection
+from deltas import change_head, reset_payload
+from generation import current_generation
+from metrics import REGISTRY
+from snapshot import compute_snapshot
+from tenants import user_scope
+from workers import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# When set, every materialized dashboard is also written here (with .gz/.br
+# siblings) for a front proxy to serve as a static file:
+# <dir>/dashboard.json for the shared database, <dir>/<user>/dashboard.json
+# per user
+SNAPSHOT_DIR = os.environ.get('NUTRILENS_SNAPSHOT_DIR')
+
+SNAPSHOT_FILE = 'dashboard.json'
+
+# Users nobody has asked for in this long stop being rebuilt (and polled)
+IDLE_AFTER = 600.0
+
+MATERIALIZE_DURATION = REGISTRY.histogram(
+    'nutrilens_materialize_duration_seconds', "Time to rebuild one user's materialized dashboard")
+
+
+class Dashboard(namedtuple('Dashboard', ['user_id', 'generation', 'built_at', 'document', 'asset'])):
+    """
+    One user's dashboard as of one data generation: a reset payload for the
+    default view (stats, charts, first page of foods and the change-log
+    cursor they correspond to), serialized and compressed once.
+    """
+    __slots__ = ()
+
+
+def build_dashboard(user_id):
+    with user_scope(user_id), connection() as conn:
+        # One read transaction, so the aggregates, the foods, the change-log
+        # cursor and the generation they are labelled with all agree
+        conn.execute("BEGIN")
+        try:
+            generation = current_generation(conn)
+            document = reset_payload(change_head(conn), compute_snapshot(conn), conn=conn)
+        finally:
+            conn.execute("COMMIT")
+    document['generation'] = generation
+    body = json.dumps(document, separators=(',', ':')).encode()
+    return Dashboard(user_id, generation, time.time(), document,
+                     make_asset(SNAPSHOT_FILE, body, 'application/json'))
+
+
+def write_atomically(path, data):
+    # A reader sees the old file or the new one, never a partial write
+    directory = os.path.dirname(path)
+    fd, temp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+def snapshot_path(directory, user_id):
+    if user_id is None:
+        return os.path.join(directory, SNAPSHOT_FILE)
+    return os.path.join(directory, user_id, SNAPSHOT_FILE)
+
+
+class Materializer:
+    """
+    Keep a prebuilt Dashboard per user, rebuilt in the background.
+
+    A background task polls the data generation of every user whose
+    dashboard was read in the last `idle_after` seconds. When one moves it
+    waits `debounce` seconds for the write burst to settle, rebuilds the
+    dashboard off the event loop and swaps it in. Readers only ever take the
+    latest Dashboard, so once a user is warm a read costs no queries
+    whatever the size of their history; only the very first read for a user
+    builds synchronously.
+
+    start() must be called where the server's event loop runs (app setup,
+    a socket handler), never from a view: views run on executor threads,
+    and a green thread spawned there would never be scheduled.
+    """
+
+    def __init__(self, socketio, interval=0.5, debounce=0.2, idle_after=IDLE_AFTER,
+                 directory=SNAPSHOT_DIR):
+        self.socketio = socketio
+        self.interval = interval
+        self.debounce = debounce
+        self.idle_after = idle_after
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._task = None
+        self._stopped = None
+        self._dashboards = {}
+        self._last_read = {}
+
+    def get(self, user_id):
+        """
+        The latest Dashboard for user_id, building it now on first use.
+        """
+        with self._lock:
+            dashboard = self._dashboards.get(user_id)
+            self._last_read[user_id] = time.monotonic()
+        if dashboard is None:
+            dashboard = self.rebuild(user_id)
+        return dashboard
+
+    def start(self):
+        with self._lock:
+            if self._task is not None:
+                return
+            # A flag per run, as in Broadcaster.start()
+            self._stopped = threading.Event()
+            self._task = self.socketio.start_background_task(self._run, self._stopped)
+
+    def stop(self, timeout=None):
+        """
+        Stop refreshing; the task exits at its next tick, or before
+        returning when a timeout to wait for it is given.
+        """
+        with self._lock:
+            task, stopped = self._task, self._stopped
+            self._task = self._stopped = None
+        if task is None:
+            return
+        stopped.set()
+        if timeout is not None:
+            task.join(timeout)
+
+    def rebuild(self, user_id):
+        started = time.perf_counter()
+        dashboard = build_dashboard(user_id)
+        MATERIALIZE_DURATION.observe(time.perf_counter() - started)
+        with self._lock:
+            current = self._dashboards.get(user_id)
+            if current is not None and current.generation > dashboard.generation:
+                # A concurrent rebuild saw a later generation
+                return current
+            self._dashboards[user_id] = dashboard
+        if self.directory:
+            self.write(dashboard)
+        return dashboard
+
+    def write(self, dashboard):
+        path = snapshot_path(self.directory, dashboard.user_id)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Compressed siblings first, so the plain file never points at
+            # a newer generation than they hold
+            for encoding, body in sorted(dashboard.asset.bodies.items(), key=lambda e: e[0] == 'identity'):
+                write_atomically(path + FILE_SUFFIXES.get(encoding, ''), body)
+            for encoding, suffix in FILE_SUFFIXES.items():
+                # A body too small to compress must not leave an old sibling
+                if encoding not in dashboard.asset.bodies and os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        except OSError:
+            logger.exception("Writing the materialized dashboard to %s failed", path)
+
+    def _stale_users(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [u for u, at in self._last_read.items() if now - at > self.idle_after]
+            for user_id in idle:
+                self._dashboards.pop(user_id, None)
+                self._last_read.pop(user_id, None)
+            dashboards = list(self._dashboards.values())
+        stale = []
+        for dashboard in dashboards:
+            try:
+                with user_scope(dashboard.user_id):
+                    generation = current_generation()
+            except Exception:
+                logger.exception("Reading the data generation for %s failed", dashboard.user_id)
+                continue
+            if generation != dashboard.generation:
+                stale.append(dashboard.user_id)
+        return stale
+
+    def _run(self, stopped):
+        while not stopped.is_set():
+            self.socketio.sleep(self.interval)
+            if stopped.is_set():
+                break
+            stale = run_blocking(self._stale_users)
+            if not stale:
+                continue
+            # Let the rest of the burst land before rebuilding
+            self.socketio.sleep(self.debounce)
+            for user_id in stale:
+                try:
+                    run_blocking(self.rebuild, user_id)
+                except Exception:
+                    logger.exception("Materializing the dashboard for %s failed", user_id)
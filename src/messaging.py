@@ -0,0 +1,376 @@
+"""
+Cross-worker messaging.
+
+NUTRILENS_MESSAGE_QUEUE selects the backend shared by every worker process:
+
+    redis://host:6379/0     Redis pub/sub (needs the redis package)
+    file:///var/run/nutri   NDJSON files in a shared directory, rotated as
+                            they grow; for tests and single-host setups
+                            without Redis
+    (unset)                 one process, messages delivered in-process
+
+Two things travel over it: Socket.IO emits (through a python-socketio
+client manager, so a room emit reaches sockets held by any worker) and
+NutriLens' own events, e.g. {"type": "changed", "user": ...} after a write,
+which drop stale cache entries and wake the broadcasters.
+"""
+import abc
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_QUEUE_URL = os.environ.get('NUTRILENS_MESSAGE_QUEUE')
+
+# How often file-backed listeners look for new lines
+FILE_POLL_INTERVAL = 0.05
+
+# A FileBus starts a new segment file once the current one reaches this size
+SEGMENT_BYTES = 4 * 1024 * 1024
+
+# Finished segments are deleted once this old; a listener further behind
+# than that skips to the oldest segment left
+SEGMENT_RETENTION = 60.0
+
+# After the next segment appears, a listener keeps reading the old one this
+# long for writers that picked it just before
+ROTATE_GRACE = 1.0
+
+EVENTS_CHANNEL = 'nutrilens-events'
+
+
+# Emits may carry binary arguments (msgpack update_data); JSON has no bytes,
+# so they travel as {"__bytes__": "<base64>"}
+BYTES_KEY = '__bytes__'
+
+
+def _encode_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {BYTES_KEY: base64.b64encode(value).decode('ascii')}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode_bytes(obj):
+    if len(obj) == 1 and BYTES_KEY in obj:
+        return base64.b64decode(obj[BYTES_KEY])
+    return obj
+
+
+def encode_message(message):
+    return json.dumps(message, separators=(',', ':'), default=_encode_bytes)
+
+
+def decode_message(raw):
+    return json.loads(raw, object_hook=_decode_bytes)
+
+
+class MessageBus(abc.ABC):
+    """
+    Publish JSON-serialisable dicts (bytes values allowed) to every worker,
+    including this one.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._started = False
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def _dispatch(self, message):
+        for callback in self._subscribers:
+            try:
+                callback(message)
+            except Exception:
+                logger.exception("Message handler failed for %r", message)
+
+    @abc.abstractmethod
+    def publish(self, message):
+        pass
+
+    @abc.abstractmethod
+    def listen(self, sleep):
+        """
+        Yield messages from every worker as they arrive, waiting with sleep.
+        """
+
+    def start(self, spawn, sleep):
+        """
+        Start delivering messages from other workers. spawn and sleep come
+        from the Socket.IO server so the listener matches its async mode.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        spawn(self._run, sleep)
+
+    def _run(self, sleep):
+        while not self._stopped.is_set():
+            try:
+                for message in self.listen(sleep):
+                    self._dispatch(message)
+            except Exception:
+                if self._stopped.is_set():
+                    # close() pulled the connection out from under it
+                    break
+                logger.exception("Message bus listener failed; reconnecting")
+                sleep(1)
+
+    def close(self):
+        """
+        Stop the listener started by start(); it returns at its next poll
+        or read. Subclasses release what the listener holds open.
+        """
+        self._stopped.set()
+
+
+class LocalBus(MessageBus):
+    """
+    Single-process stand-in: publish delivers synchronously.
+    """
+
+    def publish(self, message):
+        self._dispatch(message)
+
+    def listen(self, sleep):
+        return iter(())
+
+    def start(self, spawn, sleep):
+        pass
+
+
+class FileBus(MessageBus):
+    """
+    Append-only NDJSON files shared by the workers of one host. Messages go
+    to numbered segments, <channel>.<n>.ndjson; a writer that finds the
+    current one past segment_bytes starts the next and deletes finished
+    segments older than `retention`, so the directory holds about two
+    segments however long the workers run. Each listener tails the segments
+    in order from the position they had when it started.
+    """
+
+    def __init__(self, directory, channel=EVENTS_CHANNEL, segment_bytes=SEGMENT_BYTES,
+                 retention=SEGMENT_RETENTION):
+        super().__init__()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.channel = channel
+        self.segment_bytes = segment_bytes
+        self.retention = retention
+        segments = self._segments()
+        # Newest segment a write from this process went to
+        self._segment = segments[-1] if segments else 0
+        # Listeners only see lines written after the bus is created
+        self._read_segment = self._segment
+        self._offset = self._size(self._segment)
+        # Segment the listener has open
+        self._file = None
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{self.channel}.{number:08d}.ndjson")
+
+    def _segments(self):
+        prefix, suffix = f"{self.channel}.", '.ndjson'
+        numbers = []
+        for name in os.listdir(self.directory):
+            number = name[len(prefix):-len(suffix)]
+            if name.startswith(prefix) and name.endswith(suffix) and number.isdigit():
+                numbers.append(int(number))
+        return sorted(numbers)
+
+    def _size(self, number):
+        try:
+            return os.path.getsize(self._segment_path(number))
+        except FileNotFoundError:
+            return 0
+
+    def _rotate(self):
+        try:
+            # O_EXCL: when several writers rotate at once, one creates the
+            # segment and the rest just use it
+            os.close(os.open(self._segment_path(self._segment + 1), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+        except FileExistsError:
+            pass
+        self._segment += 1
+        self._prune()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        # The newest two stay: listeners may still be finishing the previous one
+        for number in self._segments()[:-2]:
+            path = self._segment_path(number)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def publish(self, message):
+        line = (encode_message(message) + '\n').encode()
+        while os.path.exists(self._segment_path(self._segment + 1)):
+            # Another process rotated
+            self._segment += 1
+        if self._size(self._segment) >= self.segment_bytes:
+            self._rotate()
+        # One write() on an O_APPEND descriptor, so lines from different
+        # processes never interleave
+        fd = os.open(self._segment_path(self._segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def listen(self, sleep):
+        while not self._stopped.is_set():
+            try:
+                f = open(self._segment_path(self._read_segment), 'rb')
+            except FileNotFoundError:
+                later = [n for n in self._segments() if n > self._read_segment]
+                if not later:
+                    # Nothing written yet
+                    sleep(FILE_POLL_INTERVAL)
+                    continue
+                if self._offset:
+                    logger.warning("Listener fell behind %s; skipping to segment %d",
+                                   self.directory, later[0])
+                self._read_segment, self._offset = later[0], 0
+                continue
+            self._file = f
+            with f:
+                yield from self._tail(f, sleep)
+            self._file = None
+            if self._stopped.is_set():
+                return
+            self._read_segment += 1
+            self._offset = 0
+
+    def _tail(self, f, sleep):
+        # Yield f's messages from self._offset until the next segment has
+        # taken over
+        f.seek(self._offset)
+        following = self._segment_path(self._read_segment + 1)
+        pending = b''
+        idle_since = None
+        while not self._stopped.is_set():
+            chunk = f.readline()
+            if not chunk:
+                if os.path.exists(following):
+                    if idle_since is None:
+                        idle_since = time.monotonic()
+                    if time.monotonic() - idle_since >= ROTATE_GRACE:
+                        return
+                sleep(FILE_POLL_INTERVAL)
+                continue
+            idle_since = None
+            pending += chunk
+            if not pending.endswith(b'\n'):
+                # A writer is mid-line; wait for the rest
+                continue
+            self._offset = f.tell()
+            line, pending = pending, b''
+            try:
+                yield decode_message(line)
+            except ValueError:
+                logger.warning("Skipping malformed message in %s", f.name)
+
+    def close(self):
+        super().close()
+        f = self._file
+        if f is not None:
+            f.close()
+
+
+class RedisBus(MessageBus):
+
+    def __init__(self, url, channel=EVENTS_CHANNEL):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("NUTRILENS_MESSAGE_QUEUE is a redis:// URL but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self._pubsub = None
+
+    def publish(self, message):
+        self.client.publish(self.channel, encode_message(message))
+
+    def listen(self, sleep):
+        pubsub = self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        try:
+            for item in pubsub.listen():
+                if item['type'] == 'message':
+                    yield decode_message(item['data'])
+        finally:
+            self._pubsub = None
+            pubsub.close()
+
+    def close(self):
+        super().close()
+        # Closing the connection ends the blocking read in listen()
+        pubsub = self._pubsub
+        if pubsub is not None:
+            pubsub.close()
+
+
+def _file_manager_class():
+    # python-socketio is only imported where the server is built
+    import socketio
+
+    class FileManager(socketio.PubSubManager):
+        """
+        python-socketio client manager that relays emits through a FileBus,
+        the file-backed counterpart of socketio.RedisManager.
+        """
+        name = 'file'
+
+        def __init__(self, directory, channel='socketio', write_only=False, logger=None):
+            self.bus = FileBus(directory, channel)
+            super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+        def _publish(self, data):
+            self.bus.publish(data)
+
+        def _listen(self):
+            yield from self.bus.listen(self.server.sleep)
+
+    return FileManager
+
+
+def _file_directory(url):
+    parsed = urlparse(url)
+    return (parsed.netloc + parsed.path) or '.'
+
+
+def create_bus(url=MESSAGE_QUEUE_URL):
+    if not url:
+        return LocalBus()
+    scheme = urlparse(url).scheme
+    if scheme in ('redis', 'rediss'):
+        return RedisBus(url)
+    if scheme == 'file':
+        return FileBus(_file_directory(url))
+    raise RuntimeError(f"Unsupported NUTRILENS_MESSAGE_QUEUE scheme: {scheme}")
+
+
+def socketio_options(url=MESSAGE_QUEUE_URL):
+    """
+    Keyword arguments for SocketIO() that route emits through the queue.
+    """
+    if not url:
+        return {}
+    scheme = urlparse(url).scheme
+    if scheme in ('redis', 'rediss'):
+        return {'message_queue': url}
+    if scheme == 'file':
+        return {'client_manager': _file_manager_class()(_file_directory(url))}
+    raise RuntimeError(f"Unsupported NUTRILENS_MESSAGE_QUEUE scheme: {scheme}")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for food_analysis.db.
+
+The applied version lives in PRAGMA user_version. Each migration runs in its
+own BEGIN IMMEDIATE transaction together with the version bump, so a crash
+never leaves a half-applied step and concurrent workers starting at the same
+time apply each migration exactly once.
+"""
+import argparse
+import logging
+from collections import namedtuple
+
+from db import connection, transaction
+from deltas import create_change_log
+from foods import INDEXED_COLUMNS, NUTRIENT_COLUMNS
+from generation import add_generation_timestamp, create_generation_counter
+from rollups import create_bucket_rollups, create_rollups
+from search import create_search_index, rebuild_search_index
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple('Migration', ['version', 'description', 'steps'])
+
+
+def add_column(table, column, declaration):
+    """
+    Migration step adding a column unless it is already there (ALTER TABLE
+    ADD COLUMN has no IF NOT EXISTS form).
+    """
+    def step(conn):
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return step
+
+
+def nutrient_listing_index(column):
+    # The column, then id for the keyset tie-break, then the rest of
+    # INDEXED_COLUMNS: timestamp filters are checked in the index, and only
+    # projections with free text need the table row
+    covered = [c for c in INDEXED_COLUMNS if c not in (column, 'id')]
+    return f"CREATE INDEX idx_food_items_{column} ON food_items ({column}, id, {', '.join(covered)})"
+
+
+MIGRATIONS = [
+    Migration(1, "create food_items and meal_logs", [
+        '''CREATE TABLE IF NOT EXISTS food_items
+           (id INTEGER PRIMARY KEY, name TEXT, calories INTEGER,
+            protein REAL, carbs REAL, fat REAL, fiber REAL,
+            iron REAL, calcium REAL, magnesium REAL, zinc REAL, potassium REAL,
+            benefits TEXT, drawbacks TEXT, alternatives TEXT,
+            timestamp DATETIME)''',
+        '''CREATE TABLE IF NOT EXISTS meal_logs
+           (id INTEGER PRIMARY KEY, food_id INTEGER, meal_type TEXT,
+            timestamp DATETIME, FOREIGN KEY (food_id) REFERENCES food_items(id))''',
+    ]),
+    Migration(2, "add trigger-maintained rollup tables", [
+        create_rollups,
+    ]),
+    Migration(3, "index food_items.timestamp and meal_logs.meal_type", [
+        # /api/foods ordering; id breaks ties between rows logged in the same second
+        "CREATE INDEX IF NOT EXISTS idx_food_items_timestamp ON food_items (timestamp, id)",
+        # meal_logs (food_id) is created with the rollups in migration 2
+        # Covers the per-meal GROUP BY used when rebuilding meal_totals
+        "CREATE INDEX IF NOT EXISTS idx_meal_logs_meal_type ON meal_logs (meal_type, food_id)",
+    ]),
+    Migration(4, "add food_changes log for update_data deltas", [
+        create_change_log,
+    ]),
+    Migration(5, "add data_generation counter", [
+        create_generation_counter,
+    ]),
+    Migration(6, "add ingest_key idempotency columns", [
+        add_column('food_items', 'ingest_key', 'TEXT'),
+        add_column('meal_logs', 'ingest_key', 'TEXT'),
+        # Partial, so rows written without a key don't pay for the index
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_food_items_ingest_key
+           ON food_items (ingest_key) WHERE ingest_key IS NOT NULL''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_meal_logs_ingest_key
+           ON meal_logs (ingest_key) WHERE ingest_key IS NOT NULL''',
+    ]),
+    Migration(7, "add hourly/daily/weekly nutrition rollups", [
+        create_bucket_rollups,
+    ]),
+    Migration(8, "index nutrient columns for /api/foods filters and sorts", [
+        # (column, rowid): serves both min_/max_ range seeks and the
+        # ORDER BY <column>, id keyset walk
+        f"CREATE INDEX IF NOT EXISTS idx_food_items_{column} ON food_items ({column})"
+        for column in NUTRIENT_COLUMNS
+    ]),
+    Migration(9, "add food_search FTS5 index for /api/search", [
+        create_search_index,
+        rebuild_search_index,
+    ]),
+    Migration(10, "record when the data generation last changed, for Last-Modified", [
+        add_column('data_generation', 'changed_at', 'TEXT'),
+        add_generation_timestamp,
+    ]),
+    Migration(11, "index meal_logs.timestamp for date-range exports", [
+        # Serves ?from=&to= on /api/export/meal_logs and its ORDER BY timestamp, id
+        "CREATE INDEX IF NOT EXISTS idx_meal_logs_timestamp ON meal_logs (timestamp, id)",
+    ]),
+    Migration(12, "widen the nutrient indexes into covering listing indexes", [
+        step
+        for column in NUTRIENT_COLUMNS
+        for step in (f"DROP INDEX IF EXISTS idx_food_items_{column}", nutrient_listing_index(column))
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _apply(conn, migration):
+    for step in migration.steps:
+        if callable(step):
+            step(conn)
+        else:
+            conn.execute(step)
+    # PRAGMA does not accept bound parameters; the version is always an int
+    conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+
+
+def migrate(target=None):
+    """
+    Apply every pending migration up to target (default: latest).
+    Returns the list of versions applied.
+    """
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version > target:
+            break
+        with transaction() as conn:
+            # Re-check under the write lock; another worker may have won the race
+            if current_version(conn) >= migration.version:
+                continue
+            logger.info("Applying migration %d: %s", migration.version, migration.description)
+            _apply(conn, migration)
+        applied.append(migration.version)
+    return applied
+
+
+def explain(sql, params=()):
+    with connection() as conn:
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def is_full_scan(detail):
+    # "SCAN food_items" is a table scan; "SCAN ... USING [COVERING] INDEX" walks an index
+    return detail.startswith('SCAN ') and ' USING ' not in detail
+
+
+def check_query_plans(queries):
+    """
+    Log the plan of each named dashboard query and warn about full table
+    scans or temporary sort b-trees. Returns the names of offending queries.
+    """
+    offenders = []
+    for name, (sql, params) in queries.items():
+        plan = explain(sql, params)
+        logger.info("Query plan for %s: %s", name, ' | '.join(plan))
+        bad = [d for d in plan if is_full_scan(d) or 'USE TEMP B-TREE' in d]
+        if bad:
+            logger.warning("Query %s does not use an index: %s", name, '; '.join(bad))
+            offenders.append(name)
+    return offenders
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Manage the NutriLens database schema")
+    parser.add_argument('command', choices=['status', 'migrate'])
+    parser.add_argument('--target', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        with connection() as conn:
+            version = current_version(conn)
+        print(f"Schema version {version} (latest {LATEST_VERSION})")
+        for migration in MIGRATIONS:
+            state = 'applied' if migration.version <= version else 'pending'
+            print(f"  {migration.version:>3} {state:<8} {migration.description}")
+    elif args.command == 'migrate':
+        applied = migrate(args.target)
+        print(f"Applied {len(applied)} migration(s)")
+
+
+if __name__ == '__main__':
+    main()
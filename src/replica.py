@@ -0,0 +1,240 @@
+"""
+In-memory read replicas for the HTTP read endpoints.
+
+With NUTRILENS_READ_REPLICA=1, each database that serves reads gets an
+in-memory copy made with SQLite's online backup API. A background thread
+checks the database's data generation every NUTRILENS_REPLICA_INTERVAL
+seconds and, when it has moved, copies the file again into a fresh
+in-memory database and swaps it in.
+
+Each copy is a ReplicaVersion: a frozen point-in-time image that is never
+written to. A request decorated with @reads_replica pins the current
+version for its whole life, streamed body included, so its data
+generation, validators and rows all come from the same instant. Reads never
+wait behind writers and never touch the disk. Versions are freed once the
+last request pinned to them finishes.
+
+Replicas lag writes by up to the interval plus one copy. Writes, the
+socket deltas and the materialized dashboard always use the database
+itself. Each replica holds the whole file in memory (twice while a new
+copy is made), so only the MAX_REPLICAS most recently read databases keep
+one.
+"""
+import functools
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from db import POOL_SIZE, ConnectionPool, get_pool, reset_read_pool, set_read_pool
+from generation import current_generation
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ENABLED = os.environ.get('NUTRILENS_READ_REPLICA', '0') == '1'
+
+# Seconds between generation checks; the most a replica lags behind a write
+# before its next copy starts
+REFRESH_INTERVAL = float(os.environ.get('NUTRILENS_REPLICA_INTERVAL', '1.0'))
+
+MAX_REPLICAS = int(os.environ.get('NUTRILENS_MAX_REPLICAS', '4'))
+
+REPLICA_REFRESH_DURATION = REGISTRY.histogram(
+    'nutrilens_replica_refresh_duration_seconds', "Time to copy a database into a new replica version")
+
+_names = itertools.count()
+
+
+class ReplicaVersion(ConnectionPool):
+    """
+    Pool of read-only connections to one in-memory copy of a database.
+
+    The copy is a shared-cache in-memory database, so every connection in
+    the pool sees the same pages; it lives as long as its anchor connection.
+    """
+
+    def __init__(self, anchor, uri, generation, size=POOL_SIZE):
+        super().__init__(uri, size, uri=True)
+        self.anchor = anchor
+        self.generation = generation
+        self.refs = 0
+        self.retired = False
+
+    def _open(self):
+        conn = super()._open()
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def close(self):
+        super().close()
+        self.anchor.close()
+
+
+def copy_database(path):
+    """
+    Back path up into a new shared-cache in-memory database and return its
+    ReplicaVersion.
+    """
+    uri = f"file:nutrilens-replica-{os.getpid()}-{next(_names)}?mode=memory&cache=shared"
+    anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    try:
+        source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            # A single step copies from one read transaction: a consistent
+            # image, and in WAL mode writers carry on meanwhile
+            source.backup(anchor)
+        finally:
+            source.close()
+        generation = current_generation(anchor)
+    except BaseException:
+        anchor.close()
+        raise
+    return ReplicaVersion(anchor, uri, generation)
+
+
+class ReadReplica:
+    """
+    The current ReplicaVersion of one database file, kept fresh by a
+    background thread.
+    """
+
+    def __init__(self, path, interval=REFRESH_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._current = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            # A real thread: the copy blocks in C, and the threading module
+            # is never monkey-patched (see workers.py)
+            self._thread = threading.Thread(target=self._run, name=f"replica:{self.path}", daemon=True)
+        self._thread.start()
+
+    def pin(self):
+        """
+        The current version, held until unpin(); None until the first copy
+        is ready.
+        """
+        with self._lock:
+            version = self._current
+            if version is not None:
+                version.refs += 1
+            return version
+
+    def unpin(self, version):
+        with self._lock:
+            version.refs -= 1
+            done = version.retired and version.refs == 0
+        if done:
+            version.close()
+
+    def _retire(self, version):
+        with self._lock:
+            version.retired = True
+            done = version.refs == 0
+        if done:
+            version.close()
+
+    def refresh(self):
+        started = time.perf_counter()
+        version = copy_database(self.path)
+        REPLICA_REFRESH_DURATION.observe(time.perf_counter() - started)
+        with self._lock:
+            evicted = self._stopped.is_set()
+            if not evicted:
+                previous, self._current = self._current, version
+        if evicted:
+            # stop() ran while this copy was being made
+            version.close()
+            return None
+        if previous is not None:
+            self._retire(previous)
+        return version
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            previous, self._current = self._current, None
+        if previous is not None:
+            self._retire(previous)
+
+    def _run(self):
+        source = None
+        while not self._stopped.is_set():
+            try:
+                if source is None:
+                    source = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+                current = self._current
+                if current is None or current_generation(source) != current.generation:
+                    self.refresh()
+            except Exception:
+                logger.exception("Refreshing the read replica of %s failed", self.path)
+                if source is not None:
+                    source.close()
+                    source = None
+            self._stopped.wait(self.interval)
+        if source is not None:
+            source.close()
+
+
+_replicas = OrderedDict()
+_replicas_lock = threading.Lock()
+
+
+def replica_for(path):
+    """
+    The ReadReplica of path, started on first use; the least recently read
+    one is dropped past MAX_REPLICAS.
+    """
+    with _replicas_lock:
+        replica = _replicas.get(path)
+        if replica is not None:
+            _replicas.move_to_end(path)
+            return replica
+        replica = _replicas[path] = ReadReplica(path)
+        while len(_replicas) > MAX_REPLICAS:
+            _, evicted = _replicas.popitem(last=False)
+            evicted.stop()
+    replica.start()
+    return replica
+
+
+def reads_replica(view):
+    """
+    Serve a read-only view from the current user's replica when replicas
+    are enabled and one is ready; otherwise from the database as usual.
+    Goes outside the caching decorators, so their generation comes from the
+    replica too.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not REPLICA_ENABLED:
+            return view(*args, **kwargs)
+        replica = replica_for(get_pool().path)
+        version = replica.pin()
+        if version is None:
+            return view(*args, **kwargs)
+        token = set_read_pool(version)
+        try:
+            response = view(*args, **kwargs)
+        except BaseException:
+            replica.unpin(version)
+            raise
+        finally:
+            reset_read_pool(token)
+        if getattr(response, 'is_streamed', False):
+            # The body is read after the view returns; keep its version
+            response.call_on_close(lambda: replica.unpin(version))
+        else:
+            replica.unpin(version)
+        return response
+    return wrapper
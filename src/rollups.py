@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Running-aggregate tables for the dashboard.
+
+nutrition_totals holds a single row with the global sums (and the non-NULL
+counts needed to reproduce AVG for the minerals); meal_totals holds calories
+per meal_type as seen through the meal_logs -> food_items join. Both are kept
+current by triggers, so any writer -- the API, an ad-hoc script, the sqlite3
+shell -- updates them in the same transaction as the row change, and reading
+the dashboard aggregates costs the same regardless of history size.
+nutrition_buckets and meal_buckets hold the same sums per hour, day and week
+for date-range queries.
+"""
+import argparse
+
+from db import transaction
+
+MACROS = ('calories', 'protein', 'carbs', 'fat', 'fiber')
+
+MINERALS = ('iron', 'calcium', 'magnesium', 'zinc', 'potassium')
+
+
+def _column_defs():
+    columns = ['id INTEGER PRIMARY KEY CHECK (id = 1)', 'item_count INTEGER NOT NULL DEFAULT 0']
+    # calories is INTEGER in food_items; keep integral sums integral
+    columns += [f"{m} {'INTEGER' if m == 'calories' else 'REAL'} NOT NULL DEFAULT 0" for m in MACROS]
+    for m in MINERALS:
+        columns.append(f"{m}_sum REAL NOT NULL DEFAULT 0")
+        columns.append(f"{m}_count INTEGER NOT NULL DEFAULT 0")
+    return ',\n        '.join(columns)
+
+
+def _totals_delta(row, sign):
+    # SET clause adding (sign='+') or removing (sign='-') one food_items row
+    parts = [f"item_count = item_count {sign} 1"]
+    parts += [f"{m} = {m} {sign} COALESCE({row}.{m}, 0)" for m in MACROS]
+    for m in MINERALS:
+        parts.append(f"{m}_sum = {m}_sum {sign} COALESCE({row}.{m}, 0)")
+        parts.append(f"{m}_count = {m}_count {sign} ({row}.{m} IS NOT NULL)")
+    return ', '.join(parts)
+
+
+def _meal_calories_delta(row, sign):
+    # Re-attribute a food's calories to every meal that logged it
+    return f"""
+        UPDATE meal_totals
+        SET calories = calories {sign} COALESCE({row}.calories, 0) * (
+            SELECT COUNT(*) FROM meal_logs m
+            WHERE m.food_id = {row}.id AND m.meal_type = meal_totals.meal_type)
+        WHERE meal_type IN (SELECT meal_type FROM meal_logs WHERE food_id = {row}.id);"""
+
+
+def _meal_log_delta(row, sign):
+    return f"""
+        UPDATE meal_totals
+        SET log_count = log_count {sign} 1,
+            calories = calories {sign} COALESCE(
+                (SELECT calories FROM food_items WHERE id = {row}.food_id), 0)
+        WHERE meal_type = {row}.meal_type;"""
+
+
+def _ensure_meal_row(row):
+    return f"""
+        INSERT OR IGNORE INTO meal_totals (meal_type, calories, log_count)
+        SELECT {row}.meal_type, 0, 0 WHERE {row}.meal_type IS NOT NULL;"""
+
+
+ROLLUP_SCHEMA = [
+    f"""CREATE TABLE IF NOT EXISTS nutrition_totals (
+        {_column_defs()})""",
+    """CREATE TABLE IF NOT EXISTS meal_totals (
+        meal_type TEXT PRIMARY KEY NOT NULL,
+        calories INTEGER NOT NULL DEFAULT 0,
+        log_count INTEGER NOT NULL DEFAULT 0)""",
+    # The food_items triggers look up meal_logs by food_id
+    "CREATE INDEX IF NOT EXISTS idx_meal_logs_food_id ON meal_logs (food_id)",
+    f"""CREATE TRIGGER IF NOT EXISTS food_items_rollup_insert AFTER INSERT ON food_items
+    BEGIN
+        UPDATE nutrition_totals SET {_totals_delta('NEW', '+')} WHERE id = 1;
+        {_meal_calories_delta('NEW', '+')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS food_items_rollup_delete AFTER DELETE ON food_items
+    BEGIN
+        UPDATE nutrition_totals SET {_totals_delta('OLD', '-')} WHERE id = 1;
+        {_meal_calories_delta('OLD', '-')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS food_items_rollup_update AFTER UPDATE ON food_items
+    BEGIN
+        UPDATE nutrition_totals SET {_totals_delta('OLD', '-')} WHERE id = 1;
+        UPDATE nutrition_totals SET {_totals_delta('NEW', '+')} WHERE id = 1;
+        {_meal_calories_delta('OLD', '-')}
+        {_meal_calories_delta('NEW', '+')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS meal_logs_rollup_insert AFTER INSERT ON meal_logs
+    BEGIN
+        {_ensure_meal_row('NEW')}
+        {_meal_log_delta('NEW', '+')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS meal_logs_rollup_delete AFTER DELETE ON meal_logs
+    BEGIN
+        {_meal_log_delta('OLD', '-')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS meal_logs_rollup_update AFTER UPDATE ON meal_logs
+    BEGIN
+        {_meal_log_delta('OLD', '-')}
+        {_ensure_meal_row('NEW')}
+        {_meal_log_delta('NEW', '+')}
+    END""",
+]
+
+REBUILD_TOTALS = "INSERT INTO nutrition_totals (id, item_count, {columns}) SELECT 1, COUNT(*), {values} FROM food_items".format(
+    columns=', '.join(list(MACROS) + [f"{m}_sum, {m}_count" for m in MINERALS]),
+    values=', '.join([f"COALESCE(SUM({m}), 0)" for m in MACROS]
+                     + [f"COALESCE(SUM({m}), 0), COUNT({m})" for m in MINERALS]),
+)
+
+REBUILD_MEALS = """
+    INSERT INTO meal_totals (meal_type, calories, log_count)
+    SELECT m.meal_type, COALESCE(SUM(f.calories), 0), COUNT(*)
+    FROM meal_logs m
+    LEFT JOIN food_items f ON m.food_id = f.id
+    WHERE m.meal_type IS NOT NULL
+    GROUP BY m.meal_type
+"""
+
+
+def create_rollups(conn):
+    """
+    Create the rollup tables and triggers; backfill them if they are new.
+    """
+    for statement in ROLLUP_SCHEMA:
+        conn.execute(statement)
+    if conn.execute("SELECT 1 FROM nutrition_totals WHERE id = 1").fetchone() is None:
+        rebuild_rollups(conn)
+
+
+def rebuild_rollups(conn):
+    """
+    Recompute the rollups from scratch (one full scan of each table).
+    """
+    conn.execute("DELETE FROM nutrition_totals")
+    conn.execute("DELETE FROM meal_totals")
+    conn.execute(REBUILD_TOTALS)
+    conn.execute(REBUILD_MEALS)
+
+
+# Time-bucketed rollups: the same sums per hour, day and ISO week (Monday
+# start), keyed by the bucket's start as 'YYYY-MM-DD HH:MM:SS' text so that
+# range queries are primary-key range scans. Foods are bucketed by their own
+# timestamp; meal calories by the meal log's timestamp.
+BUCKETS = ('hour', 'day', 'week')
+
+BUCKET_FORMATS = {
+    'hour': ("'%Y-%m-%d %H:00:00'", ""),
+    'day': ("'%Y-%m-%d 00:00:00'", ""),
+    'week': ("'%Y-%m-%d 00:00:00'", ", 'weekday 0', '-6 days'"),
+}
+
+
+def bucket_start_sql(bucket, timestamp):
+    fmt, modifiers = BUCKET_FORMATS[bucket]
+    return f"strftime({fmt}, {timestamp}{modifiers})"
+
+
+def _bucket_case(bucket_column, timestamp):
+    # bucket_start for whichever granularity bucket_column names
+    whens = ' '.join(f"WHEN '{b}' THEN {bucket_start_sql(b, timestamp)}" for b in BUCKETS)
+    return f"CASE {bucket_column} {whens} END"
+
+
+_BUCKET_NAMES = ' UNION ALL '.join(f"SELECT '{b}' AS bucket" for b in BUCKETS)
+
+_BUCKET_VALUE_COLUMNS = ['item_count'] + list(MACROS) + [
+    c for m in MINERALS for c in (f"{m}_sum", f"{m}_count")]
+
+
+def _bucket_column_defs():
+    columns = ['bucket TEXT NOT NULL', 'bucket_start TEXT NOT NULL', 'item_count INTEGER NOT NULL DEFAULT 0']
+    columns += [f"{m} {'INTEGER' if m == 'calories' else 'REAL'} NOT NULL DEFAULT 0" for m in MACROS]
+    for m in MINERALS:
+        columns.append(f"{m}_sum REAL NOT NULL DEFAULT 0")
+        columns.append(f"{m}_count INTEGER NOT NULL DEFAULT 0")
+    columns.append('PRIMARY KEY (bucket, bucket_start)')
+    return ',\n        '.join(columns)
+
+
+def _food_bucket_upsert(row, sign):
+    values = [f"{sign}1"] + [f"{sign}COALESCE({row}.{m}, 0)" for m in MACROS]
+    for m in MINERALS:
+        values.append(f"{sign}COALESCE({row}.{m}, 0)")
+        values.append(f"{sign}({row}.{m} IS NOT NULL)")
+    updates = ', '.join(f"{c} = {c} + excluded.{c}" for c in _BUCKET_VALUE_COLUMNS)
+    return f"""
+        INSERT INTO nutrition_buckets (bucket, bucket_start, {', '.join(_BUCKET_VALUE_COLUMNS)})
+        SELECT k.bucket, {_bucket_case('k.bucket', f'{row}.timestamp')}, {', '.join(values)}
+        FROM ({_BUCKET_NAMES}) k
+        WHERE {row}.timestamp IS NOT NULL
+        ON CONFLICT (bucket, bucket_start) DO UPDATE SET {updates};"""
+
+
+def _meal_bucket_upsert(source, calories, log_count):
+    # source yields rows aliased m (meal_logs); one upsert per bucket per row
+    return f"""
+        INSERT INTO meal_buckets (bucket, bucket_start, meal_type, calories, log_count)
+        SELECT k.bucket, {_bucket_case('k.bucket', 'm.timestamp')}, m.meal_type, {calories}, {log_count}
+        FROM {source}, ({_BUCKET_NAMES}) k
+        WHERE m.timestamp IS NOT NULL AND m.meal_type IS NOT NULL
+        ON CONFLICT (bucket, bucket_start, meal_type) DO UPDATE SET
+            calories = calories + excluded.calories,
+            log_count = log_count + excluded.log_count;"""
+
+
+def _meal_log_bucket_delta(row, sign):
+    source = f"(SELECT {row}.timestamp AS timestamp, {row}.meal_type AS meal_type) m"
+    calories = f"{sign}COALESCE((SELECT calories FROM food_items WHERE id = {row}.food_id), 0)"
+    return _meal_bucket_upsert(source, calories, f"{sign}1")
+
+
+def _food_meal_bucket_delta(row, sign):
+    # Re-attribute a food's calories to the bucket of every meal that logged it
+    source = f"(SELECT timestamp, meal_type FROM meal_logs WHERE food_id = {row}.id) m"
+    return _meal_bucket_upsert(source, f"{sign}COALESCE({row}.calories, 0)", "0")
+
+
+BUCKET_SCHEMA = [
+    f"""CREATE TABLE IF NOT EXISTS nutrition_buckets (
+        {_bucket_column_defs()}) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS meal_buckets (
+        bucket TEXT NOT NULL,
+        bucket_start TEXT NOT NULL,
+        meal_type TEXT NOT NULL,
+        calories INTEGER NOT NULL DEFAULT 0,
+        log_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, bucket_start, meal_type)) WITHOUT ROWID""",
+    f"""CREATE TRIGGER IF NOT EXISTS food_items_buckets_insert AFTER INSERT ON food_items
+    BEGIN
+        {_food_bucket_upsert('NEW', '')}
+        {_food_meal_bucket_delta('NEW', '')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS food_items_buckets_delete AFTER DELETE ON food_items
+    BEGIN
+        {_food_bucket_upsert('OLD', '-')}
+        {_food_meal_bucket_delta('OLD', '-')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS food_items_buckets_update AFTER UPDATE ON food_items
+    BEGIN
+        {_food_bucket_upsert('OLD', '-')}
+        {_food_bucket_upsert('NEW', '')}
+        {_food_meal_bucket_delta('OLD', '-')}
+        {_food_meal_bucket_delta('NEW', '')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS meal_logs_buckets_insert AFTER INSERT ON meal_logs
+    BEGIN
+        {_meal_log_bucket_delta('NEW', '')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS meal_logs_buckets_delete AFTER DELETE ON meal_logs
+    BEGIN
+        {_meal_log_bucket_delta('OLD', '-')}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS meal_logs_buckets_update AFTER UPDATE ON meal_logs
+    BEGIN
+        {_meal_log_bucket_delta('OLD', '-')}
+        {_meal_log_bucket_delta('NEW', '')}
+    END""",
+]
+
+REBUILD_FOOD_BUCKETS = """
+    INSERT INTO nutrition_buckets (bucket, bucket_start, {columns})
+    SELECT k.bucket, {start} AS start, COUNT(*), {values}
+    FROM food_items f, ({names}) k
+    WHERE f.timestamp IS NOT NULL
+    GROUP BY k.bucket, start
+""".format(
+    columns=', '.join(_BUCKET_VALUE_COLUMNS),
+    start=_bucket_case('k.bucket', 'f.timestamp'),
+    values=', '.join([f"COALESCE(SUM(f.{m}), 0)" for m in MACROS]
+                     + [f"COALESCE(SUM(f.{m}), 0), COUNT(f.{m})" for m in MINERALS]),
+    names=_BUCKET_NAMES,
+)
+
+REBUILD_MEAL_BUCKETS = """
+    INSERT INTO meal_buckets (bucket, bucket_start, meal_type, calories, log_count)
+    SELECT k.bucket, {start} AS start, m.meal_type, COALESCE(SUM(f.calories), 0), COUNT(*)
+    FROM meal_logs m
+    LEFT JOIN food_items f ON m.food_id = f.id, ({names}) k
+    WHERE m.timestamp IS NOT NULL AND m.meal_type IS NOT NULL
+    GROUP BY k.bucket, start, m.meal_type
+""".format(start=_bucket_case('k.bucket', 'm.timestamp'), names=_BUCKET_NAMES)
+
+
+def create_bucket_rollups(conn):
+    """
+    Create the time-bucket tables and triggers and backfill them.
+    """
+    for statement in BUCKET_SCHEMA:
+        conn.execute(statement)
+    rebuild_bucket_rollups(conn)
+
+
+def rebuild_bucket_rollups(conn):
+    conn.execute("DELETE FROM nutrition_buckets")
+    conn.execute("DELETE FROM meal_buckets")
+    conn.execute(REBUILD_FOOD_BUCKETS)
+    conn.execute(REBUILD_MEAL_BUCKETS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the NutriLens rollup tables")
+    parser.add_argument('command', choices=['rebuild'])
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        with transaction() as conn:
+            create_rollups(conn)
+            rebuild_rollups(conn)
+            # Creates the bucket tables if needed, then backfills them
+            create_bucket_rollups(conn)
+            row = conn.execute("SELECT item_count FROM nutrition_totals WHERE id = 1").fetchone()
+        print(f"Rebuilt rollups over {row[0]} food items")
+
+
+if __name__ == '__main__':
+    main()
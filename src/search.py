@@ -0,0 +1,165 @@
+import html
+import re
+
+from db import connection
+from foods import InvalidQuery, parse_limit
+
+# Text columns indexed for /api/search, in FTS column order
+SEARCH_COLUMNS = ('name', 'benefits', 'drawbacks', 'alternatives')
+
+# BM25 weight per column: a hit in the name counts for far more than one in
+# the free-text notes
+SEARCH_WEIGHTS = (10.0, 2.0, 2.0, 1.0)
+
+# Longest query accepted, in terms; each one is a separate posting-list walk
+MAX_SEARCH_TERMS = 8
+
+HIGHLIGHT_OPEN = '<mark>'
+HIGHLIGHT_CLOSE = '</mark>'
+
+# What highlight() and snippet() wrap matches in: private-use characters that
+# survive HTML escaping of the text around them, then become the tags
+MATCH_OPEN = '\ue000'
+MATCH_CLOSE = '\ue001'
+
+# Words either side of the best match in a snippet
+SNIPPET_TOKENS = 12
+
+# External-content table: the text stays in food_items and the index holds
+# only postings, kept in sync by triggers in the same transaction as the row
+# change. prefix='2 3' adds prefix indexes so short as-you-type prefixes are
+# a single lookup instead of a scan over every matching term.
+SEARCH_SCHEMA = [
+    f'''CREATE VIRTUAL TABLE IF NOT EXISTS food_search USING fts5(
+           {', '.join(SEARCH_COLUMNS)},
+           content='food_items', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2', prefix='2 3')''',
+    f'''CREATE TRIGGER IF NOT EXISTS food_items_search_insert AFTER INSERT ON food_items
+       BEGIN
+           INSERT INTO food_search (rowid, {', '.join(SEARCH_COLUMNS)})
+           VALUES (NEW.id, {', '.join(f"NEW.{c}" for c in SEARCH_COLUMNS)});
+       END''',
+    # An external-content delete must be given the old values to remove
+    f'''CREATE TRIGGER IF NOT EXISTS food_items_search_delete AFTER DELETE ON food_items
+       BEGIN
+           INSERT INTO food_search (food_search, rowid, {', '.join(SEARCH_COLUMNS)})
+           VALUES ('delete', OLD.id, {', '.join(f"OLD.{c}" for c in SEARCH_COLUMNS)});
+       END''',
+    # Nutrient-only updates leave the index alone
+    f'''CREATE TRIGGER IF NOT EXISTS food_items_search_update
+       AFTER UPDATE OF id, {', '.join(SEARCH_COLUMNS)} ON food_items
+       BEGIN
+           INSERT INTO food_search (food_search, rowid, {', '.join(SEARCH_COLUMNS)})
+           VALUES ('delete', OLD.id, {', '.join(f"OLD.{c}" for c in SEARCH_COLUMNS)});
+           INSERT INTO food_search (rowid, {', '.join(SEARCH_COLUMNS)})
+           VALUES (NEW.id, {', '.join(f"NEW.{c}" for c in SEARCH_COLUMNS)});
+       END''',
+]
+
+REBUILD_SEARCH = "INSERT INTO food_search (food_search) VALUES ('rebuild')"
+
+# BM25 reads every match, and each term's whole posting list, to score a
+# query; past this many matches that stops being cheap, and the terms are so
+# common their IDF is near zero anyway. Such queries list name matches, then
+# the rest, newest first, reading only the rows returned.
+MAX_RANKED_MATCHES = 2000
+
+MATCH_COUNT_QUERY = "SELECT COUNT(*) FROM (SELECT 1 FROM food_search WHERE food_search MATCH ? LIMIT ?)"
+
+_SEARCH_SELECT = """
+    SELECT f.id, f.name, f.calories, f.timestamp, {score} AS score,
+           highlight(food_search, 0, ?, ?), snippet(food_search, -1, ?, ?, '…', {tokens})
+    FROM food_search JOIN food_items f ON f.id = food_search.rowid
+    WHERE food_search MATCH ?
+"""
+
+RANKED_SEARCH_QUERY = _SEARCH_SELECT.format(
+    score=f"bm25(food_search, {', '.join(map(str, SEARCH_WEIGHTS))})",
+    tokens=SNIPPET_TOKENS) + "ORDER BY score, f.id LIMIT ?"
+
+# Newest first, like /api/foods: the inner query walks
+# idx_food_items_timestamp backwards, probing the set of matching rowids,
+# and stops at LIMIT, so highlight() and snippet() run only for the rows
+# returned
+RECENT_SEARCH_QUERY = _SEARCH_SELECT.format(score='NULL', tokens=SNIPPET_TOKENS) + """
+      AND food_search.rowid IN (
+          SELECT id FROM food_items INDEXED BY idx_food_items_timestamp
+          WHERE id IN (SELECT rowid FROM food_search WHERE food_search MATCH ?)
+          ORDER BY timestamp DESC, id DESC LIMIT ?)
+    ORDER BY f.timestamp DESC, f.id DESC
+"""
+
+SEARCH_RESULT_COLUMNS = ('id', 'name', 'calories', 'timestamp', 'score', 'name_highlight', 'snippet')
+
+_MARKERS = (MATCH_OPEN, MATCH_CLOSE, MATCH_OPEN, MATCH_CLOSE)
+
+_TERM = re.compile(r'\w+')
+
+
+def create_search_index(conn):
+    for statement in SEARCH_SCHEMA:
+        conn.execute(statement)
+
+
+def rebuild_search_index(conn):
+    # Re-reads every food_items row; for the initial build and after bulk
+    # loads that ran with the triggers dropped
+    conn.execute(REBUILD_SEARCH)
+
+
+def build_match(text):
+    """
+    Turn free text into an FTS5 query: every word must match, the last one
+    as a prefix so results follow typing ("chicken ric" finds "Chicken and
+    Rice Bowl"). Words are quoted, so FTS5 operators and column filters in
+    the input are taken literally.
+    """
+    if not isinstance(text, str):
+        raise InvalidQuery("q must be a string")
+    terms = _TERM.findall(text)
+    if not terms:
+        raise InvalidQuery("q must contain at least one word")
+    if len(terms) > MAX_SEARCH_TERMS:
+        raise InvalidQuery(f"q may contain at most {MAX_SEARCH_TERMS} words")
+    # Only the last word is a prefix: a prefix longer than the prefix
+    # indexes has to merge every matching term's postings
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+
+def mark_matches(text):
+    """
+    HTML for highlight()/snippet() output: the food's own text escaped, the
+    matches wrapped in HIGHLIGHT_OPEN/HIGHLIGHT_CLOSE.
+    """
+    if text is None:
+        return None
+    return html.escape(text).replace(MATCH_OPEN, HIGHLIGHT_OPEN).replace(MATCH_CLOSE, HIGHLIGHT_CLOSE)
+
+
+def search_foods(text, limit=None):
+    """
+    Best matches for text with the name highlighted and a snippet around the
+    best-matching column, both as HTML. Ranked by BM25 (score, lower is
+    better) unless the query is too common to rank; then score is None and
+    name matches come first, each group newest first.
+    """
+    match = build_match(text)
+    limit = parse_limit(limit)
+    with connection() as conn:
+        matches = conn.execute(MATCH_COUNT_QUERY, (match, MAX_RANKED_MATCHES + 1)).fetchone()[0]
+        if matches <= MAX_RANKED_MATCHES:
+            rows = conn.execute(RANKED_SEARCH_QUERY, _MARKERS + (match, limit)).fetchall()
+        else:
+            names = f"{{name}} : ({match})"
+            rows = conn.execute(RECENT_SEARCH_QUERY, _MARKERS + (names, names, limit)).fetchall()
+            if len(rows) < limit:
+                rest = f"({match}) NOT {{name}} : ({match})"
+                rows += conn.execute(RECENT_SEARCH_QUERY,
+                                     _MARKERS + (rest, rest, limit - len(rows))).fetchall()
+    results = []
+    for row in rows:
+        result = dict(zip(SEARCH_RESULT_COLUMNS, row))
+        result['name_highlight'] = mark_matches(result['name_highlight'])
+        result['snippet'] = mark_matches(result['snippet'])
+        results.append(result)
+    return results
@@ -0,0 +1,272 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from db import connection
+from foods import InvalidQuery, parse_moment
+from generation import current_generation
+from rollups import BUCKETS, MACROS, MINERALS
+
+MEAL_TYPES = ('Breakfast', 'Lunch', 'Dinner', 'Snacks')
+
+# Daily recommended values used to turn mineral averages into percentages
+DAILY_VALUES = {
+    'iron': 18,  # mg
+    'calcium': 1000,  # mg
+    'magnesium': 400,  # mg
+    'zinc': 11,  # mg
+    'potassium': 3500  # mg
+}
+
+# Every dashboard aggregate in one statement, read from the trigger-maintained
+# rollup tables (see rollups.py) so the cost is independent of history size
+SNAPSHOT_QUERY = """
+    SELECT t.item_count, t.calories, t.protein, t.carbs, t.fat, t.fiber,
+           {mineral_columns},
+           {meal_columns}
+    FROM nutrition_totals t
+    WHERE t.id = 1
+""".format(
+    mineral_columns=',\n           '.join(
+        f"CASE WHEN t.{m}_count > 0 THEN t.{m}_sum / t.{m}_count ELSE 0 END" for m in MINERALS),
+    meal_columns=',\n           '.join(
+        "COALESCE((SELECT calories FROM meal_totals WHERE meal_type = ?), 0)"
+        for _ in MEAL_TYPES),
+)
+
+# The same aggregates over a date range, summed from the time-bucket rollups
+RANGE_SNAPSHOT_QUERY = """
+    SELECT COALESCE(SUM(item_count), 0),
+           {macro_columns},
+           {mineral_columns},
+           {meal_columns}
+    FROM nutrition_buckets
+    WHERE bucket = :bucket AND bucket_start >= :start AND bucket_start < :end
+""".format(
+    macro_columns=',\n           '.join(f"COALESCE(SUM({m}), 0)" for m in MACROS),
+    mineral_columns=',\n           '.join(
+        f"CASE WHEN SUM({m}_count) > 0 THEN SUM({m}_sum) / SUM({m}_count) ELSE 0 END"
+        for m in MINERALS),
+    meal_columns=',\n           '.join(
+        f"""(SELECT COALESCE(SUM(calories), 0) FROM meal_buckets
+             WHERE bucket = :bucket AND bucket_start >= :start AND bucket_start < :end
+               AND meal_type = :meal_{i})"""
+        for i in range(len(MEAL_TYPES))),
+)
+
+BUCKET_SERIES_QUERY = """
+    SELECT bucket_start, item_count, {macros}
+    FROM nutrition_buckets
+    WHERE bucket = :bucket AND bucket_start >= :start AND bucket_start < :end
+    ORDER BY bucket_start
+""".format(macros=', '.join(MACROS))
+
+# Open-ended ranges compare against these; bucket_start is always a
+# 'YYYY-MM-DD HH:MM:SS' string
+RANGE_MIN = '0000-00-00 00:00:00'
+RANGE_MAX = '9999-12-31 23:59:59'
+
+_SnapshotBase = namedtuple('_SnapshotBase', [
+    'total_items', 'total_calories', 'total_protein', 'total_carbs',
+    'total_fat', 'total_fiber', 'macronutrients', 'meal_calories', 'minerals',
+])
+
+
+class Snapshot(_SnapshotBase):
+    """
+    Immutable view of every dashboard aggregate at one point in time.
+    """
+    __slots__ = ()
+
+    def stats(self):
+        return {
+            'total_items': self.total_items,
+            'total_calories': self.total_calories,
+            'total_protein': self.total_protein,
+            'total_carbs': self.total_carbs,
+            'total_fat': self.total_fat,
+            'total_fiber': self.total_fiber
+        }
+
+    def charts(self):
+        return {
+            'macronutrients': list(self.macronutrients),
+            'meal_calories': list(self.meal_calories),
+            'minerals': list(self.minerals)
+        }
+
+
+def macro_distribution(protein, carbs, fat):
+    total = protein + carbs + fat
+    if total == 0:
+        return (0, 0, 0)
+    return (protein / total * 100, carbs / total * 100, fat / total * 100)
+
+
+def mineral_percentages(averages):
+    return tuple(averages[m] / DAILY_VALUES[m] * 100 for m in MINERALS)
+
+
+def build_snapshot(row):
+    """
+    Turn one SNAPSHOT_QUERY result row into a Snapshot.
+    """
+    (total_items, total_calories, total_protein, total_carbs,
+     total_fat, total_fiber) = row[:6]
+    averages = dict(zip(MINERALS, row[6:6 + len(MINERALS)]))
+    meal_calories = tuple(row[6 + len(MINERALS):])
+    return Snapshot(
+        total_items=total_items,
+        total_calories=total_calories,
+        total_protein=total_protein,
+        total_carbs=total_carbs,
+        total_fat=total_fat,
+        total_fiber=total_fiber,
+        macronutrients=macro_distribution(total_protein, total_carbs, total_fat),
+        meal_calories=meal_calories,
+        minerals=mineral_percentages(averages),
+    )
+
+
+def compute_snapshot(conn=None):
+    if conn is None:
+        with connection() as conn:
+            return compute_snapshot(conn)
+    row = conn.execute(SNAPSHOT_QUERY, MEAL_TYPES).fetchone()
+    if row is None:
+        # Rollups not created yet (init_db has not run against this file)
+        row = (0,) * (6 + len(MINERALS) + len(MEAL_TYPES))
+    return build_snapshot(row)
+
+
+def read_snapshot():
+    """
+    Return (generation, snapshot) from one read transaction, so the snapshot
+    is exactly that generation's data.
+    """
+    with connection() as conn:
+        conn.execute("BEGIN")
+        try:
+            return current_generation(conn), compute_snapshot(conn)
+        finally:
+            conn.execute("COMMIT")
+
+
+class CoalescedSnapshot:
+    """
+    Share one snapshot between callers that arrive within `window` seconds.
+
+    The computation runs under a lock, so a burst of refresh requests waits
+    for a single query instead of each issuing its own. compute returns
+    (generation, snapshot), as read_snapshot() does.
+    """
+
+    def __init__(self, compute=read_snapshot, window=0.2):
+        self.compute = compute
+        self.window = window
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generation = None
+        self._computed_at = 0.0
+
+    def get(self, generation=None):
+        """
+        The shared snapshot. With a generation (e.g. the one a response is
+        cached and validated under), never one older than it.
+        """
+        requested_at = time.monotonic()
+        with self._lock:
+            # Anything computed after this caller arrived is fresh enough
+            if (self._snapshot is None or self._computed_at < requested_at - self.window
+                    or (generation is not None and self._generation < generation)):
+                self._generation, self._snapshot = self.compute()
+                self._computed_at = time.monotonic()
+            return self._snapshot
+
+    def refresh(self):
+        with self._lock:
+            self._generation, self._snapshot = self.compute()
+            self._computed_at = time.monotonic()
+            return self._snapshot
+
+
+class DateRange(namedtuple('DateRange', ['bucket', 'start', 'end'])):
+    """
+    A bucket granularity plus [start, end) bounds on bucket_start.
+    """
+    __slots__ = ()
+
+    def params(self):
+        params = {'bucket': self.bucket, 'start': self.start, 'end': self.end}
+        params.update({f'meal_{i}': meal_type for i, meal_type in enumerate(MEAL_TYPES)})
+        return params
+
+
+BUCKET_LENGTHS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+
+def floor_to_bucket(moment, bucket):
+    if bucket == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == 'week':
+        moment -= timedelta(days=moment.weekday())
+    return moment
+
+
+def ceil_to_bucket(moment, bucket):
+    floor = floor_to_bucket(moment, bucket)
+    if floor == moment:
+        return moment
+    try:
+        return floor + BUCKET_LENGTHS[bucket]
+    except OverflowError:
+        return None
+
+
+def parse_range(args):
+    """
+    Build a DateRange from from=/to=/bucket= query arguments, or return None
+    when none are given. The range covers whole buckets: `from` is rounded
+    down to the start of its bucket and `to`, which is exclusive, up to the
+    start of the next one, so to=Wednesday with bucket=week counts that
+    whole week.
+    """
+    if not any(k in args for k in ('from', 'to', 'bucket')):
+        return None
+    bucket = args.get('bucket') or 'day'
+    if bucket not in BUCKETS:
+        raise InvalidQuery(f"bucket must be one of {', '.join(BUCKETS)}")
+    start = parse_moment(args['from'], 'from') if args.get('from') else None
+    end = parse_moment(args['to'], 'to') if args.get('to') else None
+    if start is not None and end is not None and start >= end:
+        raise InvalidQuery("from must be earlier than to")
+    if start is None:
+        start = RANGE_MIN
+    else:
+        start = floor_to_bucket(start, bucket).strftime('%Y-%m-%d %H:%M:%S')
+    if end is not None:
+        end = ceil_to_bucket(end, bucket)
+    end = RANGE_MAX if end is None else end.strftime('%Y-%m-%d %H:%M:%S')
+    return DateRange(bucket, start, end)
+
+
+def compute_range_snapshot(date_range):
+    with connection() as conn:
+        row = conn.execute(RANGE_SNAPSHOT_QUERY, date_range.params()).fetchone()
+    return build_snapshot(row)
+
+
+def bucket_series(date_range):
+    """
+    Per-bucket item counts and macro totals, oldest first.
+    """
+    with connection() as conn:
+        rows = conn.execute(BUCKET_SERIES_QUERY, date_range.params()).fetchall()
+    columns = ('start', 'total_items') + MACROS
+    return [dict(zip(columns, row)) for row in rows]
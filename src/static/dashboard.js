@@ -0,0 +1,368 @@
+// update_data encodings this browser can read besides JSON; msgpack frames
+// over the size threshold are deflated, so they need DecompressionStream
+const ENCODINGS = typeof DecompressionStream === 'undefined' ? [] : ['msgpack'];
+
+// ?user=<id> opens that user's dashboard
+const socket = io({auth: {
+    user: new URLSearchParams(window.location.search).get('user'),
+    encodings: ENCODINGS
+}});
+let macronutrientsChart, caloriesChart, mineralsChart;
+
+function updateStats(stats) {
+    document.getElementById('total-items').textContent = stats.total_items;
+    document.getElementById('total-calories').textContent = stats.total_calories;
+    document.getElementById('total-protein').textContent = stats.total_protein + 'g';
+    document.getElementById('total-fiber').textContent = stats.total_fiber + 'g';
+}
+
+let pageSize = 50;
+
+// Filter and sort arguments, as /api/foods takes them; the server
+// echoes its canonical form as data.view
+let currentView = {};
+let currentViewKey = '';
+
+function renderFoodCard(food) {
+    const card = document.createElement('div');
+    card.className = 'food-card';
+    card.dataset.id = food.id;
+    card.dataset.timestamp = food.timestamp || '';
+    card.sortValue = food[currentView.sort || 'timestamp'];
+    card.innerHTML = `
+        <div class="food-header">
+            <div class="food-name">${food.name}</div>
+            <div class="food-calories">${food.calories} kcal</div>
+        </div>
+        <div class="nutrition-info">
+            <div class="nutrition-item">
+                <div class="nutrition-label">Protein</div>
+                <div class="nutrition-value">${food.protein}g</div>
+            </div>
+            <div class="nutrition-item">
+                <div class="nutrition-label">Carbs</div>
+                <div class="nutrition-value">${food.carbs}g</div>
+            </div>
+            <div class="nutrition-item">
+                <div class="nutrition-label">Fat</div>
+                <div class="nutrition-value">${food.fat}g</div>
+            </div>
+            <div class="nutrition-item">
+                <div class="nutrition-label">Fiber</div>
+                <div class="nutrition-value">${food.fiber}g</div>
+            </div>
+        </div>
+        <div class="food-details">
+            <div class="detail-section">
+                <div class="detail-title">Benefits</div>
+                <div class="detail-content">${food.benefits}</div>
+            </div>
+            <div class="detail-section">
+                <div class="detail-title">Drawbacks</div>
+                <div class="detail-content">${food.drawbacks}</div>
+            </div>
+            <div class="detail-section">
+                <div class="detail-title">Alternatives</div>
+                <div class="detail-content">${food.alternatives}</div>
+            </div>
+        </div>
+    `;
+    return card;
+}
+
+// Grid order matches /api/foods: the sort column (SQLite order,
+// NULL lowest), then id, descending unless order=asc
+function compareSortValues(a, b) {
+    if (a === b) {
+        return 0;
+    }
+    if (a === null || a === undefined) {
+        return -1;
+    }
+    if (b === null || b === undefined) {
+        return 1;
+    }
+    return a < b ? -1 : 1;
+}
+
+function cardComesBefore(a, b) {
+    const order = compareSortValues(a.sortValue, b.sortValue) ||
+        Number(a.dataset.id) - Number(b.dataset.id);
+    return currentView.order === 'asc' ? order < 0 : order > 0;
+}
+
+function updateFoodGrid(foods) {
+    const grid = document.getElementById('food-grid');
+    grid.innerHTML = '';
+
+    foods.forEach(food => {
+        grid.appendChild(renderFoodCard(food));
+    });
+}
+
+function applyFoodDelta(upserted, deleted) {
+    const grid = document.getElementById('food-grid');
+
+    deleted.forEach(id => {
+        const card = grid.querySelector(`[data-id="${id}"]`);
+        if (card) {
+            card.remove();
+        }
+    });
+
+    upserted.forEach(food => {
+        const existing = grid.querySelector(`[data-id="${food.id}"]`);
+        if (existing) {
+            existing.remove();
+        }
+        const card = renderFoodCard(food);
+        const next = Array.from(grid.children).find(other => cardComesBefore(card, other));
+        grid.insertBefore(card, next || null);
+    });
+
+    // Keep the grid to one page; rows pushed off the end are older
+    while (grid.children.length > pageSize) {
+        grid.lastElementChild.remove();
+    }
+}
+
+function updateCharts(data) {
+    // Update Macronutrients Chart
+    if (macronutrientsChart) {
+        macronutrientsChart.destroy();
+    }
+    const macronutrientsCtx = document.getElementById('macronutrientsChart').getContext('2d');
+    macronutrientsChart = new Chart(macronutrientsCtx, {
+        type: 'doughnut',
+        data: {
+            labels: ['Protein', 'Carbs', 'Fat'],
+            datasets: [{
+                data: data.macronutrients,
+                backgroundColor: [
+                    'rgba(52, 199, 89, 0.8)',
+                    'rgba(0, 122, 255, 0.8)',
+                    'rgba(255, 149, 0, 0.8)'
+                ]
+            }]
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                title: {
+                    display: true,
+                    text: 'Macronutrient Distribution'
+                }
+            }
+        }
+    });
+
+    // Update Calories Chart
+    if (caloriesChart) {
+        caloriesChart.destroy();
+    }
+    const caloriesCtx = document.getElementById('caloriesChart').getContext('2d');
+    caloriesChart = new Chart(caloriesCtx, {
+        type: 'bar',
+        data: {
+            labels: ['Breakfast', 'Lunch', 'Dinner', 'Snacks'],
+            datasets: [{
+                label: 'Calories',
+                data: data.meal_calories,
+                backgroundColor: 'rgba(88, 86, 214, 0.8)'
+            }]
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                title: {
+                    display: true,
+                    text: 'Calories by Meal'
+                }
+            }
+        }
+    });
+
+    // Update Minerals Chart
+    if (mineralsChart) {
+        mineralsChart.destroy();
+    }
+    const mineralsCtx = document.getElementById('mineralsChart').getContext('2d');
+    mineralsChart = new Chart(mineralsCtx, {
+        type: 'radar',
+        data: {
+            labels: ['Iron', 'Calcium', 'Magnesium', 'Zinc', 'Potassium'],
+            datasets: [{
+                label: 'Daily Intake %',
+                data: data.minerals,
+                backgroundColor: 'rgba(0, 122, 255, 0.2)',
+                borderColor: 'rgba(0, 122, 255, 0.8)',
+                pointBackgroundColor: 'rgba(0, 122, 255, 0.8)'
+            }]
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                title: {
+                    display: true,
+                    text: 'Mineral Intake'
+                }
+            },
+            scales: {
+                r: {
+                    beginAtZero: true,
+                    max: 100
+                }
+            }
+        }
+    });
+}
+
+// Change-log position of what the grid currently shows
+let currentCursor = null;
+
+function refreshData() {
+    socket.emit('refresh_data', {cursor: currentCursor, view: currentView});
+}
+
+const SORT_COLUMNS = ['timestamp', 'calories', 'protein', 'carbs', 'fat', 'fiber',
+                      'iron', 'calcium', 'magnesium', 'zinc', 'potassium'];
+
+function filterData() {
+    const current = new URLSearchParams(
+        Object.entries(currentView).filter(([key]) => key !== 'sort' && key !== 'order'));
+    const input = prompt(
+        'Filter, e.g. min_calories=200&max_fat=20&meal_type=Lunch&from=2025-01-01&to=2025-02-01 ' +
+        '(min_/max_ work on any nutrient; empty clears)', current.toString());
+    if (input === null) {
+        return;
+    }
+    const view = {};
+    if (currentView.sort) {
+        view.sort = currentView.sort;
+    }
+    if (currentView.order) {
+        view.order = currentView.order;
+    }
+    new URLSearchParams(input.trim()).forEach((value, key) => {
+        if (value !== '') {
+            view[key] = value;
+        }
+    });
+    currentView = view;
+    refreshData();
+}
+
+function sortData() {
+    const input = prompt(`Sort by (${SORT_COLUMNS.join(', ')}); prefix with - for descending`,
+                         (currentView.order === 'asc' ? '' : '-') + (currentView.sort || 'timestamp'));
+    if (input === null) {
+        return;
+    }
+    const descending = input.trim().startsWith('-');
+    const column = input.trim().replace(/^-/, '') || 'timestamp';
+    if (!SORT_COLUMNS.includes(column)) {
+        alert(`Unknown sort column: ${column}`);
+        return;
+    }
+    currentView = Object.assign({}, currentView, {sort: column, order: descending ? 'desc' : 'asc'});
+    refreshData();
+}
+
+socket.on('invalid_query', function(data) {
+    alert(data.error);
+    currentView = {};
+    refreshData();
+});
+
+// First byte of a msgpack frame (payloads.py)
+const FRAME_DEFLATE = 1;
+
+// Food lists arrive as {columns, values} column arrays
+const ROW_LISTS = ['foods', 'upserted'];
+
+function fromColumns(table) {
+    const length = table.columns.length ? table.values[0].length : 0;
+    const rows = new Array(length);
+    for (let i = 0; i < length; i++) {
+        const row = {};
+        table.columns.forEach((column, c) => {
+            row[column] = table.values[c][i];
+        });
+        rows[i] = row;
+    }
+    return rows;
+}
+
+async function decodeUpdate(message) {
+    if (!(message instanceof ArrayBuffer)) {
+        return message;
+    }
+    let body = new Uint8Array(message, 1);
+    if (new Uint8Array(message)[0] === FRAME_DEFLATE) {
+        const stream = new Blob([body]).stream().pipeThrough(new DecompressionStream('deflate'));
+        body = await new Response(stream).arrayBuffer();
+    }
+    const data = MsgPack.decode(body);
+    ROW_LISTS.forEach(key => {
+        if (data[key]) {
+            data[key] = fromColumns(data[key]);
+        }
+    });
+    return data;
+}
+
+// Decoding can be asynchronous; chaining keeps updates in arrival order
+let pendingUpdate = Promise.resolve();
+
+socket.on('update_data', function(message) {
+    pendingUpdate = pendingUpdate
+        .then(() => decodeUpdate(message))
+        .then(applyUpdate)
+        .catch(error => console.error('update_data', error));
+});
+
+function applyUpdate(data) {
+    // Full payload on first contact, otherwise only what changed
+    if (data.broadcast && data.view !== currentViewKey) {
+        // A room-wide update for the default view; ask for ours
+        refreshData();
+        return;
+    }
+    currentViewKey = data.view;
+    if (data.reset) {
+        pageSize = data.page_size;
+        updateFoodGrid(data.foods);
+    } else if (data.from_cursor !== currentCursor) {
+        // Missed an update; ask for a diff from where we actually are
+        refreshData();
+        return;
+    } else {
+        applyFoodDelta(data.upserted, data.deleted);
+    }
+    currentCursor = data.cursor;
+    if (data.stats) {
+        updateStats(data.stats);
+    }
+    if (data.charts) {
+        updateCharts(data.charts);
+    }
+}
+
+// First paint from the materialized dashboard, then a socket refresh that
+// only has to send what changed since it was built
+fetch('/api/dashboard' + window.location.search)
+    .then(response => response.ok ? response.json() : Promise.reject(response.status))
+    .then(data => {
+        pendingUpdate = pendingUpdate.then(() => {
+            // An update that arrived first is newer
+            if (currentCursor === null) {
+                applyUpdate(data);
+            }
+        });
+        return pendingUpdate;
+    })
+    .catch(error => console.error('dashboard', error))
+    .finally(refreshData);
@@ -0,0 +1,207 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from db import MAX_OPEN_SHARDS, reset_current_user, set_current_user, user_db_path
+from deltas import ClientCursors
+from foods import InvalidQuery
+from migrations import migrate
+from payloads import DEFAULT_ENCODING
+from snapshot import CoalescedSnapshot, read_snapshot
+
+# User ids become file names under USER_DB_DIR, so keep them to a safe alphabet
+USER_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+# Every connected dashboard joins its user's room; the shared database keeps
+# the original room name
+DASHBOARD_ROOM = 'dashboard'
+
+# Users whose database this process has migrated, least recently used
+# first; bounded like the shard pools, since forgetting one only costs a
+# no-op migrate() on its next use
+_migrated = OrderedDict()
+# user -> lock held while that user's database is migrated, so one user's
+# first request never waits behind another's
+_migrating = {}
+_state_lock = threading.Lock()
+
+
+class UnknownUser(LookupError):
+    """
+    Raised when a read names a user who has no database yet; only writes
+    create one. The API maps it to a 404.
+    """
+
+
+def parse_user_id(value):
+    """
+    Validate a user id from a header, query string or socket auth payload.
+    Missing or empty means the shared database (None).
+    """
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str) or not USER_ID_PATTERN.fullmatch(value):
+        raise InvalidQuery("user must be 1-64 letters, digits, '_' or '-'")
+    return value
+
+
+def dashboard_room(user_id):
+    return DASHBOARD_ROOM if user_id is None else f"{DASHBOARD_ROOM}:{user_id}"
+
+
+def prepare_user(user_id, create=False):
+    """
+    Make sure user_id's database exists and is migrated, creating it only
+    when `create` is set; otherwise a user without one raises UnknownUser.
+    """
+    with _state_lock:
+        if user_id in _migrated:
+            _migrated.move_to_end(user_id)
+            return
+        lock = _migrating.setdefault(user_id, threading.Lock())
+    try:
+        with lock:
+            with _state_lock:
+                if user_id in _migrated:
+                    return
+            if not create and not os.path.exists(user_db_path(user_id)):
+                raise UnknownUser(f"unknown user: {user_id}")
+            token = set_current_user(user_id)
+            try:
+                migrate()
+            finally:
+                reset_current_user(token)
+            with _state_lock:
+                _migrated[user_id] = True
+                while len(_migrated) > MAX_OPEN_SHARDS:
+                    _migrated.popitem(last=False)
+    finally:
+        with _state_lock:
+            if _migrating.get(user_id) is lock:
+                del _migrating[user_id]
+
+
+def activate(user_id, create=False):
+    """
+    Route this context's database access to user_id, migrating the user's
+    database on first use (see prepare_user for `create`). Returns a token
+    for deactivate().
+    """
+    if user_id is not None:
+        prepare_user(user_id, create)
+    return set_current_user(user_id)
+
+
+def deactivate(token):
+    reset_current_user(token)
+
+
+@contextmanager
+def user_scope(user_id):
+    token = activate(user_id)
+    try:
+        yield
+    finally:
+        deactivate(token)
+
+
+class Tenant:
+    """
+    Per-user dashboard state: a coalesced snapshot of the user's aggregates,
+    the delta cursors of their sockets, and the broadcaster's position.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.room = dashboard_room(user_id)
+        self.snapshots = CoalescedSnapshot(self._compute)
+        self.cursors = ClientCursors()
+        # sid -> the update_data encoding that socket negotiated
+        self.clients = {}
+        # Owned by the broadcaster
+        self.generation = None
+        self.broadcast_cursor = None
+
+    def _compute(self):
+        # Snapshots may be refreshed from the broadcaster's background task,
+        # outside any request's user scope
+        with user_scope(self.user_id):
+            return read_snapshot()
+
+
+class Tenants:
+    """
+    Registry of Tenant objects and of which user each socket belongs to.
+    Tenants with a connected socket are always kept; past max_tenants the
+    least recently used of the others are dropped.
+    """
+
+    def __init__(self, max_tenants=MAX_OPEN_SHARDS):
+        self.max_tenants = max_tenants
+        self._lock = threading.Lock()
+        # user -> Tenant, least recently used first
+        self._tenants = OrderedDict()
+        self._sockets = {}
+
+    def get(self, user_id):
+        with self._lock:
+            return self._get(user_id)
+
+    def _get(self, user_id):
+        # Caller holds the lock
+        tenant = self._tenants.get(user_id)
+        if tenant is not None:
+            self._tenants.move_to_end(user_id)
+            return tenant
+        tenant = self._tenants[user_id] = Tenant(user_id)
+        excess = len(self._tenants) - self.max_tenants
+        if excess > 0:
+            idle = [u for u, t in self._tenants.items() if not t.clients and t is not tenant]
+            for evicted in idle[:excess]:
+                del self._tenants[evicted]
+        return tenant
+
+    def connect(self, sid, user_id, encoding=DEFAULT_ENCODING):
+        with self._lock:
+            tenant = self._get(user_id)
+            tenant.clients[sid] = encoding
+            self._sockets[sid] = tenant
+        return tenant
+
+    def for_socket(self, sid):
+        with self._lock:
+            return self._sockets.get(sid)
+
+    def encoding(self, sid):
+        with self._lock:
+            tenant = self._sockets.get(sid)
+            return tenant.clients.get(sid, DEFAULT_ENCODING) if tenant else DEFAULT_ENCODING
+
+    def encodings(self, tenant):
+        # Encodings in use among a tenant's sockets
+        with self._lock:
+            return set(tenant.clients.values())
+
+    def disconnect(self, sid):
+        with self._lock:
+            tenant = self._sockets.pop(sid, None)
+            if tenant is None:
+                return
+            tenant.clients.pop(sid, None)
+        tenant.cursors.forget(sid)
+
+    def clear(self):
+        with self._lock:
+            self._tenants.clear()
+            self._sockets.clear()
+
+    def client_count(self):
+        with self._lock:
+            return len(self._sockets)
+
+    def active(self):
+        # Tenants with at least one connected dashboard
+        with self._lock:
+            return [t for t in self._tenants.values() if t.clients]
@@ -0,0 +1,164 @@
+"""
+Server concurrency model.
+
+NUTRILENS_ASYNC_MODE picks the Socket.IO server stack: 'threading' (the
+Werkzeug development server, the default), or 'eventlet' / 'gevent' for
+production, where every socket is a green thread and thousands of idle
+dashboards cost a few kilobytes each.
+
+SQLite calls block in C and never yield to the event loop, so in the async
+modes all database and aggregation work goes through run_blocking(), which
+runs it on a bounded pool of real OS threads. Only socket I/O stays on the
+hub.
+"""
+import contextvars
+import functools
+import os
+import threading
+
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+
+ASYNC_MODE = os.environ.get('NUTRILENS_ASYNC_MODE', 'threading')
+
+# Real threads available for database work; matches the default pool size so
+# a worker never waits on the connection pool
+DB_WORKERS = int(os.environ.get('NUTRILENS_DB_WORKERS', '8'))
+
+
+def patch_for_async_mode(mode=ASYNC_MODE):
+    """
+    Monkey-patch sockets and timers for the green server. Must run before
+    flask and socketio are imported.
+
+    threading is deliberately left unpatched: the connection pool, snapshot
+    and cursor locks are only taken on run_blocking() threads, which need
+    real primitives.
+    """
+    if mode not in ASYNC_MODES:
+        raise RuntimeError(f"NUTRILENS_ASYNC_MODE must be one of {', '.join(ASYNC_MODES)}")
+    try:
+        if mode == 'eventlet':
+            import eventlet
+            eventlet.monkey_patch(thread=False)
+        elif mode == 'gevent':
+            from gevent import monkey
+            monkey.patch_all(thread=False)
+    except ImportError:
+        raise RuntimeError(f"NUTRILENS_ASYNC_MODE={mode} but the {mode} package is not installed")
+
+
+def raise_fd_limit():
+    """
+    Lift the soft open-file limit to the hard limit; each socket is a file
+    descriptor. Returns the new soft limit, or None where unsupported.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        soft = hard
+    return soft
+
+
+class BlockingExecutor:
+    """
+    Run blocking callables on at most `workers` real threads and wait for
+    the result without stalling the event loop.
+
+    The caller's contextvars (e.g. the active user's database) travel with
+    the call.
+    """
+
+    def __init__(self, mode=ASYNC_MODE, workers=DB_WORKERS):
+        self.mode = mode
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers)
+        self._pool = None
+        if mode == 'eventlet':
+            from eventlet import tpool
+            tpool.set_num_threads(workers)
+            self._pool = tpool
+        elif mode == 'gevent':
+            from gevent.threadpool import ThreadPool
+            self._pool = ThreadPool(workers)
+
+    def run(self, fn, *args, **kwargs):
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        if self.mode == 'eventlet':
+            return self._pool.execute(call)
+        if self.mode == 'gevent':
+            return self._pool.apply(call)
+        # Threading mode: handlers already have their own thread, so just
+        # cap how many touch the database at once
+        with self._slots:
+            return call()
+
+    def wrap_wsgi(self, wsgi_app):
+        """
+        Run a WSGI app (the whole Flask request: scope, view and teardown)
+        on the executor. Bodies are buffered by Flask for ordinary
+        responses, so only start_response and the returned iterable cross
+        back to the hub; streamed bodies wrap their generator with
+        iter_blocking().
+        """
+        if self.mode == 'threading':
+            return wsgi_app
+
+        @functools.wraps(wsgi_app)
+        def offloaded(environ, start_response):
+            return self.run(wsgi_app, environ, start_response)
+        return offloaded
+
+
+class BlockingIterator:
+    """
+    Iterator whose every step runs on the executor inside one saved context.
+    """
+
+    def __init__(self, executor, iterable, context):
+        self._executor = executor
+        self._iterator = iter(iterable)
+        self._context = context
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._executor.run(self._context.run, next, self._iterator)
+
+    def close(self):
+        # The WSGI server calls this when the client goes away mid-stream;
+        # a generator's cleanup (releasing its connection) may block too
+        close = getattr(self._iterator, 'close', None)
+        if close is not None:
+            self._executor.run(self._context.run, close)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = BlockingExecutor()
+    return _executor
+
+
+def run_blocking(fn, *args, **kwargs):
+    return get_executor().run(fn, *args, **kwargs)
+
+
+def iter_blocking(iterable):
+    """
+    Wrap a streamed response body that does database work. The server
+    iterates it after the request has been torn down (and on the hub in the
+    async modes), so each step runs on the executor in the context captured
+    here, with the view's active user.
+    """
+    return BlockingIterator(get_executor(), iterable, contextvars.copy_context())
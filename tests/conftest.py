@@ -0,0 +1,105 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+# The app reads its locations at import time; point them at scratch space
+# before anything under src/ is imported
+_scratch = tempfile.mkdtemp(prefix='nutrilens-tests-')
+os.environ.setdefault('NUTRILENS_DB', os.path.join(_scratch, 'food_analysis.db'))
+os.environ.setdefault('NUTRILENS_USER_DB_DIR', os.path.join(_scratch, 'users'))
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+@pytest.fixture
+def database(tmp_path):
+    """
+    A freshly migrated database file, used by everything that calls
+    connection().
+    """
+    import db
+    import migrations
+
+    path = str(tmp_path / 'food_analysis.db')
+    db.configure(path)
+    migrations.migrate()
+    yield path
+    db.configure(os.environ['NUTRILENS_DB'])
+
+
+@pytest.fixture
+def app_module(database):
+    """
+    The Flask app with its per-process caches emptied, serving `database`.
+    """
+    pytest.importorskip('flask_socketio')
+    import app
+
+    app.response_cache.clear()
+    app.last_modified.clear()
+    app.tenants.clear()
+    yield app
+    app.stop_background_tasks()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def socket_client(app_module, client):
+    """
+    A Socket.IO test client, its connect reply already drained.
+    """
+    socket = app_module.socketio.test_client(app_module.app, flask_test_client=client)
+    socket.get_received()
+    yield socket
+    if socket.is_connected():
+        socket.disconnect()
+
+
+def add_foods(*names, **fields):
+    """
+    Insert one food per name through bulk ingest; returns the report.
+    """
+    from ingest import ingest
+
+    records = [dict({'name': name, 'calories': 100}, **fields) for name in names]
+    return ingest('foods', enumerate(records, start=1))
+
+
+class FakeSocketIO:
+    """
+    Stands in for flask_socketio.SocketIO: real threads, recorded emits,
+    and a hook to run something while a background task sleeps.
+    """
+
+    def __init__(self):
+        self.emits = []
+        self.on_sleep = {}
+
+    def start_background_task(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    def sleep(self, seconds):
+        action = self.on_sleep.pop(seconds, None)
+        if action is not None:
+            action()
+        time.sleep(0.005)
+
+    def emit(self, event, data, to=None, **options):
+        self.emits.append((event, data, to))
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def test_app_import_loads_no_pandas(tmp_path):
+    pytest.importorskip('flask_socketio')
+    env = dict(os.environ, NUTRILENS_DB=str(tmp_path / 'food_analysis.db'),
+               NUTRILENS_USER_DB_DIR=str(tmp_path / 'users'))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SRC, env.get('PYTHONPATH')]))
+    check = "import sys, app; app.stop_background_tasks(); print(sorted({'pandas', 'numpy'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, '-c', check], env=env, capture_output=True, text=True,
+                            timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '[]'
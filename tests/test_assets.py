@@ -0,0 +1,65 @@
+import gzip
+import os
+import re
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def static_bytes(name):
+    with open(os.path.join(SRC, 'static', name), 'rb') as f:
+        return f.read()
+
+
+def asset_url(client, name):
+    stem, ext = os.path.splitext(name)
+    page = client.get('/').get_data(as_text=True)
+    [url] = re.findall(rf'/assets/{re.escape(stem)}\.[0-9a-f]{{16}}{re.escape(ext)}', page)
+    return url
+
+
+def test_page_names_fingerprinted_assets(client):
+    url = asset_url(client, 'dashboard.css')
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert response.content_type == 'text/css; charset=utf-8'
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data() == static_bytes('dashboard.css')
+
+
+def test_gzip_is_negotiated_with_its_own_etag(client):
+    url = asset_url(client, 'dashboard.js')
+    plain = client.get(url)
+    compressed = client.get(url, headers={'Accept-Encoding': 'br;q=0, gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(compressed.get_data()) == plain.get_data() == static_bytes('dashboard.js')
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+
+
+def test_repeat_page_load_is_a_304(client):
+    first = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'no-cache'
+    again = client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    # A validator for another encoding does not match
+    assert client.get('/', headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+
+def test_unknown_and_unversioned_assets_are_404(client):
+    assert client.get('/assets/dashboard.0000000000000000.css').status_code == 404
+    assert client.get('/assets/dashboard.css').status_code == 404
+    assert client.get('/static/dashboard.css').status_code == 404
+
+
+def test_build_writes_compressed_siblings(tmp_path):
+    from assets import AssetManifest
+
+    manifest = AssetManifest()
+    written = manifest.write(str(tmp_path))
+    target = str(tmp_path) + manifest.url('dashboard.js')[len('/assets'):]
+    assert target in written
+    with open(target + '.gz', 'rb') as f:
+        assert gzip.decompress(f.read()) == static_bytes('dashboard.js')
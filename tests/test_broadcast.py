@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from conftest import FakeSocketIO, add_foods, wait_for
+
+
+@pytest.fixture
+def socketio():
+    return FakeSocketIO()
+
+
+def make_broadcaster(socketio, *encodings):
+    from broadcast import Broadcaster
+    from tenants import Tenants
+
+    tenants = Tenants()
+    for number, encoding in enumerate(encodings):
+        tenant = tenants.connect(f"sid-{number}", None, encoding)
+    broadcaster = Broadcaster(socketio, tenants, interval=0.01, debounce=0.25)
+    broadcaster.watch(tenant)
+    return broadcaster
+
+
+def test_a_write_burst_is_broadcast_once(database, socketio):
+    broadcaster = make_broadcaster(socketio, 'json', 'json')
+    # The second write lands while the broadcaster waits for the burst to settle
+    socketio.on_sleep[broadcaster.debounce] = lambda: add_foods('pear')
+    broadcaster.start()
+    try:
+        add_foods('apple')
+        wait_for(lambda: socketio.emits)
+        time.sleep(0.1)
+    finally:
+        broadcaster.stop(timeout=2)
+
+    [(event, payload, room)] = socketio.emits
+    assert (event, room) == ('update_data', 'dashboard')
+    assert sorted(food['name'] for food in payload['upserted']) == ['apple', 'pear']
+    assert payload['stats']['total_items'] == 2
+
+
+def test_one_message_per_encoding(database, socketio):
+    pytest.importorskip('msgpack')
+    from payloads import decode_payload
+
+    broadcaster = make_broadcaster(socketio, 'json', 'msgpack', 'msgpack')
+    broadcaster.start()
+    try:
+        add_foods('apple')
+        wait_for(lambda: len(socketio.emits) >= 2)
+        time.sleep(0.1)
+    finally:
+        broadcaster.stop(timeout=2)
+
+    messages = {room: data for _, data, room in socketio.emits}
+    assert len(socketio.emits) == 2
+    assert set(messages) == {'dashboard', 'dashboard#msgpack'}
+    assert isinstance(messages['dashboard#msgpack'], bytes)
+    assert decode_payload(messages['dashboard#msgpack']) == messages['dashboard']
+
+
+def test_stop_ends_the_background_task(database, socketio):
+    broadcaster = make_broadcaster(socketio, 'json')
+    broadcaster.start()
+    task = broadcaster._task
+    broadcaster.stop(timeout=2)
+    assert not task.is_alive()
+
+    # Stopped broadcasters send nothing and can be started again
+    add_foods('apple')
+    time.sleep(0.1)
+    assert socketio.emits == []
+    broadcaster.start()
+    try:
+        wait_for(lambda: socketio.emits)
+    finally:
+        broadcaster.stop(timeout=2)
@@ -0,0 +1,73 @@
+import time
+
+from conftest import add_foods
+
+
+def test_stats_follow_a_write_immediately(client):
+    add_foods('Apple', 'Banana')
+    first = client.get('/api/stats')
+    assert first.get_json()['total_items'] == 2
+
+    # Within the snapshot coalescing window: the body must still match the
+    # generation it is cached and validated under
+    add_foods('Cherry')
+    second = client.get('/api/stats')
+    assert second.get_json()['total_items'] == 3
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert client.get('/api/stats').get_json()['total_items'] == 3
+
+
+def test_charts_follow_a_write_immediately(client):
+    add_foods('Apple', protein=10, carbs=0, fat=0)
+    assert client.get('/api/charts').get_json()['macronutrients'] == [100, 0, 0]
+    add_foods('Butter', protein=0, carbs=0, fat=10)
+    assert client.get('/api/charts').get_json()['macronutrients'] == [50, 0, 50]
+
+
+def test_cached_response_is_reused_within_a_generation(client, app_module):
+    add_foods('Apple')
+    client.get('/api/foods?limit=5')
+    hits = app_module.response_cache.hits
+    client.get('/api/foods?limit=5')
+    assert app_module.response_cache.hits == hits + 1
+
+
+def test_etag_revalidation(client):
+    add_foods('Apple')
+    etag = client.get('/api/foods').headers['ETag']
+    assert client.get('/api/foods', headers={'If-None-Match': etag}).status_code == 304
+    add_foods('Banana')
+    assert client.get('/api/foods', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_vary_survives_the_cache_and_304s(client):
+    add_foods('apple')
+    first = client.get('/api/foods')
+    assert first.vary.as_set() == {'accept'}
+    cached = client.get('/api/foods')
+    assert cached.vary.as_set() == {'accept'}
+    revalidated = client.get('/api/foods', headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert revalidated.vary.as_set() == {'accept'}
+
+
+def test_if_modified_since_sees_back_dated_writes(client):
+    add_foods('apple', timestamp='2024-06-01T12:00:00')
+    # Last-Modified is only sent once the second of the last change is over
+    time.sleep(1.1)
+    first = client.get('/api/stats')
+    assert first.last_modified is not None
+
+    add_foods('pear', timestamp='2001-01-01T00:00:00')
+    second = client.get('/api/stats', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert second.status_code == 200
+    assert second.get_json()['total_items'] == 2
+    assert second.last_modified is None
+
+
+def test_last_modified_of_an_unchanged_database(client):
+    add_foods('apple')
+    time.sleep(1.1)
+    first = client.get('/api/stats')
+    again = client.get('/api/stats', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert again.status_code == 304
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from conftest import add_foods
+
+
+def test_connections_use_wal(database):
+    import db
+
+    assert db.query_one("PRAGMA journal_mode")[0] == 'wal'
+    assert db.query_one("PRAGMA foreign_keys")[0] == 1
+
+
+def test_requests_share_one_pooled_connection(client, database):
+    import db
+
+    pool = db.configure(database, size=1)
+    pool.timeout = 0.5
+    add_foods('apple')
+    for _ in range(3):
+        assert client.get('/api/foods').status_code == 200
+        # A failing request must hand its connection back too
+        assert client.get('/api/foods?cursor=bogus').status_code == 400
+    assert pool._created == 1
+    assert pool._idle.qsize() == 1
+
+
+def test_an_exhausted_pool_times_out(database):
+    import db
+
+    pool = db.ConnectionPool(database, size=1, timeout=0.05)
+    with pool.connection():
+        with pytest.raises(RuntimeError, match='Timed out'):
+            pool.acquire()
+    with pool.connection() as conn:
+        assert conn.execute("SELECT 1").fetchone() == (1,)
+    pool.close()
+
+
+def test_a_failed_transaction_rolls_back_and_returns_its_connection(database):
+    import db
+
+    pool = db.get_pool()
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction() as conn:
+            conn.execute("INSERT INTO food_items (name, calories) VALUES ('apple', 100)")
+            conn.execute("INSERT INTO meal_logs (food_id) VALUES (-1)")
+    assert db.query_one("SELECT COUNT(*) FROM food_items")[0] == 0
+    assert pool._idle.qsize() == pool._created
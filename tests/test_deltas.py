@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import add_foods
+
+
+@pytest.fixture
+def cursors(database):
+    from deltas import ClientCursors
+    return ClientCursors()
+
+
+def build(cursors, client_cursor=None):
+    from snapshot import compute_snapshot
+    return cursors.build_update('sid', compute_snapshot(), client_cursor)
+
+
+def test_first_update_is_a_reset(cursors):
+    add_foods('apple', 'pear')
+    payload = build(cursors)
+    assert payload['reset']
+    assert [food['name'] for food in payload['foods']] == ['pear', 'apple']
+
+
+def test_next_update_is_a_delta(cursors):
+    add_foods('apple')
+    first = build(cursors)
+    add_foods('pear')
+    payload = build(cursors, first['cursor'])
+    assert not payload['reset']
+    assert payload['from_cursor'] == first['cursor']
+    assert [food['name'] for food in payload['upserted']] == ['pear']
+
+
+@pytest.mark.parametrize('bad', ['abc', '3', -1, 1.5, True, [1], {'seq': 1}])
+def test_invalid_client_cursor_gets_a_reset(cursors, bad):
+    add_foods('apple')
+    build(cursors)
+    payload = build(cursors, bad)
+    assert payload['reset']
+    assert [food['name'] for food in payload['foods']] == ['apple']
+
+
+def test_refresh_with_a_garbage_cursor(socket_client):
+    add_foods('apple')
+    socket_client.emit('refresh_data', {'cursor': 'abc'})
+    [message] = [m for m in socket_client.get_received() if m['name'] == 'update_data']
+    assert message['args'][0]['reset']
+    assert [food['name'] for food in message['args'][0]['foods']] == ['apple']
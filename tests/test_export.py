@@ -0,0 +1,109 @@
+import pytest
+
+from conftest import add_foods
+
+
+@pytest.mark.parametrize('table', ['food_items', 'meal_logs'])
+@pytest.mark.parametrize('args', [{}, {'from': '2024-01-01'}, {'from': '2024-01-01', 'to': '2024-02-01'}])
+@pytest.mark.parametrize('after', [None, ('2024-01-10 00:00:00', 5), (None, 5)])
+def test_exports_walk_the_timestamp_index(database, table, args, after):
+    from export import export_query, parse_export
+    from migrations import check_query_plans
+
+    request = parse_export(table, dict(args, format='arrow'))
+    assert check_query_plans({table: export_query(request, after)}) == []
+
+
+def test_meal_log_range_export(database):
+    pytest.importorskip('pyarrow')
+    import pyarrow as pa
+
+    from export import iter_export, parse_export
+    from ingest import ingest
+
+    add_foods('apple')
+    meals = [{'food_id': 1, 'meal_type': 'Lunch', 'timestamp': f"2024-01-{day:02d}T12:00:00"}
+             for day in (3, 1, 2, 9)]
+    ingest('meals', enumerate(meals, start=1))
+
+    request = parse_export('meal_logs', {'format': 'arrow', 'from': '2024-01-01', 'to': '2024-01-05'})
+    table = pa.ipc.open_stream(b''.join(iter_export(request))).read_all()
+    assert [t.day for t in table.column('timestamp').to_pylist()] == [1, 2, 3]
+
+
+def read_arrow(chunks):
+    import pyarrow as pa
+
+    return pa.ipc.open_stream(b''.join(chunks)).read_all()
+
+
+def test_export_pages_cover_every_row_once(database):
+    pytest.importorskip('pyarrow')
+    from db import transaction
+    from export import iter_export, parse_export
+
+    with transaction() as conn:
+        conn.executemany("INSERT INTO food_items (name, timestamp) VALUES (?, ?)",
+                         [('undated', None)] * 3
+                         + [(f"food {i}", f"2024-01-{i // 2 + 1:02d} 00:00:00") for i in range(8)])
+
+    request = parse_export('food_items', {'format': 'arrow', 'columns': 'name'})
+    table = read_arrow(iter_export(request, batch_size=2))
+    assert table.column_names == ['name']
+    assert table.column('name').to_pylist() == ['undated'] * 3 + [f"food {i}" for i in range(8)]
+
+
+def test_a_stalled_export_holds_no_read_transaction(database):
+    pytest.importorskip('pyarrow')
+    from db import connection
+    from export import iter_export, parse_export
+
+    add_foods('apple', 'pear', 'plum', timestamp='2024-01-01T00:00:00')
+    chunks = iter_export(parse_export('food_items', {'format': 'arrow'}), batch_size=1)
+    first = next(chunks)
+
+    # The client stops reading; writes and a full checkpoint still go through
+    add_foods('fig', timestamp='2024-02-01T00:00:00')
+    with connection() as conn:
+        busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    assert busy == 0
+
+    table = read_arrow([first] + list(chunks))
+    assert table.column('name').to_pylist() == ['apple', 'pear', 'plum', 'fig']
+
+
+@pytest.fixture
+def odd_timestamp(database):
+    from db import transaction
+
+    add_foods('apple', timestamp='2024-01-01T00:00:00')
+    with transaction() as conn:
+        conn.execute("INSERT INTO food_items (name, timestamp) VALUES ('pear', '2024-03-01T08:00:00')")
+
+
+def test_non_canonical_timestamps_fail_the_export(client, odd_timestamp):
+    pytest.importorskip('pyarrow')
+    response = client.get('/api/export/food_items?format=arrow')
+    assert response.status_code == 500
+    assert '2024-03-01T08:00:00' in response.get_json()['error']
+
+
+def test_exports_that_skip_the_bad_timestamp_still_work(client, odd_timestamp):
+    pytest.importorskip('pyarrow')
+    response = client.get('/api/export/food_items?format=arrow&columns=name')
+    assert read_arrow([response.data]).column('name').to_pylist() == ['apple', 'pear']
+    response = client.get('/api/export/food_items?format=arrow&to=2024-02-01')
+    assert read_arrow([response.data]).column('name').to_pylist() == ['apple']
+
+
+def test_timestamps_never_become_null(database):
+    pytest.importorskip('pyarrow')
+    import pyarrow as pa
+
+    from export import ExportFailed, _record_batch
+
+    schema = pa.schema([('timestamp', pa.timestamp('s', tz='UTC'))])
+    batch = _record_batch(pa, schema, [('2024-01-01 00:00:00',), (None,)])
+    assert batch.column(0).null_count == 1
+    with pytest.raises(ExportFailed):
+        _record_batch(pa, schema, [('2024-01-01 00:00:00',), ('yesterday',)])
@@ -0,0 +1,174 @@
+import base64
+import json
+
+import pytest
+
+from conftest import add_foods
+
+
+def raw_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def test_pages_follow_the_cursor(client):
+    add_foods(*(f"food {i}" for i in range(5)))
+    first = client.get('/api/foods?limit=3')
+    assert [food['name'] for food in first.get_json()] == ['food 4', 'food 3', 'food 2']
+    rest = client.get(f"/api/foods?limit=3&cursor={first.headers['X-Next-Cursor']}")
+    assert [food['name'] for food in rest.get_json()] == ['food 1', 'food 0']
+    assert 'X-Next-Cursor' not in rest.headers
+
+
+@pytest.mark.parametrize('key', [
+    ['2024-01-01 00:00:00', 2 ** 63],
+    ['2024-01-01 00:00:00', -2 ** 63 - 1],
+    ['2024-01-01 00:00:00', True],
+    ['2024-01-01 00:00:00', '1'],
+    [{'a': 1}, 1],
+    [[1, 2], 1],
+    [12, 1],
+    ['2024-01-01 00:00:00'],
+    {'value': 1},
+])
+def test_malformed_cursor_is_a_400(client, key):
+    response = client.get(f"/api/foods?cursor={raw_cursor(key)}")
+    assert response.status_code == 400
+    assert 'cursor' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('value', ['high', [1], {'a': 1}, True, 2 ** 64, float('nan')])
+def test_nutrient_cursor_value_must_be_a_number(value):
+    from foods import InvalidQuery, decode_cursor, parse_view
+
+    view = parse_view({'sort': 'calories'})
+    cursor = raw_cursor([value, 1, 'calories:desc'])
+    with pytest.raises(InvalidQuery):
+        decode_cursor(cursor, view)
+
+
+def test_nutrient_cursor_round_trips():
+    from foods import decode_cursor, encode_cursor, parse_view
+
+    view = parse_view({'sort': 'protein', 'order': 'asc'})
+    for value in (None, 0, 12.5):
+        assert decode_cursor(encode_cursor(value, 7, view), view) == (value, 7)
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_stream_reads_in_keyset_batches(database, monkeypatch):
+    import db
+    from foods import iter_foods
+
+    add_foods(*(f"food {i}" for i in range(7)))
+    held, reads = [], []
+    acquire, release = db.ConnectionPool.acquire, db.ConnectionPool.release
+    monkeypatch.setattr(db.ConnectionPool, 'acquire', lambda self: held.append(1) or reads.append(1) or acquire(self))
+    monkeypatch.setattr(db.ConnectionPool, 'release', lambda self, conn: held.pop() and release(self, conn))
+
+    batches = iter_foods(batch_size=3)
+    assert [food['name'] for food in next(batches)] == ['food 6', 'food 5', 'food 4']
+    # Nothing is held while a batch is with the client
+    assert not held
+    rest = [food['name'] for batch in batches for food in batch]
+    assert rest == [f"food {i}" for i in range(3, -1, -1)]
+    assert not held
+    assert len(reads) == 3
+
+
+def test_stream_honours_limit_across_batches(database):
+    from foods import iter_foods
+
+    add_foods(*(f"food {i}" for i in range(7)))
+    assert [len(batch) for batch in iter_foods(limit=5, batch_size=2)] == [2, 2, 1]
+
+
+@pytest.mark.parametrize('limit', ['99999999999999999999999', str(2 ** 63), '0', 'ten'])
+def test_stream_rejects_bad_limits_before_streaming(client, limit):
+    response = client.get(f"/api/foods?stream=1&limit={limit}")
+    assert response.status_code == 400
+    assert response.mimetype == 'application/json'
+
+
+def test_stream_lists_every_row(client):
+    add_foods(*(f"food {i}" for i in range(3)))
+    response = client.get('/api/foods?stream=1')
+    assert response.mimetype == 'application/x-ndjson'
+    assert [food['name'] for food in ndjson(response)] == ['food 2', 'food 1', 'food 0']
+
+
+@pytest.mark.parametrize('keyset, keyset_params', [(None, ()), ('AFTER_VALUE', (300, 5)), ('WITHIN_NULLS', (5,))])
+@pytest.mark.parametrize('args', [
+    {'sort': 'calories', 'order': 'asc', 'min_calories': '200', 'max_calories': '800'},
+    {'sort': 'calories', 'from': '2024-01-01'},
+    {'sort': 'protein', 'min_protein': '10'},
+])
+def test_nutrient_listings_read_only_the_index(database, args, keyset, keyset_params):
+    import foods
+    from migrations import explain
+
+    view = foods.parse_view(args)
+    columns = ('id', 'name', 'timestamp', view.sort, 'fat')
+    sql, params = foods.page_query(view, columns, keyset and getattr(foods, keyset))
+    plan = explain(sql, params + keyset_params + (50,))
+    # One index walk, no table lookups and no sort
+    assert len(plan) == 1
+    assert f"USING COVERING INDEX idx_food_items_{view.sort}" in plan[0]
+
+
+def list_all(client, query, limit=2):
+    names, cursor = [], None
+    while True:
+        url = f"/api/foods?{query}&limit={limit}" + (f"&cursor={cursor}" if cursor else '')
+        response = client.get(url)
+        assert response.status_code == 200
+        names += [food['name'] for food in response.get_json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            return names
+
+
+@pytest.fixture
+def foods_with_nulls(database):
+    for name, calories in (('a', 100), ('b', None), ('c', 300), ('d', None), ('e', 200)):
+        add_foods(name, calories=calories)
+
+
+@pytest.mark.parametrize('order, expected', [
+    # SQLite sorts NULL first: the tail of a descending listing, the head of
+    # an ascending one, by id in the listing's direction
+    ('desc', ['c', 'e', 'a', 'd', 'b']),
+    ('asc', ['b', 'd', 'a', 'e', 'c']),
+])
+@pytest.mark.parametrize('limit', [1, 2, 3])
+def test_sorted_pages_reach_the_null_rows(client, foods_with_nulls, order, expected, limit):
+    assert list_all(client, f"sort=calories&order={order}", limit) == expected
+
+
+def test_filters_drop_null_rows(client, foods_with_nulls):
+    assert list_all(client, "sort=calories&order=asc&min_calories=150") == ['e', 'c']
+    assert list_all(client, "sort=calories&max_calories=250") == ['e', 'a']
+
+
+@pytest.mark.parametrize('other', ['sort=calories&order=asc', 'sort=protein', ''])
+def test_cursor_is_rejected_when_the_sort_changes(client, foods_with_nulls, other):
+    cursor = client.get('/api/foods?sort=calories&order=desc&limit=2').headers['X-Next-Cursor']
+    response = client.get(f"/api/foods?{other}&cursor={cursor}")
+    assert response.status_code == 400
+    assert 'different sort' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('query', [
+    'min_calories=lots',
+    'min_calories=inf',
+    'min_calories=500&max_calories=100',
+    'min_sugar=1',
+    'sort=sugar',
+    'order=sideways',
+])
+def test_invalid_filters_are_a_400(client, query):
+    response = client.get(f"/api/foods?{query}")
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
@@ -0,0 +1,77 @@
+import json
+
+from conftest import add_foods
+
+
+def meal_rows(conn):
+    return conn.execute("SELECT food_id, meal_type FROM meal_logs ORDER BY id").fetchall()
+
+
+def test_meals_reference_foods_by_key(client):
+    foods = client.post('/api/foods/bulk', json=[{'name': 'apple', 'calories': 95, 'idempotency_key': 'apple'}])
+    assert foods.get_json()['inserted'] == 1
+    report = client.post('/api/meals/bulk', json=[
+        {'food_key': 'apple', 'meal_type': 'Lunch'},
+        {'food_key': 'ghost', 'meal_type': 'Lunch'},
+        {'food_id': 999, 'meal_type': 'Dinner'},
+    ]).get_json()
+    assert report['inserted'] == 1
+    assert report['rejected'] == 2
+    assert report['errors'] == [{'row': 2, 'error': 'food not found'},
+                                {'row': 3, 'error': 'food not found'}]
+
+    from db import connection
+    with connection() as conn:
+        assert meal_rows(conn) == [(1, 'Lunch')]
+    assert client.get('/api/charts').get_json()['meal_calories'][1] == 95
+
+
+def test_unknown_food_keys_alone_insert_nothing(client):
+    report = client.post('/api/meals/bulk', json=[{'food_key': 'ghost', 'meal_type': 'Lunch'}]).get_json()
+    assert (report['inserted'], report['duplicates'], report['rejected']) == (0, 0, 1)
+
+    from db import connection
+    with connection() as conn:
+        assert meal_rows(conn) == []
+        assert conn.execute("SELECT COUNT(*) FROM meal_totals WHERE log_count > 0").fetchone()[0] == 0
+
+
+def test_replaying_a_request_inserts_nothing_twice(client):
+    add_foods('apple')
+    rows = [{'food_id': 1, 'meal_type': 'Breakfast'}, {'food_id': 1, 'meal_type': 'Snacks'}]
+    headers = {'Idempotency-Key': 'backfill-1'}
+    first = client.post('/api/meals/bulk', json=rows, headers=headers).get_json()
+    replay = client.post('/api/meals/bulk', json=rows, headers=headers).get_json()
+    assert (first['inserted'], first['duplicates']) == (2, 0)
+    assert (replay['inserted'], replay['duplicates']) == (0, 2)
+    # Without the key the same rows are new ones
+    again = client.post('/api/meals/bulk', json=rows).get_json()
+    assert again['inserted'] == 2
+
+
+def test_ndjson_bodies_report_bad_lines(client):
+    body = '\n'.join([
+        json.dumps({'name': 'apple', 'calories': 95}),
+        '{not json',
+        '',
+        json.dumps({'name': 'pear', 'calories': -1}),
+        json.dumps({'name': 'plum', 'calories': 30, 'idempotency_key': 'plum'}),
+    ]) + '\n'
+    report = client.post('/api/foods/bulk', data=body, content_type='application/x-ndjson').get_json()
+    assert (report['received'], report['inserted'], report['rejected']) == (4, 2, 2)
+    assert report['errors'] == [
+        {'row': 2, 'error': 'invalid JSON'},
+        {'row': 4, 'error': 'calories must be a non-negative finite number'},
+    ]
+    assert client.get('/api/stats').get_json()['total_calories'] == 125
+
+
+def test_small_batches_reject_only_the_bad_row(database):
+    from ingest import ingest
+
+    add_foods('apple')
+    records = enumerate([{'food_id': 1, 'meal_type': 'Lunch'}, {'food_id': 7, 'meal_type': 'Lunch'},
+                         {'food_key': 'ghost', 'meal_type': 'Lunch'}, {'food_id': 1, 'meal_type': 'Dinner'}],
+                        start=1)
+    report = ingest('meals', records, batch_size=2)
+    assert (report['inserted'], report['rejected'], report['duplicates']) == (2, 2, 0)
@@ -0,0 +1,56 @@
+import pytest
+
+from conftest import FakeSocketIO, add_foods, wait_for
+
+
+@pytest.fixture
+def materializer(database):
+    from materializer import Materializer
+
+    materializer = Materializer(FakeSocketIO(), interval=0.01, debounce=0.01)
+    yield materializer
+    materializer.stop(timeout=2)
+
+
+def test_writes_reach_the_materialized_dashboard(materializer):
+    first = materializer.get(None)
+    assert first.document['stats']['total_items'] == 0
+
+    materializer.start()
+    add_foods('apple', 'pear')
+    wait_for(lambda: materializer.get(None).generation != first.generation)
+    dashboard = materializer.get(None)
+    assert dashboard.document['stats']['total_items'] == 2
+    assert sorted(food['name'] for food in dashboard.document['foods']) == ['apple', 'pear']
+
+
+def test_get_does_not_start_the_refresher(materializer):
+    materializer.get(None)
+    assert materializer._task is None
+
+
+def test_stop_ends_the_refresher(materializer):
+    materializer.start()
+    task = materializer._task
+    materializer.stop(timeout=2)
+    assert not task.is_alive()
+
+
+def test_a_dashboard_reads_one_generation(database, monkeypatch):
+    import materializer
+    from generation import current_generation
+    from snapshot import compute_snapshot
+
+    add_foods('apple')
+
+    def write_then_compute(conn):
+        # Commits on another connection in the middle of the build
+        add_foods('pear')
+        return compute_snapshot(conn)
+
+    monkeypatch.setattr(materializer, 'compute_snapshot', write_then_compute)
+    dashboard = materializer.build_dashboard(None)
+    assert dashboard.document['stats']['total_items'] == 1
+    assert [food['name'] for food in dashboard.document['foods']] == ['apple']
+    # Labelled with the generation it shows, so the refresher rebuilds it
+    assert dashboard.generation < current_generation()
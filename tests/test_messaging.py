@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from messaging import FileBus, decode_message, encode_message
+
+
+class Drained(Exception):
+    pass
+
+
+def drained(_seconds):
+    # listen() sleeps when it reaches the end of the file
+    raise Drained
+
+
+def read_all(bus):
+    messages = []
+    with pytest.raises(Drained):
+        for message in bus.listen(drained):
+            messages.append(message)
+    return messages
+
+
+def test_binary_values_survive_encoding():
+    message = {'data': [b'\x00\x01\xff', {'nested': bytearray(b'abc')}], 'room': 'r'}
+    assert decode_message(encode_message(message)) == {
+        'data': [b'\x00\x01\xff', {'nested': b'abc'}], 'room': 'r'}
+
+
+def test_file_bus_delivers_messages_in_order(tmp_path):
+    bus = FileBus(str(tmp_path))
+    bus.publish({'type': 'a'})
+    bus.publish({'type': 'b'})
+    assert read_all(bus) == [{'type': 'a'}, {'type': 'b'}]
+
+
+def test_msgpack_emit_through_the_file_queue(tmp_path):
+    pytest.importorskip('socketio')
+    pytest.importorskip('msgpack')
+    from messaging import _file_manager_class
+    from payloads import decode_payload, encode_payload
+
+    payload = {'type': 'delta', 'cursor': 3,
+               'upserted': [{'id': i, 'name': f"food {i}", 'calories': 100} for i in range(50)]}
+    frame = encode_payload(payload, 'msgpack')
+    assert isinstance(frame, bytes)
+
+    manager = _file_manager_class()(str(tmp_path))
+    manager.emit('update_data', frame, room='user:1#msgpack')
+
+    [message] = read_all(manager.bus)
+    assert message['event'] == 'update_data'
+    assert message['room'] == 'user:1#msgpack'
+    assert message['data'] == frame
+    assert decode_payload(message['data']) == payload
+
+
+def test_file_bus_follows_rotated_segments(tmp_path, monkeypatch):
+    import messaging
+    monkeypatch.setattr(messaging, 'ROTATE_GRACE', 0)
+    writer = FileBus(str(tmp_path), segment_bytes=64)
+    reader = FileBus(str(tmp_path), segment_bytes=64)
+    for i in range(20):
+        writer.publish({'type': 'changed', 'n': i})
+    assert len(writer._segments()) > 2
+    assert [m['n'] for m in read_all(reader)] == list(range(20))
+
+
+def test_file_bus_deletes_old_segments(tmp_path):
+    bus = FileBus(str(tmp_path), segment_bytes=64, retention=0)
+    for i in range(100):
+        bus.publish({'type': 'changed', 'n': i})
+    assert len(bus._segments()) <= 3
+
+
+def test_message_bus_is_abstract():
+    from messaging import MessageBus
+    with pytest.raises(TypeError):
+        MessageBus()
+
+
+def test_close_stops_the_listener(tmp_path):
+    bus = FileBus(str(tmp_path))
+    received = []
+    bus.subscribe(received.append)
+    threads = []
+
+    def spawn(target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    bus.start(spawn, time.sleep)
+    bus.publish({'type': 'changed', 'n': 1})
+    deadline = time.monotonic() + 5
+    while not received and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert received == [{'type': 'changed', 'n': 1}]
+
+    segment = bus._file
+    bus.close()
+    assert segment.closed
+    [thread] = threads
+    thread.join(2)
+    assert not thread.is_alive()
@@ -0,0 +1,88 @@
+import re
+
+import pytest
+
+from conftest import add_foods
+
+
+def test_histogram_buckets_are_cumulative():
+    from metrics import Registry
+
+    registry = Registry()
+    latency = registry.histogram('test_latency_seconds', "Latency", ['route'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, route='/a')
+    assert registry.render().splitlines() == [
+        '# HELP test_latency_seconds Latency',
+        '# TYPE test_latency_seconds histogram',
+        'test_latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'test_latency_seconds_bucket{route="/a",le="1"} 3',
+        'test_latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'test_latency_seconds_sum{route="/a"} 3.65',
+        'test_latency_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_counters_and_gauges_render():
+    from metrics import Registry
+
+    registry = Registry()
+    registry.counter('test_requests', "Requests", ['status']).inc(2, status='200')
+    registry.gauge('test_open', "Open").set_function(lambda: 3)
+    assert registry.render().splitlines() == [
+        '# HELP test_requests_total Requests',
+        '# TYPE test_requests_total counter',
+        'test_requests_total{status="200"} 2',
+        '# HELP test_open Open',
+        '# TYPE test_open gauge',
+        'test_open 3',
+    ]
+
+
+def test_labels_must_match():
+    from metrics import Registry
+
+    counter = Registry().counter('test_requests', "Requests", ['status'])
+    with pytest.raises(ValueError):
+        counter.inc(route='/')
+
+
+def test_metric_base_is_abstract():
+    from metrics import _Metric
+
+    with pytest.raises(TypeError):
+        _Metric('test_metric', "Metric")
+
+
+@pytest.mark.parametrize('sql, label', [
+    ("SELECT name FROM food_items WHERE id = ?", 'select food_items'),
+    ("WITH recent AS (SELECT id FROM meal_logs) SELECT * FROM recent", 'select meal_logs'),
+    ("INSERT OR IGNORE INTO meal_logs (food_id) VALUES (?)", 'insert meal_logs'),
+    ("UPDATE OR IGNORE food_items SET name = 'x'", 'update food_items'),
+    ("DELETE FROM idempotency_keys WHERE created_at < ?", 'delete idempotency_keys'),
+    ("ALTER TABLE data_generation ADD COLUMN changed_at TEXT", 'ddl'),
+    ("CREATE INDEX idx_x ON food_items (name)", 'ddl'),
+    ("PRAGMA user_version = 3", 'pragma'),
+    ("BEGIN IMMEDIATE", 'transaction'),
+])
+def test_statements_are_labelled_by_fingerprint(sql, label):
+    from db import query_fingerprint
+
+    assert query_fingerprint(sql) == label
+
+
+def test_metrics_labels_carry_no_statement_text(client, app_module):
+    add_foods('apple')
+    client.get('/api/foods?limit=5')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    assert re.search(r'^nutrilens_http_requests_total\{route="/api/foods",method="GET",status="200"\} \d+$',
+                     body, re.MULTILINE)
+    queries = set(re.findall(r'query="([^"]*)"', body))
+    assert queries
+    named = set(app_module.DASHBOARD_QUERIES)
+    for label in queries - named:
+        assert re.fullmatch(r'(select|insert|update|delete|replace)( \w+)?|ddl|pragma|transaction|maintenance|other',
+                            label), label
@@ -0,0 +1,54 @@
+import logging
+
+import pytest
+
+
+def test_migrating_again_applies_nothing(database):
+    import db
+    import migrations
+
+    assert migrations.migrate() == []
+    assert db.query_one("PRAGMA user_version")[0] == migrations.LATEST_VERSION
+
+
+def test_migrations_resume_from_the_stored_version(tmp_path, database):
+    import db
+    import migrations
+
+    db.configure(str(tmp_path / 'old.db'))
+    assert migrations.migrate(target=3) == [1, 2, 3]
+    assert db.query_one("PRAGMA user_version")[0] == 3
+    assert migrations.migrate() == list(range(4, migrations.LATEST_VERSION + 1))
+
+
+def test_a_failing_migration_leaves_nothing_behind(monkeypatch, database):
+    import db
+    import migrations
+
+    broken = migrations.Migration(migrations.LATEST_VERSION + 1, "broken", [
+        "CREATE TABLE half_done (id INTEGER)",
+        "SELECT missing FROM half_done",
+    ])
+    monkeypatch.setattr(migrations, 'MIGRATIONS', list(migrations.MIGRATIONS) + [broken])
+    with pytest.raises(Exception, match='missing'):
+        migrations.migrate(target=broken.version)
+    assert db.query_one("PRAGMA user_version")[0] == migrations.LATEST_VERSION
+    assert db.query_one("SELECT COUNT(*) FROM sqlite_master WHERE name = 'half_done'")[0] == 0
+
+
+def test_dashboard_queries_all_use_indexes(app_module, caplog):
+    from migrations import check_query_plans
+
+    with caplog.at_level(logging.INFO, logger='migrations'):
+        assert check_query_plans(app_module.DASHBOARD_QUERIES) == []
+    assert not [r for r in caplog.records if r.levelno >= logging.WARNING]
+    assert len([r for r in caplog.records if 'Query plan for' in r.getMessage()]) == len(app_module.DASHBOARD_QUERIES)
+
+
+def test_plan_check_flags_a_table_scan(database, caplog):
+    from migrations import check_query_plans
+
+    queries = {'by_benefits': ("SELECT id FROM food_items WHERE benefits = ?", ('crunchy',))}
+    with caplog.at_level(logging.WARNING, logger='migrations'):
+        assert check_query_plans(queries) == ['by_benefits']
+    assert 'by_benefits does not use an index' in caplog.text
@@ -0,0 +1,101 @@
+import sqlite3
+
+import pytest
+
+from conftest import add_foods
+
+
+def count_foods(version):
+    with version.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM food_items").fetchone()[0]
+
+
+def test_copy_is_a_read_only_image(database):
+    from generation import current_generation
+    from replica import copy_database
+
+    add_foods('apple')
+    version = copy_database(database)
+    try:
+        assert version.generation == current_generation()
+        add_foods('pear')
+        assert count_foods(version) == 1
+        with version.connection() as conn, pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM food_items")
+    finally:
+        version.close()
+
+
+def test_pin_waits_for_the_first_copy(database):
+    from replica import ReadReplica
+
+    replica = ReadReplica(database)
+    assert replica.pin() is None
+    version = replica.refresh()
+    assert replica.pin() is version
+    assert version.refs == 1
+    replica.unpin(version)
+    assert version.refs == 0
+    replica.stop()
+
+
+def test_retired_version_lives_until_unpinned(database):
+    from replica import ReadReplica
+
+    add_foods('apple')
+    replica = ReadReplica(database)
+    replica.refresh()
+    old = replica.pin()
+
+    add_foods('pear')
+    new = replica.refresh()
+    assert new is not old and old.retired and not old.closed
+    # The pinned request keeps reading the image it started with
+    assert count_foods(old) == 1
+    assert count_foods(new) == 2
+    assert replica.pin() is new
+
+    replica.unpin(old)
+    assert old.closed
+    replica.unpin(new)
+    replica.stop()
+    assert new.retired and new.closed
+
+
+def test_unpinned_version_closes_on_refresh(database):
+    from replica import ReadReplica
+
+    replica = ReadReplica(database)
+    old = replica.refresh()
+    replica.refresh()
+    assert old.retired and old.closed
+    replica.stop()
+
+
+def test_refresh_after_stop_discards_the_copy(database):
+    from replica import ReadReplica
+
+    replica = ReadReplica(database)
+    replica.stop()
+    assert replica.refresh() is None
+    assert replica.pin() is None
+
+
+def test_views_read_the_pinned_replica(database, client, monkeypatch):
+    import replica
+
+    monkeypatch.setattr(replica, 'REPLICA_ENABLED', True)
+    monkeypatch.setattr(replica, 'replica_for', lambda path: reader)
+    add_foods('apple')
+    reader = replica.ReadReplica(database)
+    version = reader.refresh()
+
+    # Writes after the copy stay invisible until the next refresh
+    add_foods('pear')
+    assert client.get('/api/stats').get_json()['total_items'] == 1
+    assert version.refs == 0
+
+    reader.refresh()
+    assert version.closed
+    assert client.get('/api/stats').get_json()['total_items'] == 2
+    reader.stop()
@@ -0,0 +1,171 @@
+import random
+
+import pytest
+
+from conftest import add_foods
+
+MEAL_TYPES = ('Breakfast', 'Lunch', 'Dinner', 'Snacks')
+
+# Rows the triggers emptied stay behind at zero; a rebuild leaves them out
+TOTALS_QUERIES = (
+    "SELECT * FROM nutrition_totals",
+    "SELECT * FROM meal_totals WHERE log_count > 0 ORDER BY meal_type",
+)
+
+BUCKET_QUERIES = (
+    "SELECT * FROM nutrition_buckets WHERE item_count > 0 ORDER BY bucket, bucket_start",
+    "SELECT * FROM meal_buckets WHERE log_count > 0 ORDER BY bucket, bucket_start, meal_type",
+)
+
+
+def rollup_state(conn, queries):
+    return [[tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+             for row in conn.execute(sql)] for sql in queries]
+
+
+def maintained_and_rebuilt(queries, rebuild):
+    from db import transaction
+
+    with transaction() as conn:
+        maintained = rollup_state(conn, queries)
+        rebuild(conn)
+        return maintained, rollup_state(conn, queries)
+
+
+def random_timestamp(rng):
+    if rng.random() < 0.1:
+        return None
+    return f"2024-0{rng.randint(1, 3)}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"
+
+
+def random_amount(rng):
+    return None if rng.random() < 0.2 else rng.randint(0, 50)
+
+
+def apply_random_writes(rng, steps):
+    from db import transaction
+
+    with transaction() as conn:
+        for _ in range(steps):
+            foods = [row[0] for row in conn.execute("SELECT id FROM food_items")]
+            logs = [row[0] for row in conn.execute("SELECT id FROM meal_logs")]
+            op = rng.choice(['food', 'food', 'meal', 'meal', 'update_food', 'update_meal',
+                             'delete_meal', 'delete_food'])
+            if op == 'food' or not foods:
+                conn.execute(
+                    "INSERT INTO food_items (name, calories, protein, iron, calcium, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    ('food', rng.randint(0, 900), random_amount(rng), random_amount(rng),
+                     random_amount(rng), random_timestamp(rng)))
+            elif op == 'meal':
+                conn.execute("INSERT INTO meal_logs (food_id, meal_type, timestamp) VALUES (?, ?, ?)",
+                             (rng.choice(foods), rng.choice(MEAL_TYPES), random_timestamp(rng)))
+            elif op == 'update_food':
+                conn.execute("UPDATE food_items SET calories = ?, iron = ?, timestamp = ? WHERE id = ?",
+                             (rng.randint(0, 900), random_amount(rng), random_timestamp(rng),
+                              rng.choice(foods)))
+            elif op == 'update_meal' and logs:
+                conn.execute("UPDATE meal_logs SET food_id = ?, meal_type = ?, timestamp = ? WHERE id = ?",
+                             (rng.choice(foods), rng.choice(MEAL_TYPES), random_timestamp(rng),
+                              rng.choice(logs)))
+            elif op == 'delete_meal' and logs:
+                conn.execute("DELETE FROM meal_logs WHERE id = ?", (rng.choice(logs),))
+            elif op == 'delete_food':
+                food_id = rng.choice(foods)
+                conn.execute("DELETE FROM meal_logs WHERE food_id = ?", (food_id,))
+                conn.execute("DELETE FROM food_items WHERE id = ?", (food_id,))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_totals_triggers_match_a_rebuild(database, seed):
+    from rollups import rebuild_rollups
+
+    rng = random.Random(seed)
+    for _ in range(4):
+        apply_random_writes(rng, 50)
+        maintained, rebuilt = maintained_and_rebuilt(TOTALS_QUERIES, rebuild_rollups)
+        assert maintained == rebuilt
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bucket_triggers_match_a_rebuild(database, seed):
+    from rollups import rebuild_bucket_rollups
+
+    rng = random.Random(seed)
+    for _ in range(4):
+        apply_random_writes(rng, 50)
+        maintained, rebuilt = maintained_and_rebuilt(BUCKET_QUERIES, rebuild_bucket_rollups)
+        assert maintained == rebuilt
+
+
+def test_ingest_updates_the_rollups(database):
+    from rollups import rebuild_rollups
+    from snapshot import compute_snapshot
+
+    add_foods('apple', 'pear', calories=120, protein=2)
+    stats = compute_snapshot().stats()
+    assert stats['total_items'] == 2
+    assert stats['total_calories'] == 240
+    maintained, rebuilt = maintained_and_rebuilt(TOTALS_QUERIES, rebuild_rollups)
+    assert maintained == rebuilt
+
+
+@pytest.fixture
+def week_of_foods(database):
+    # 2024-01-01 is a Monday
+    for timestamp, calories in (('2024-01-01T10:00:00', 100), ('2024-01-03T09:00:00', 200),
+                                ('2024-01-07T20:00:00', 400), ('2024-01-08T08:00:00', 800)):
+        add_foods(timestamp, calories=calories, timestamp=timestamp)
+
+
+def range_stats(client, query):
+    response = client.get(f"/api/stats?{query}")
+    assert response.status_code == 200
+    stats = response.get_json()
+    return stats['total_items'], stats['total_calories']
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('from=2024-01-01&to=2024-01-08&bucket=day', (3, 700)),
+    ('from=2024-01-03&bucket=day', (3, 1400)),
+    ('to=2024-01-03', (1, 100)),
+    # to is rounded up to the end of its bucket
+    ('from=2024-01-01&to=2024-01-03T12:00:00&bucket=day', (2, 300)),
+    ('from=2024-01-01&to=2024-01-03T12:00:00&bucket=week', (3, 700)),
+    ('from=2024-01-03T09:30:00&to=2024-01-03T09:30:00Z&bucket=hour', None),
+    ('from=2024-01-01&to=2024-01-03T09:00:00&bucket=hour', (1, 100)),
+    ('from=2024-01-01&to=2024-01-03T09:30:00&bucket=hour', (2, 300)),
+    # from is rounded down to the start of its bucket
+    ('from=2024-01-03T23:00:00&to=2024-01-04&bucket=day', (1, 200)),
+    ('from=2024-01-05&to=2024-01-09&bucket=week', (4, 1500)),
+])
+def test_stats_over_a_date_range(client, week_of_foods, query, expected):
+    if expected is None:
+        assert client.get(f"/api/stats?{query}").status_code == 400
+    else:
+        assert range_stats(client, query) == expected
+
+
+@pytest.mark.parametrize('query', [
+    'bucket=month',
+    'from=2024-01-02&to=2024-01-01',
+    'from=yesterday',
+])
+def test_invalid_ranges_are_rejected(client, query):
+    response = client.get(f"/api/stats?{query}")
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_charts_series_per_bucket(client, week_of_foods):
+    charts = client.get('/api/charts?from=2024-01-01&to=2024-01-08&bucket=day').get_json()
+    assert set(charts) == {'macronutrients', 'meal_calories', 'minerals', 'series'}
+    series = charts['series']
+    assert [point['start'] for point in series] == [
+        '2024-01-01 00:00:00', '2024-01-03 00:00:00', '2024-01-07 00:00:00']
+    assert [point['calories'] for point in series] == [100, 200, 400]
+    assert set(series[0]) == {'start', 'total_items', 'calories', 'protein', 'carbs', 'fat', 'fiber'}
+
+    weekly = client.get('/api/charts?bucket=week').get_json()['series']
+    assert [(point['start'], point['total_items']) for point in weekly] == [
+        ('2024-01-01 00:00:00', 3), ('2024-01-08 00:00:00', 1)]
@@ -0,0 +1,41 @@
+import pytest
+
+from conftest import add_foods
+
+
+@pytest.fixture
+def search(database):
+    from search import search_foods
+    return search_foods
+
+
+def test_name_match_ranks_first(search):
+    add_foods('Rice Cake', benefits='goes well with chicken')
+    add_foods('Chicken Rice Bowl')
+    results = search('chicken')
+    assert [r['name'] for r in results] == ['Chicken Rice Bowl', 'Rice Cake']
+    assert results[0]['name_highlight'] == '<mark>Chicken</mark> Rice Bowl'
+
+
+def test_highlights_escape_the_food_text(search):
+    add_foods('<img src=x onerror=alert(1)> apple & pear')
+    add_foods('<i>Crunchy</i>', benefits='<b>crisp</b> apple')
+    results = {r['id']: r for r in search('apple')}
+    assert results[1]['name_highlight'] == '&lt;img src=x onerror=alert(1)&gt; <mark>apple</mark> &amp; pear'
+    assert results[2]['name_highlight'] == '&lt;i&gt;Crunchy&lt;/i&gt;'
+    assert results[2]['snippet'] == '&lt;b&gt;crisp&lt;/b&gt; <mark>apple</mark>'
+
+
+def test_unranked_results_are_newest_first(search, monkeypatch):
+    import search as search_module
+
+    monkeypatch.setattr(search_module, 'MAX_RANKED_MATCHES', 0)
+    # Inserted out of timestamp order, so rowid order would differ
+    add_foods('Apple Old', timestamp='2024-01-01T00:00:00')
+    add_foods('Apple New', timestamp='2024-03-01T00:00:00')
+    add_foods('Pie', benefits='apple filling', timestamp='2024-04-01T00:00:00')
+    add_foods('Apple Mid', timestamp='2024-02-01T00:00:00')
+    results = search('apple')
+    assert [r['name'] for r in results] == ['Apple New', 'Apple Mid', 'Apple Old', 'Pie']
+    assert all(r['score'] is None for r in results)
+    assert [r['name'] for r in search('apple', 2)] == ['Apple New', 'Apple Mid']
@@ -0,0 +1,54 @@
+import pytest
+
+FOODS = [
+    {'name': 'apple', 'calories': 100, 'protein': 10, 'carbs': 20, 'fat': 10, 'fiber': 2,
+     'iron': 18, 'calcium': 500},
+    {'name': 'bread', 'calories': 200, 'protein': 30, 'carbs': 40, 'fat': 30, 'fiber': 4,
+     'iron': 9},
+]
+
+MEALS = [
+    {'food_id': 1, 'meal_type': 'Breakfast'},
+    {'food_id': 2, 'meal_type': 'Dinner'},
+    {'food_id': 2, 'meal_type': 'Dinner'},
+]
+
+
+@pytest.fixture
+def logged(client):
+    assert client.post('/api/foods/bulk', json=FOODS).get_json()['inserted'] == 2
+    assert client.post('/api/meals/bulk', json=MEALS).get_json()['inserted'] == 3
+    return client
+
+
+def test_an_empty_database_has_zero_aggregates(client):
+    assert client.get('/api/stats').get_json() == {
+        'total_items': 0, 'total_calories': 0, 'total_protein': 0,
+        'total_carbs': 0, 'total_fat': 0, 'total_fiber': 0,
+    }
+    assert client.get('/api/charts').get_json() == {
+        'macronutrients': [0, 0, 0], 'meal_calories': [0, 0, 0, 0], 'minerals': [0, 0, 0, 0, 0],
+    }
+
+
+def test_stats_total_every_food(logged):
+    assert logged.get('/api/stats').get_json() == {
+        'total_items': 2, 'total_calories': 300, 'total_protein': 40,
+        'total_carbs': 60, 'total_fat': 40, 'total_fiber': 6,
+    }
+
+
+def test_charts_split_macros_meals_and_minerals(logged):
+    charts = logged.get('/api/charts').get_json()
+    assert charts['macronutrients'] == pytest.approx([40 / 140 * 100, 60 / 140 * 100, 40 / 140 * 100])
+    assert charts['meal_calories'] == [100, 0, 400, 0]
+    # Averages skip foods with no value, then scale by the daily value
+    assert charts['minerals'] == pytest.approx([75, 50, 0, 0, 0])
+
+
+def test_refresh_sends_the_same_snapshot(logged, socket_client):
+    socket_client.emit('refresh_data')
+    [message] = [m for m in socket_client.get_received() if m['name'] == 'update_data']
+    payload = message['args'][0]
+    assert payload['stats'] == logged.get('/api/stats').get_json()
+    assert payload['charts'] == logged.get('/api/charts').get_json()
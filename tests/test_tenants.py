@@ -0,0 +1,101 @@
+import os
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def user_dir(database, tmp_path, monkeypatch):
+    import db
+    import tenants
+
+    directory = tmp_path / 'users'
+    monkeypatch.setattr(db, 'USER_DB_DIR', str(directory))
+    monkeypatch.setattr(tenants, '_migrated', type(tenants._migrated)())
+    return directory
+
+
+def test_reads_do_not_create_users(client, user_dir):
+    response = client.get('/api/stats?user=ghost')
+    assert response.status_code == 404
+    assert client.get('/api/foods', headers={'X-NutriLens-User': 'ghost'}).status_code == 404
+    assert not (user_dir / 'ghost.db').exists()
+
+
+def test_a_write_creates_the_user(client, user_dir):
+    response = client.post('/api/foods/bulk?user=alice', json=[{'name': 'apple', 'calories': 95}])
+    assert response.status_code == 200
+    assert (user_dir / 'alice.db').exists()
+    assert client.get('/api/stats?user=alice').get_json()['total_items'] == 1
+    # The shared database is untouched
+    assert client.get('/api/stats').get_json()['total_items'] == 0
+
+
+def test_sockets_cannot_create_users(app_module, client, user_dir):
+    socket = app_module.socketio.test_client(app_module.app, flask_test_client=client, auth={'user': 'ghost'})
+    assert not socket.is_connected()
+    assert not (user_dir / 'ghost.db').exists()
+
+
+def test_migrations_lock_per_user(user_dir, monkeypatch):
+    import tenants
+    from db import current_user
+
+    started, release = threading.Event(), threading.Event()
+    migrate = tenants.migrate
+
+    def slow_migrate():
+        if current_user() == 'slow':
+            started.set()
+            release.wait(5)
+        return migrate()
+
+    monkeypatch.setattr(tenants, 'migrate', slow_migrate)
+    slow = threading.Thread(target=tenants.prepare_user, args=('slow', True))
+    slow.start()
+    try:
+        assert started.wait(5)
+        # Another user's first use doesn't queue behind it
+        tenants.prepare_user('fast', create=True)
+        assert os.path.exists(user_dir / 'fast.db')
+        assert slow.is_alive()
+    finally:
+        release.set()
+        slow.join()
+    assert list(tenants._migrated) == ['fast', 'slow']
+    assert not tenants._migrating
+
+
+def test_migrated_users_are_bounded(user_dir, monkeypatch):
+    import tenants
+
+    monkeypatch.setattr(tenants, 'MAX_OPEN_SHARDS', 2)
+    for user_id in ('a', 'b', 'c'):
+        tenants.prepare_user(user_id, create=True)
+    assert list(tenants._migrated) == ['b', 'c']
+
+
+def test_idle_tenants_are_evicted():
+    from tenants import Tenants
+
+    registry = Tenants(max_tenants=2)
+    connected = registry.connect('sid', 'a')
+    registry.get('b')
+    registry.get('c')
+    registry.get('d')
+    assert registry.get('a') is connected
+    assert set(registry._tenants) == {'a', 'd'}
+
+
+def test_response_cache_forgets_scopes_without_entries():
+    # cache.py imports flask
+    pytest.importorskip('flask')
+    from cache import CachedResponse, ResponseCache
+
+    cache = ResponseCache(max_entries=2)
+    for scope in ('a', 'b', 'c'):
+        cache.put(1, '/api/stats', CachedResponse(b'{}', 200, 'application/json', []), scope)
+    assert cache.get(1, '/api/stats', 'z') is None
+    assert cache.stats()['scopes'] == 2
+    cache.invalidate('c')
+    assert cache.stats()['scopes'] == 1
@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+
+import pytest
+
+
+class RecordingExecutor:
+    """
+    Wraps the real executor and counts the calls routed through it.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.calls = 0
+
+    def run(self, fn, *args, **kwargs):
+        self.calls += 1
+        return self.executor.run(fn, *args, **kwargs)
+
+
+def test_calls_carry_the_callers_user(database):
+    import db
+    from workers import run_blocking
+
+    token = db.set_current_user('alice')
+    try:
+        assert run_blocking(db.current_user) == 'alice'
+    finally:
+        db.reset_current_user(token)
+    assert run_blocking(db.current_user) is None
+
+
+def test_threading_mode_caps_concurrent_calls():
+    from workers import BlockingExecutor
+
+    executor = BlockingExecutor('threading', workers=2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def work():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+
+    threads = [threading.Thread(target=executor.run, args=(work,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(peak) == 6
+    assert max(peak) == 2
+
+
+def test_unknown_async_mode_is_rejected():
+    from workers import patch_for_async_mode
+
+    with pytest.raises(RuntimeError, match='NUTRILENS_ASYNC_MODE'):
+        patch_for_async_mode('tornado')
+
+
+def test_streamed_listing_runs_on_the_executor_as_its_user(client, monkeypatch):
+    import workers
+
+    client.post('/api/foods/bulk?user=alice', json=[{'name': 'apple', 'calories': 95}])
+    client.post('/api/foods/bulk', json=[{'name': 'bread', 'calories': 200}])
+    recording = RecordingExecutor(workers.get_executor())
+    monkeypatch.setattr(workers, '_executor', recording)
+
+    response = client.get('/api/foods?stream=1&user=alice')
+    assert response.status_code == 200
+    # The body is read after the request's user scope has closed
+    assert [json.loads(line)['name'] for line in response.get_data(as_text=True).splitlines()] == ['apple']
+    # One step per batch plus the final StopIteration, and close()
+    assert recording.calls >= 2